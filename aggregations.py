@@ -0,0 +1,386 @@
+import heapq
+from datetime import datetime
+
+### ---- AGGREGATE SPECS ---- ###
+
+# Base aggregate spec
+class Aggregate:
+    """A named metric folded over a list of records, optionally grouped by `key`.
+
+    `value(record)` extracts what is folded, `key(record)` the group it belongs to and
+    `where(record)` filters records out before either is called. Subclasses only define
+    how a single accumulator starts, absorbs a value and turns into a result.
+    """
+
+    def __init__(self, name, value=None, key=None, where=None):
+        self.name = name
+        self.value = value or (lambda record: record)
+        self.key = key
+        self.where = where
+
+    def initial(self):
+        raise NotImplementedError
+
+    def step(self, acc, value, position, record):
+        raise NotImplementedError
+
+    def finish(self, acc):
+        return acc
+
+# Number of records
+class Count(Aggregate):
+    def initial(self):
+        return 0
+
+    def step(self, acc, value, position, record):
+        return acc + 1
+
+# Sum of values
+class Sum(Aggregate):
+    def __init__(self, name, value=None, key=None, where=None, start=0):
+        super().__init__(name, value, key, where)
+        self.start = start
+
+    def initial(self):
+        return self.start
+
+    def step(self, acc, value, position, record):
+        return acc + value
+
+# Arithmetic mean of values
+class Mean(Aggregate):
+    def initial(self):
+        return (0, 0)
+
+    def step(self, acc, value, position, record):
+        return (acc[0] + value, acc[1] + 1)
+
+    def finish(self, acc):
+        return acc[0] / acc[1] if acc[1] else None
+
+# Record with the smallest / largest value
+class Min(Aggregate):
+    """Keeps the record with the smallest value; `keep` picks the first or last one on ties."""
+
+    def __init__(self, name, value=None, key=None, where=None, keep="first"):
+        super().__init__(name, value, key, where)
+        self.keep = keep
+
+    def initial(self):
+        return None
+
+    def better(self, value, best):
+        return value < best if self.keep == "first" else value <= best
+
+    def step(self, acc, value, position, record):
+        if acc is None or self.better(value, acc[0]):
+            return (value, record)
+        return acc
+
+    def finish(self, acc):
+        return acc[1] if acc else None
+
+class Max(Min):
+    """Keeps the record with the largest value; `keep` picks the first or last one on ties."""
+
+    def better(self, value, best):
+        return value > best if self.keep == "first" else value >= best
+
+# Last value seen (per group)
+class Last(Aggregate):
+    def initial(self):
+        return None
+
+    def step(self, acc, value, position, record):
+        return value
+
+# Distinct values, in first-seen order
+class Distinct(Aggregate):
+    def initial(self):
+        return {}
+
+    def step(self, acc, value, position, record):
+        acc.setdefault(value, None)
+        return acc
+
+    def finish(self, acc):
+        return list(acc)
+
+# Top N records by value, through a bounded heap
+class TopN(Aggregate):
+    """Keeps the `n` records with the largest value, earliest first on ties (like a stable descending sort)."""
+
+    def __init__(self, name, n, value=None, key=None, where=None):
+        super().__init__(name, value, key, where)
+        self.n = n
+
+    def initial(self):
+        return []
+
+    def step(self, acc, value, position, record):
+        item = (value, -position, record)  # -position makes earlier records win ties and keeps records out of comparisons
+        if len(acc) < self.n:
+            heapq.heappush(acc, item)
+        elif item[:2] > acc[0][:2]:
+            heapq.heapreplace(acc, item)
+        return acc
+
+    def finish(self, acc):
+        return [record for _, _, record in sorted(acc, key=lambda item: item[:2], reverse=True)]
+
+### ---- ENGINE ---- ###
+
+# Fold every spec over the records in a single pass
+def run_aggregates(records, specs):
+    """Evaluates all `specs` in one scan of `records` and returns `{spec.name: result}`.
+
+    Grouped specs return a dict of results keyed by group, in first-seen order. A spec
+    that raises on some record is dropped from the pass and its result is None, so only
+    the insights reading it come back empty.
+    """
+    states = {spec.name: {} if spec.key else spec.initial() for spec in specs}
+    active = list(specs)
+
+    for position, record in enumerate(records):
+        for spec in active:
+            try:
+                if spec.where is not None and not spec.where(record):
+                    continue
+                value = spec.value(record)
+                if spec.key is None:
+                    states[spec.name] = spec.step(states[spec.name], value, position, record)
+                else:
+                    groups = states[spec.name]
+                    group = spec.key(record)
+                    acc = groups[group] if group in groups else spec.initial()
+                    groups[group] = spec.step(acc, value, position, record)
+            except Exception as e:
+                print(f"Error in aggregate {spec.name}: {e}")
+                states[spec.name] = None
+                active = [other for other in active if other is not spec]
+
+    results = {}
+    for spec in specs:
+        state = states[spec.name]
+        if state is None:
+            results[spec.name] = None
+        elif spec.key:
+            results[spec.name] = {group: spec.finish(acc) for group, acc in state.items()}
+        else:
+            results[spec.name] = spec.finish(state)
+    return results
+
+### ---- INCREMENTAL MAINTENANCE ---- ###
+
+# Records of one group of a spec
+class GroupMembers:
+    """The `(ordinal, record)` of every member of a group by source key, its smallest ordinal and its last result."""
+
+    __slots__ = ("members", "first", "result")
+
+    def __init__(self):
+        self.members = {}
+        self.first = None
+        self.result = None
+
+# Aggregate state that absorbs add/remove deltas
+class IncrementalAggregates:
+    """Keeps the results of `specs` up to date under record deltas, without rescanning the records.
+
+    Records are added under their source key with an ordinal, any comparable value that sorts
+    them in list order. Every group keeps its members, so a delta only refolds the groups it
+    touched, in ordinal order: a Count group costs O(1), any other O(group size). Groups stay
+    in first-seen order by their smallest ordinal and are only re-sorted when a delta moves one.
+    `results()` equals run_aggregates over the records sorted by ordinal.
+    """
+
+    def __init__(self, specs, items=()):
+        self.specs = list(specs)
+        self.rebuild(items)
+
+    def rebuild(self, items):
+        """Recomputes every group from `(key, ordinal, record)` items."""
+        self.groups = {spec.name: {} for spec in self.specs}
+        self.values = {spec.name: {} for spec in self.specs}  # Group results of the last `results()`, in group order
+        self.dirty = {spec.name: set() for spec in self.specs}  # Groups whose members changed since
+        self.reorder = set()  # Specs whose group order changed since
+        self.failed = {spec.name: set() for spec in self.specs}  # Keys whose record made spec.key or spec.where raise
+        self.memberships = {}  # Key -> [(spec name, group)]
+        self.published = {}
+        for key, ordinal, record in items:
+            self.add(key, ordinal, record)
+
+    def add(self, key, ordinal, record):
+        memberships = self.memberships[key] = []
+        for spec in self.specs:
+            name = spec.name
+            try:
+                if spec.where is not None and not spec.where(record):
+                    continue
+                group = spec.key(record) if spec.key else None
+            except Exception as e:
+                print(f"Error in aggregate {name}: {e}")
+                self.failed[name].add(key)
+                continue
+
+            groups = self.groups[name]
+            state = groups.get(group)
+            if state is None:
+                last = next(reversed(groups.values()), None)
+                if (last is not None and ordinal < last.first) or group in self.values[name]:  # Not (or no longer) the last group
+                    self.reorder.add(name)
+                state = groups[group] = GroupMembers()
+            elif ordinal < state.first:
+                self.reorder.add(name)
+            if state.first is None or ordinal < state.first:
+                state.first = ordinal
+            state.members[key] = (ordinal, record)
+            self.dirty[name].add(group)
+            memberships.append((name, group))
+
+    def remove(self, key):
+        for name, keys in self.failed.items():
+            if key in keys:
+                keys.discard(key)
+                self.reorder.add(name)  # Publish the spec again
+        for name, group in self.memberships.pop(key, ()):
+            groups = self.groups[name]
+            state = groups[group]
+            ordinal, _ = state.members.pop(key)
+            if not state.members:
+                del groups[group]
+            elif ordinal == state.first:
+                state.first = min(member[0] for member in state.members.values())
+                self.reorder.add(name)
+            self.dirty[name].add(group)
+
+    def fold(self, spec, state):
+        if isinstance(spec, Count):
+            return len(state.members)
+        acc = spec.initial()
+        for position, (_, record) in enumerate(sorted(state.members.values(), key=lambda member: member[0])):
+            acc = spec.step(acc, spec.value(record), position, record)
+        return spec.finish(acc)
+
+    def results(self):
+        """Returns the `{spec.name: result}` mapping of run_aggregates; specs that raise on a record give None."""
+        for spec in self.specs:
+            name = spec.name
+            if name in self.published and not self.dirty[name] and name not in self.reorder:
+                continue
+            if self.failed[name]:
+                self.published[name] = None
+                continue
+            groups, values = self.groups[name], self.values[name]
+            try:
+                for group in self.dirty[name]:
+                    if group in groups:
+                        groups[group].result = self.fold(spec, groups[group])
+            except Exception as e:
+                print(f"Error in aggregate {name}: {e}")
+                self.published[name] = None  # The touched groups stay dirty and are tried again
+                continue
+
+            if name in self.reorder:
+                self.groups[name] = groups = dict(sorted(groups.items(), key=lambda item: item[1].first))
+                self.values[name] = values = {group: state.result for group, state in groups.items()}
+            else:
+                added = []
+                for group in self.dirty[name]:
+                    if group not in groups:
+                        values.pop(group, None)
+                    elif group in values:
+                        values[group] = groups[group].result
+                    else:
+                        added.append(group)
+                for group in sorted(added, key=lambda group: groups[group].first):  # They follow every existing group
+                    values[group] = groups[group].result
+            self.dirty[name] = set()
+            self.reorder.discard(name)
+
+            if spec.key:
+                self.published[name] = dict(values)  # Copied, later deltas change `values` in place
+            else:
+                self.published[name] = values[None] if None in values else spec.finish(spec.initial())
+        return dict(self.published)
+
+### ---- ENTITY SPECS ---- ###
+
+AGE_BUCKETS = ("0-18", "19-30", "31-45", "46-60", "61+")
+
+# Year an ISO date of birth starts with
+def birth_year(dob, current_year):
+    """Returns `current_year` for a missing or shorter date (counted as born this year) and None if it does not start with a year."""
+    dob = str(dob) if dob else ""
+    if len(dob) < 4:
+        return current_year
+    if dob[:4].isascii() and dob[:4].isdigit():
+        return int(dob[:4])
+    return None
+
+# Bucket a user's age
+def age_bucket(dob, current_year):
+    """Maps an ISO date of birth to one of AGE_BUCKETS, or None (unknown) if it has no readable year."""
+    year = birth_year(dob, current_year)
+    if year is None:
+        return None
+    age = current_year - year
+
+    if age <= 18:
+        return "0-18"
+    elif age <= 30:
+        return "19-30"
+    elif age <= 45:
+        return "31-45"
+    elif age <= 60:
+        return "46-60"
+    return "61+"
+
+# Product metrics
+def product_specs(top_rated=5):
+    """Aggregates computed over the product list."""
+    category = lambda p: p["data"].get("category", "Unknown")
+    has_category = lambda p: bool(category(p))
+    price = lambda p: p["data"].get("price", 0)
+    rating_count = lambda p: (p["data"].get("rating") or {}).get("count") or 0  # A null rating or count counts as 0
+    title = lambda p: p["data"].get("title", "Unknown")
+
+    return [
+        Sum("category_rating_count", rating_count, key=category, where=has_category),
+        Sum("category_revenue", price, key=category, where=has_category, start=0.0),
+        Mean("category_average_price", price, key=category, where=has_category),
+        Last("sales_by_title", rating_count, key=title, where=lambda p: bool(title(p))),
+        TopN("most_rated", top_rated, rating_count),
+        Min("cheapest", price),
+        Max("most_expensive", price, keep="last")
+    ]
+
+# User metrics
+def user_specs():
+    """Aggregates computed over the user list."""
+    current_year = datetime.utcnow().year
+    user_data = lambda u: u.get("data", {})
+
+    return [
+        Count("total_users"),
+        Count("gender_count", key=lambda u: user_data(u).get("gender", "Unknown")),
+        Count("age_count", key=lambda u: age_bucket(user_data(u).get("dob", ""), current_year)),
+        Distinct("user_names", lambda u: user_data(u).get("name"), where=lambda u: "name" in user_data(u))
+    ]
+
+# Transaction metrics
+def transaction_specs():
+    """Aggregates computed over the transaction list."""
+    return [
+        Count("transactions_per_user", key=lambda t: t["data"].get("user_name", "Unknown"))
+    ]
+
+# One pass per entity list
+def aggregate_products(products):
+    return run_aggregates(products, product_specs())
+
+def aggregate_users(users):
+    return run_aggregates(users, user_specs())
+
+def aggregate_transactions(transactions):
+    return run_aggregates(transactions, transaction_specs())
@@ -0,0 +1,75 @@
+import random
+
+# Shapes follow the three upstream APIs used in fetch_data.py
+CATEGORIES = ["electronics", "jewelery", "men's clothing", "women's clothing"]
+GENDERS = ["male", "female"]
+STATUSES = ["delivered", "shipped", "pending", "returned", "cancelled"]
+SENDERS = ["Realbuzz", "Skiba", "Voonyx", "Jabbertype", "Quatz", "Twinder"]
+FIRST_NAMES = ["Jhon", "Mehmet", "Lumi", "Chanakya", "Eugen", "Jason", "Paul", "Magdalena", "Elliot", "Tony"]
+LAST_NAMES = ["Doe", "Simon", "Salo", "Das", "Gautier", "Olson", "Laurent", "Tapia", "Smith", "Carpentier"]
+
+# Entity counts for a benchmark size (the size is the number of transactions)
+def entity_counts(size):
+    return {
+        "products": max(20, size // 100),
+        "users": max(20, size // 10),
+        "transactions": size
+    }
+
+# fakestoreapi.com/products
+def generate_products(count, seed=0):
+    rng = random.Random(f"products-{seed}")
+    for product_id in range(1, count + 1):
+        yield {
+            "id": product_id,
+            "title": f"Product {product_id}",
+            "price": round(rng.uniform(5, 1000), 2),
+            "description": "Synthetic product",
+            "category": rng.choice(CATEGORIES),
+            "image": f"https://fakestoreapi.com/img/{product_id}.jpg",
+            "rating": {"rate": round(rng.uniform(1, 5), 1), "count": rng.randint(0, 1000)}
+        }
+
+# One randomuser.me user; `index` is global so paging returns the same users
+def make_user(index, seed=0):
+    rng = random.Random(f"users-{seed}-{index}")
+    first, last = rng.choice(FIRST_NAMES), f"{rng.choice(LAST_NAMES)}{index}"
+    return {
+        "gender": rng.choice(GENDERS),
+        "name": {"title": "Mx", "first": first, "last": last},
+        "location": {"city": "Springfield", "state": "State", "country": "Country"},
+        "email": f"{first.lower()}.{last.lower()}@example.com",
+        "login": {"uuid": f"00000000-0000-4000-8000-{index:012d}", "username": f"user{index}", "password": "password"},
+        "dob": {"date": f"{rng.randint(1940, 2010)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T00:00:00.000Z", "age": 0},
+        "phone": f"555-{index:07d}"
+    }
+
+# randomuser.me/api/?results=N
+def generate_users(count, seed=0, start=0):
+    for index in range(start, start + count):
+        yield make_user(index, seed)
+
+# my.api.mockaroo.com/orders.json
+def generate_transactions(count, user_count, product_count, seed=0):
+    rng = random.Random(f"transactions-{seed}")
+    for transaction_id in range(1, count + 1):
+        user_index = rng.randrange(user_count)
+        user = make_user(user_index, seed)
+        yield {
+            "id": transaction_id,
+            "parcel_id": str(rng.randint(1, product_count + product_count // 10)),  # Some parcels match no product
+            "status": rng.choice(STATUSES),
+            "sender": rng.choice(SENDERS),
+            "user_phone": user["phone"],
+            "user_name": f"{user['name']['first']} {user['name']['last']}"
+        }
+
+# All three sources as lists
+def generate_dataset(size, seed=0):
+    """Returns raw `{"products", "users", "transactions"}` data for `size` transactions."""
+    counts = entity_counts(size)
+    return {
+        "products": list(generate_products(counts["products"], seed)),
+        "users": list(generate_users(counts["users"], seed)),
+        "transactions": list(generate_transactions(counts["transactions"], counts["users"], counts["products"], seed))
+    }
@@ -0,0 +1,196 @@
+"""Benchmark the pipeline's hot paths on synthetic data.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run --sizes 1000,10000,100000 --output bench.json
+
+Every size is the number of transactions (products and users scale with it, see
+benchmarks/generate.py). Results are written as JSON so runs can be compared over time.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import fetch_data
+import insights
+from aggregations import aggregate_products, aggregate_transactions, aggregate_users
+from benchmarks.stub_server import StubServer
+from business_rules import (
+    average_transaction_value, calculate_user_spending, join_transactions_with_products,
+    join_transactions_with_users, most_popular_categories
+)
+from runner import build_snapshot
+from snapshot_writer import write_snapshot
+from transform import transform_data
+
+# Insight functions timed one by one (each on its own, without shared aggregates)
+INSIGHTS = {
+    "total_transactions_per_user": lambda d: insights.total_transactions_per_user(d["transactions"]),
+    "user_with_most_transactions": lambda d: insights.user_with_most_transactions(d["transactions"]),
+    "users_with_no_transactions": lambda d: insights.users_with_no_transactions(d["users"], d["transactions"]),
+    "calculate_user_statistics": lambda d: insights.calculate_user_statistics(d["users"]),
+    "top_selling_products": lambda d: insights.top_selling_products(d["products"]),
+    "expensive_and_cheapest_products": lambda d: insights.expensive_and_cheapest_products(d["products"]),
+    "category_wise_revenue": lambda d: insights.category_wise_revenue(d["products"]),
+    "top_revenue_categories": lambda d: insights.top_revenue_categories(d["products"]),
+    "most_rated_products": lambda d: insights.most_rated_products(d["products"]),
+    "calculate_user_spending": lambda d: calculate_user_spending(d["transactions"]),
+    "most_popular_categories": lambda d: most_popular_categories(d["products"]),
+    "average_transaction_value": lambda d: average_transaction_value(d["products"]),
+    "aggregate_products": lambda d: aggregate_products(d["products"]),
+    "aggregate_users": lambda d: aggregate_users(d["users"]),
+    "aggregate_transactions": lambda d: aggregate_transactions(d["transactions"])
+}
+
+# Endpoints timed through the ASGI app
+ENDPOINTS = [
+    ("/insights/users", ""),
+    ("/insights/products", ""),
+    ("/data/product", "limit=100"),
+    ("/data/transaction", "limit=100&data.status=delivered"),
+    ("/data/user", "limit=100&fields=data.name,data.email")
+]
+
+# Time a stage (and optionally trace its peak allocation; tracing slows allocation-heavy stages down)
+def measure(results, size, stage, fn, trace_memory=True, **extra):
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results.append(dict({"size": size, "stage": stage, "seconds": round(seconds, 6), "peak_bytes": peak}, **extra))
+    print(f"  {stage:<40} {seconds * 1000:>10.2f} ms" + (f"  peak {peak / 1e6:>8.1f} MB" if peak is not None else ""))
+    return value
+
+# Minimal ASGI client: one GET request, no network
+async def asgi_get(app, path, query=""):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", b"benchmark")], "client": ("127.0.0.1", 0), "server": ("benchmark", 80)
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return messages[0]["status"], body
+
+# Latency distribution and throughput of one endpoint
+async def bench_endpoint(app, path, query, requests):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        status, body = await asgi_get(app, path, query)
+        latencies.append(time.perf_counter() - request_start)
+        if status != 200:
+            raise RuntimeError(f"{path}?{query} returned {status}: {body[:200]!r}")
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "response_bytes": len(body)
+    }
+
+# Benchmark one size
+def bench_size(size, seed, requests, trace_memory, results):
+    print(f"size={size}")
+    with StubServer(size, seed) as stub:
+        for name, url in stub.urls.items():
+            setattr(fetch_data, name, url)
+        latencies = {}
+        raw = measure(results, size, "fetch", lambda: fetch_data.fetch_data(latencies), trace_memory)
+        results[-1]["sources"] = {name: round(value, 6) for name, value in latencies.items()}
+        results[-1]["records"] = {name: len(records) for name, records in raw.items()}
+        distinct_users = len({user["login"]["uuid"] for user in raw["users"]})
+        if distinct_users != stub.counts["users"]:  # Paging must return every user exactly once
+            raise RuntimeError(f"fetched {distinct_users} distinct users, expected {stub.counts['users']}")
+
+    data = measure(results, size, "transform_data", lambda: transform_data(raw), trace_memory)
+    del raw
+    joined_products = measure(results, size, "join_transactions_with_products",
+                              lambda: join_transactions_with_products(data["transactions"], data["products"]), trace_memory)
+    joined_users = measure(results, size, "join_transactions_with_users",
+                           lambda: join_transactions_with_users(data["transactions"], data["users"]), trace_memory)
+    for name, fn in INSIGHTS.items():
+        measure(results, size, f"insight:{name}", lambda: fn(data), trace_memory)
+
+    datasets = dict(data, transactions_with_products=joined_products, transactions_with_users=joined_users)
+    with tempfile.TemporaryDirectory() as root:
+        measure(results, size, "persist:write_snapshot", lambda: write_snapshot(datasets, root=root), trace_memory)
+        measure(results, size, "persist:write_snapshot_gzip", lambda: write_snapshot(datasets, root=root, compression="gzip"), trace_memory)
+
+    import main  # Imported late: the app is only needed for the endpoint stage
+    main.runner.publish(measure(results, size, "build_snapshot", lambda: build_snapshot(datasets), trace_memory))
+    for path, query in ENDPOINTS:
+        stats = asyncio.run(bench_endpoint(main.app, path, query, requests))
+        url = f"{path}?{query}" if query else path
+        results.append(dict({"size": size, "stage": f"endpoint:{url}"}, **stats))
+        print(f"  endpoint {url:<56} p50 {stats['p50_ms']:>8.3f} ms  {stats['throughput_rps']:>9.1f} req/s")
+
+# Commit the results belong to, when run from a git checkout
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated transaction counts (10^3 to 10^7)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (faster, no peak_bytes)")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("PIPELINE_REFRESH_SECONDS", "0")
+    fetch_data.HTTP_CACHE = False  # Measure real fetches, not the on-disk response cache
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        bench_size(size, args.seed, args.requests, not args.no_memory, results)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed
+        },
+        "results": results
+    }
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(encoded)
+    else:
+        print(encoded)
+
+if __name__ == "__main__":
+    main()
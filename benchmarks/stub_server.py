@@ -0,0 +1,99 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.generate import entity_counts, generate_products, generate_transactions, generate_users
+
+# Local stand-in for the three upstream APIs
+class StubServer:
+    """Serves synthetic fakestoreapi, randomuser and mockaroo payloads on 127.0.0.1.
+
+    `/products` and `/orders.json` return the whole list for `size` transactions;
+    `/api/?results=N&page=P` pages through users like randomuser.me. Bodies are encoded
+    once and cached. Use as a context manager; `urls` holds the endpoint URLs.
+    """
+
+    def __init__(self, size, seed=0, port=0):
+        self.size = size
+        self.seed = seed
+        self.counts = entity_counts(size)
+        self.bodies = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def urls(self):
+        return {
+            "PRODUCTS_API": f"{self.base_url}/products",
+            "USERS_API": f"{self.base_url}/api/?results={self.counts['users']}",
+            "TRANSACTIONS_API": f"{self.base_url}/orders.json"
+        }
+
+    def body(self, path, query):
+        if path == "/products":
+            key = ("products",)
+            build = lambda: list(generate_products(self.counts["products"], self.seed))
+        elif path == "/orders.json":
+            key = ("transactions",)
+            build = lambda: list(generate_transactions(self.size, self.counts["users"], self.counts["products"], self.seed))
+        elif path.rstrip("/") == "/api":
+            results = int(query.get("results", ["20"])[0])
+            page = int(query.get("page", ["1"])[0])
+            key = ("users", results, page)
+            build = lambda: {"results": list(generate_users(results, self.seed, start=(page - 1) * results)), "info": {"page": page, "results": results}}
+        else:
+            return None
+
+        with self._lock:
+            if key not in self.bodies:
+                self.bodies[key] = json.dumps(build()).encode("utf-8")
+            return self.bodies[key]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                stub.requests += 1
+                body = stub.body(parts.path, parse_qs(parts.query))
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
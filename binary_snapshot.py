@@ -0,0 +1,323 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+
+from indexes import SortedIndex, build_indexes
+from records import from_dict, to_json
+from snapshot_writer import SNAPSHOTS_TO_KEEP, encode_record, write_file_atomic
+from windows import TransactionWindows
+
+try:
+    import fcntl  # Producer lock on POSIX
+except ImportError:
+    fcntl = None
+    import msvcrt  # Producer lock on Windows
+
+# Binary snapshot settings (overridable through the environment)
+BINARY_SNAPSHOTS = os.environ.get("BINARY_SNAPSHOTS", "0") == "1"  # Share one memory-mapped snapshot between workers
+BINARY_ROOT = os.environ.get("BINARY_SNAPSHOT_ROOT", os.path.join("json", "binary"))  # Files live in BINARY_ROOT/<version>.snap
+POLL_SECONDS = float(os.environ.get("BINARY_POLL_SECONDS", "2"))  # How often readers check CURRENT for a new version
+
+# File layout: header, 8-byte aligned sections, then a JSON table of contents the header points to
+MAGIC = b"DPSNAP01"
+HEADER = struct.Struct("<8sQQ")  # magic, table of contents offset, table of contents length
+ALIGNMENT = 8
+DATASETS = ("products", "users", "transactions", "transactions_with_products", "transactions_with_users")
+ENTITY_DATASETS = {"product": "products", "user": "users", "transaction": "transactions"}
+
+# Writes sections one after another and remembers where each one went
+class SectionWriter:
+    def __init__(self, file):
+        self.file = file
+        self.sections = {}  # name -> [offset, length, typecode]
+
+    def begin(self):
+        padding = -self.file.tell() % ALIGNMENT
+        self.file.write(b"\0" * padding)
+        return self.file.tell()
+
+    def add(self, name, data, typecode="B"):
+        offset = self.begin()
+        self.file.write(data)
+        self.sections[name] = [offset, self.file.tell() - offset, typecode]
+
+# Record documents plus an offset index into them
+def write_documents(writer, name, records):
+    """Writes the JSON documents of `records` back to back; `<name>.offsets` holds n + 1 start offsets."""
+    offsets = array("Q", [0])
+    start = writer.begin()
+    for record in records:
+        document = encode_record(record)
+        writer.file.write(document)
+        offsets.append(offsets[-1] + len(document))
+    writer.sections[f"{name}.data"] = [start, offsets[-1], "B"]
+    writer.add(f"{name}.offsets", offsets, "Q")
+    return len(offsets) - 1
+
+# Hash indexes as columnar arrays over the shared string table
+def write_index(writer, name, index, codes):
+    """`<name>.keys` holds the sorted string codes, `<name>.offsets` where each key's positions start in `<name>.positions`."""
+    keys, offsets, positions = array("I"), array("Q", [0]), array("I")
+    for value in sorted(index, key=codes.__getitem__):
+        keys.append(codes[value])
+        positions.extend(index[value])
+        offsets.append(len(positions))
+    writer.add(f"{name}.keys", keys, "I")
+    writer.add(f"{name}.offsets", offsets, "Q")
+    writer.add(f"{name}.positions", positions, "I")
+
+def write_sorted_index(writer, name, index):
+    writer.add(f"{name}.values", array("d", index.values), "d")
+    writer.add(f"{name}.positions", array("I", index.positions), "I")
+
+# Remove all but the newest files
+def prune_binary_snapshots(root, keep=SNAPSHOTS_TO_KEEP):
+    versions = sorted(name[:-len(".snap")] for name in os.listdir(root) if name.endswith(".snap"))
+    for version in versions[:-keep] if keep else []:
+        try:
+            os.remove(os.path.join(root, f"{version}.snap"))
+        except OSError:
+            pass  # Still mapped by a reader on Windows, retried after the next write
+
+# Write one snapshot as a single binary file
+def write_binary_snapshot(snapshot, root=None):
+    """Writes `snapshot` to `<root>/<version>.snap` and points `<root>/CURRENT` at it. Returns the file's path.
+
+    Records are stored as JSON documents with an offset index, hash indexes as columnar
+    arrays of codes into one sorted string table, sorted indexes as value and position
+    arrays, and aggregates and windows as JSON.
+    The file is written under a temporary name and renamed into place when complete.
+    """
+    root = root or BINARY_ROOT
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"{snapshot.version}.snap")
+    temp_path = f"{path}.tmp-{os.getpid()}"
+
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, 0, 0))
+            writer = SectionWriter(file)
+            counts = {name: write_documents(writer, name, getattr(snapshot, name)) for name in DATASETS}
+
+            indexes = {}
+            for entity_type, name in ENTITY_DATASETS.items():
+                indexes[entity_type] = (snapshot.indexes or {}).get(entity_type) or build_indexes(getattr(snapshot, name), entity_type)
+            is_hash = lambda index: not isinstance(index, SortedIndex)
+            strings = sorted({value for entity_indexes in indexes.values() for index in entity_indexes.values() if is_hash(index) for value in index})
+            codes = {value: code for code, value in enumerate(strings)}
+            encoded = [value.encode("utf-8") for value in strings]
+            string_offsets = array("Q", [0])
+            for value in encoded:
+                string_offsets.append(string_offsets[-1] + len(value))
+            writer.add("strings.data", b"".join(encoded))
+            writer.add("strings.offsets", string_offsets, "Q")
+            for entity_type, entity_indexes in indexes.items():
+                for field, index in entity_indexes.items():
+                    if is_hash(index):
+                        write_index(writer, f"{entity_type}.index.{field}", index, codes)
+                    else:
+                        write_sorted_index(writer, f"{entity_type}.index.{field}", index)
+
+            aggregates = {name: getattr(snapshot, f"{name}_aggregates") for name in ENTITY_DATASETS}
+            writer.add("aggregates", json.dumps(aggregates, default=to_json).encode("utf-8"))
+            if snapshot.transaction_windows is not None:
+                writer.add("windows", json.dumps(snapshot.transaction_windows.to_dict()).encode("utf-8"))
+
+            toc = json.dumps({
+                "version": snapshot.version,
+                "created_at": snapshot.created_at,
+                "byteorder": sys.byteorder,
+                "records": counts,
+                "indexes": {entity_type: {field: "hash" if is_hash(index) else "sorted" for field, index in entity_indexes.items()}
+                            for entity_type, entity_indexes in indexes.items()},
+                "sections": writer.sections
+            }).encode("utf-8")
+            toc_offset = writer.begin()
+            file.write(toc)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, toc_offset, len(toc)))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)  # Never leave a partial file behind
+        raise
+
+    write_file_atomic(os.path.join(root, "CURRENT"), snapshot.version.encode("utf-8"))
+    prune_binary_snapshots(root)
+    return path
+
+# Version CURRENT points at
+def current_version(root=None):
+    try:
+        with open(os.path.join(root or BINARY_ROOT, "CURRENT"), encoding="utf-8") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+# Open the file of one version (the one CURRENT points at by default)
+def open_binary_snapshot(version=None, root=None):
+    """Returns the BinarySnapshot of `version`, or None if there is none."""
+    root = root or BINARY_ROOT
+    version = version or current_version(root)
+    path = os.path.join(root, f"{version}.snap") if version else None
+    return BinarySnapshot(path) if path and os.path.exists(path) else None
+
+# Only one process per root writes; the others follow CURRENT
+def acquire_producer_lock(root=None):
+    """Returns an open lock file if this process became the producer, None if another process holds the lock.
+
+    The lock is released by the operating system when the process exits, so a reader can
+    take over from a producer that died.
+    """
+    root = root or BINARY_ROOT
+    os.makedirs(root, exist_ok=True)
+    file = open(os.path.join(root, "producer.lock"), "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        file.close()
+        return None
+    return file
+
+# Sorted string table
+class StringTable(Sequence):
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        return str(self.data[self.offsets[code]:self.offsets[code + 1]], "utf-8")
+
+    def code(self, value):
+        """Code of `value`, or None if the table does not hold it."""
+        code = bisect_left(self, value)
+        return code if code < len(self) and self[code] == value else None
+
+# Records of one dataset, decoded on demand
+class MappedRecords(Sequence):
+    """Read-only sequence view of a dataset in a binary snapshot, so code written for record lists works unchanged."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return from_dict(json.loads(self.data[self.offsets[position]:self.offsets[position + 1]].tobytes()))
+
+# One hash index, looked up in place
+class MappedIndex(Mapping):
+    """Maps values to their record positions like the dicts of indexes.build_hash_index."""
+
+    def __init__(self, strings, keys, offsets, positions):
+        self.strings = strings
+        self.keys = keys
+        self.offsets = offsets
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return (self.strings[code] for code in self.keys)
+
+    def __getitem__(self, value):
+        code = self.strings.code(value) if isinstance(value, str) else None
+        slot = bisect_left(self.keys, code) if code is not None else len(self.keys)
+        if slot == len(self.keys) or self.keys[slot] != code:
+            raise KeyError(value)
+        return self.positions[self.offsets[slot]:self.offsets[slot + 1]]
+
+# Read side of one binary snapshot file
+class BinarySnapshot:
+    """A snapshot file mapped read-only into memory.
+
+    Opening one only reads its table of contents; records and index entries are read
+    from the mapping when they are used, and every process mapping the same file shares
+    its pages through the OS page cache.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, toc_offset, toc_length = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary snapshot")
+        toc = json.loads(self.mmap[toc_offset:toc_offset + toc_length])
+        if toc["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written on a {toc['byteorder']}-endian machine")
+        self.path = path
+        self.version = toc["version"]
+        self.created_at = toc["created_at"]
+        self.sections = toc["sections"]
+        self.index_fields = toc["indexes"]
+        self.view = memoryview(self.mmap)
+        self.strings = StringTable(self.section("strings.offsets"), self.section("strings.data"))
+
+    def section(self, name):
+        offset, length, typecode = self.sections[name]
+        view = self.view[offset:offset + length]
+        return view if typecode == "B" else view.cast(typecode)
+
+    def load_json(self, name):
+        return json.loads(self.section(name).tobytes()) if name in self.sections else None
+
+    def records(self, name):
+        """Sequence view of a dataset (by dataset name, e.g. "products")."""
+        return MappedRecords(self.section(f"{name}.offsets"), self.section(f"{name}.data"))
+
+    def index(self, entity_type, field, kind):
+        name = f"{entity_type}.index.{field}"
+        if kind == "sorted":
+            return SortedIndex(self.section(f"{name}.values"), self.section(f"{name}.positions"))
+        return MappedIndex(self.strings, *(self.section(f"{name}.{part}") for part in ("keys", "offsets", "positions")))
+
+    def indexes(self):
+        """{entity_type: {path: MappedIndex or SortedIndex}}, in the shape of Snapshot.indexes."""
+        return {entity_type: {field: self.index(entity_type, field, kind) for field, kind in fields.items()}
+                for entity_type, fields in self.index_fields.items()}
+
+    def aggregates(self):
+        """{entity_type: aggregates}, with the records inside them (e.g. most_rated) rebuilt."""
+        rebuild = lambda value: [from_dict(item) for item in value] if isinstance(value, list) else from_dict(value)
+        return {entity_type: {name: rebuild(value) for name, value in aggregates.items()} if aggregates else aggregates
+                for entity_type, aggregates in self.load_json("aggregates").items()}
+
+    def windows(self):
+        state = self.load_json("windows")
+        return TransactionWindows.from_dict(state) if state is not None else None
+
+    def close(self):
+        """Unmaps the file. Returns False, leaving it mapped, while views of it (records or
+        indexes of a snapshot still being read) exist; call again once they are gone."""
+        if self.mmap.closed:
+            return True
+        self.strings = None
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            return False
+        return True
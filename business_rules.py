@@ -1,28 +1,94 @@
-from collections import defaultdict
+from aggregations import aggregate_products, aggregate_transactions
+from hash_join import hash_join
+
+# Lookup tables used by the joins
+def build_product_lookup(products):
+    """Maps product IDs (as strings) to product details."""
+    return {str(product["data"]["id"]): product["data"] for product in products}
+
+def build_user_lookup(users):
+    """Maps user names to user details."""
+    return {u["data"]["name"]: u["data"] for u in users}
+
+
+# Join keys
+def product_key(transaction):
+    return str(transaction["data"].get("parcel_id", ""))  # Convert to string for lookup
+
+def user_key(transaction):
+    return transaction.get("data", {}).get("user_name")
+
+
+# Enrich a single transaction with product details
+def join_product_row(transaction, product_lookup):
+    return product_row(transaction, product_lookup.get(product_key(transaction)))  # Find product by parcel_id
+
+def product_row(transaction, product):
+    return {
+        "transaction_id": transaction["data"].get("transaction_id", "Unknown"),
+        "user_name": transaction["data"].get("user_name", "Unknown"),
+        "user_phone": transaction["data"].get("user_phone", "Unknown"),
+        "status": transaction["data"].get("status", "Unknown"),
+        "sender": transaction["data"].get("sender", "Unknown"),
+        "product": product.get("title", "Product Not Found") if product else "Product Not Found"
+    }
+
+
+# Enrich a single transaction with user details
+def join_user_row(transaction, user_lookup):
+    return user_row(transaction, user_lookup.get(user_key(transaction), None))  # Fetch user details using the lookup table
+
+def user_row(transaction, user_details):
+    transaction_data = transaction.get("data", {})
+    return {
+        "transaction_id": transaction_data.get("transaction_id", "Unknown"),
+        "user": user_details if user_details else "User Not Found",
+        "user_phone": transaction_data.get("user_phone", "Unknown"),
+        "status": transaction_data.get("status", "Unknown"),
+        "sender": transaction_data.get("sender", "Unknown"),
+        "parcel_id": transaction_data.get("parcel_id", "Unknown"),
+    }
+
+
+# Lazily join transactions with product details
+def iter_transactions_with_products(transactions, products, budget=None):
+    """Yields the rows of join_transactions_with_products one at a time.
+
+    `transactions` may be a generator (e.g. snapshot_writer.read_records); products beyond
+    `budget` are spilled to disk instead of being held in memory (see hash_join.py).
+    """
+    return hash_join(transactions, products, product_key, lambda product: str(product["data"]["id"]), product_row,
+                     build_value=lambda product: product["data"], budget=budget)
+
+# Lazily join transactions with user details
+def iter_transactions_with_users(transactions, users, budget=None):
+    """Yields the rows of join_transactions_with_users one at a time; see iter_transactions_with_products."""
+    return hash_join(transactions, users, user_key, lambda user: user["data"]["name"], user_row,
+                     build_value=lambda user: user["data"], budget=budget)
+
+# Join whose rows are produced while they are consumed
+class JoinedRows:
+    """Iterable over the rows of `join(transactions, build)`, which is rerun lazily on every iteration.
+
+    Snapshots hold their joins this way: only the writers (snapshot_writer.write_snapshot,
+    binary_snapshot) read them, one row at a time, so the join is never held in memory.
+    """
+
+    def __init__(self, join, transactions, build, budget=None):
+        self.join = join
+        self.transactions = transactions
+        self.build = build
+        self.budget = budget
+
+    def __iter__(self):
+        return self.join(self.transactions, self.build, budget=self.budget)
+
 
 # Join Transactions with Product Details
 def join_transactions_with_products(transactions, products):
     """Enrich transactions by adding product details based on parcel_id."""
     try:
-        # Create a mapping of product IDs to product details for fast lookup
-        product_lookup = {str(product["data"]["id"]): product["data"] for product in products}
-        enriched_transactions = []
-
-        for transaction in transactions:
-            parcel_id = str(transaction["data"].get("parcel_id", ""))  # Convert to string for lookup
-            product = product_lookup.get(parcel_id)  # Find product by parcel_id
-
-            # Append transaction with product details
-            enriched_transactions.append({
-                "transaction_id": transaction["data"].get("transaction_id", "Unknown"),
-                "user_name": transaction["data"].get("user_name", "Unknown"),
-                "user_phone": transaction["data"].get("user_phone", "Unknown"),
-                "status": transaction["data"].get("status", "Unknown"),
-                "sender": transaction["data"].get("sender", "Unknown"),
-                "product": product.get("title", "Product Not Found") if product else "Product Not Found"
-            })
-
-        return enriched_transactions
+        return list(iter_transactions_with_products(transactions, products))
 
     except Exception as e:
         print(f"Error in join_transactions_with_products: {e}")
@@ -33,27 +99,7 @@ def join_transactions_with_products(transactions, products):
 def join_transactions_with_users(transactions, users):
     """Enrich transactions by adding user details."""
     try:
-        enriched_transactions = []
-        # Create a dictionary mapping user names to user details for fast lookup
-        user_lookup = {u["data"]["name"]: u["data"] for u in users}
-
-        for transaction in transactions:
-            transaction_data = transaction.get("data", {})
-            user_name = transaction_data.get("user_name")
-
-            # Fetch user details using the lookup table
-            user_details = user_lookup.get(user_name, None)
-
-            enriched_transactions.append({
-                "transaction_id": transaction_data.get("transaction_id", "Unknown"),
-                "user": user_details if user_details else "User Not Found",
-                "user_phone": transaction_data.get("user_phone", "Unknown"),
-                "status": transaction_data.get("status", "Unknown"),
-                "sender": transaction_data.get("sender", "Unknown"),
-                "parcel_id": transaction_data.get("parcel_id", "Unknown"),
-            })
-
-        return enriched_transactions
+        return list(iter_transactions_with_users(transactions, users))
 
     except Exception as e:
         print(f"Error in join_transactions_with_users: {e}")
@@ -61,16 +107,11 @@ def join_transactions_with_users(transactions, users):
 
 
 # Calculate Total Spending per User
-def calculate_user_spending(transactions):
+def calculate_user_spending(transactions, aggregates=None):
     """Counts the number of transactions per user."""
     try:
-        user_transactions = defaultdict(int)
-
-        for transaction in transactions:
-            user_name = transaction["data"].get("user_name", "Unknown")
-            user_transactions[user_name] += 1
-
-        return dict(user_transactions)
+        aggregates = aggregate_transactions(transactions) if aggregates is None else aggregates
+        return dict(aggregates["transactions_per_user"])
 
     except Exception as e:
         print(f"Error in calculate_user_spending: {e}")
@@ -78,17 +119,11 @@ def calculate_user_spending(transactions):
 
 
 # Identify Most Popular Product Categories
-def most_popular_categories(products):
+def most_popular_categories(products, aggregates=None):
     """Finds the most popular product categories based on rating count."""
     try:
-        category_count = defaultdict(int)
-
-        for product in products:
-            category = product["data"].get("category", "Unknown")
-            rating_count = product["data"].get("rating", {}).get("count", 0)
-
-            if category:
-                category_count[category] += rating_count
+        aggregates = aggregate_products(products) if aggregates is None else aggregates
+        category_count = aggregates["category_rating_count"]
 
         # Return categories sorted by popularity (highest rating count first)
         return sorted(category_count.items(), key=lambda x: x[1], reverse=True)
@@ -99,20 +134,11 @@ def most_popular_categories(products):
 
 
 # Calculate Average Transaction Value
-def average_transaction_value(products):
+def average_transaction_value(products, aggregates=None):
     """Calculates the average price of products within each category."""
     try:
-        category_prices = defaultdict(list)
-
-        for product in products:
-            category = product["data"].get("category", "Unknown")
-            price = product["data"].get("price", 0)
-
-            if category:
-                category_prices[category].append(price)
-
-        # Compute the average price per category
-        return {category: sum(prices) / len(prices) for category, prices in category_prices.items() if prices}
+        aggregates = aggregate_products(products) if aggregates is None else aggregates
+        return dict(aggregates["category_average_price"])
 
     except Exception as e:
         print(f"Error in average_transaction_value: {e}")
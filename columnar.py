@@ -0,0 +1,135 @@
+import os
+from datetime import datetime
+
+try:
+    import numpy as np  # Optional, only needed for the columnar store
+except ImportError:
+    np = None
+
+from aggregations import AGE_BUCKETS, birth_year
+
+# Compute snapshot aggregates with the columnar store (when NumPy is installed)
+COLUMNAR_INSIGHTS = os.environ.get("COLUMNAR_INSIGHTS", "0") == "1"
+
+# Upper age bound of every bucket but the last, see aggregations.age_bucket
+AGE_BOUNDS = (18, 30, 45, 60)
+THIS_YEAR = -1  # Birth year column of a missing date of birth
+UNKNOWN_YEAR = -2  # Birth year column of a date of birth that does not start with a year
+
+def available():
+    return np is not None
+
+# Dictionary-encode a column of hashable values
+def dictionary_encode(values, keep=None):
+    """Returns `(codes, dictionary)` with int32 codes and the distinct values in first-seen order.
+
+    Values rejected by `keep` get code -1 and are left out of every group-by.
+    """
+    lookup = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for position, value in enumerate(values):
+        if keep is not None and not keep(value):
+            codes[position] = -1
+            continue
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(lookup)
+        codes[position] = code
+    return codes, list(lookup)
+
+# Sum `weights` per code (sequentially, so float results match a Python loop)
+def group_sum(codes, weights, size):
+    mask = codes >= 0
+    return np.bincount(codes[mask], weights=weights[mask], minlength=size)
+
+def group_count(codes, size):
+    return np.bincount(codes[codes >= 0], minlength=size)
+
+# Columnar entity store
+class ColumnarStore:
+    """Products, users and transactions held as typed NumPy columns.
+
+    Numeric fields become float64/int32 arrays and categorical ones dictionary-encoded
+    int32 codes; the `*_aggregates()` methods compute the same mappings as
+    aggregations.aggregate_products / aggregate_users / aggregate_transactions with
+    vectorized group-bys, so every view in insights.py and business_rules.py can read them.
+    """
+
+    def __init__(self, products, users, transactions):
+        if np is None:
+            raise RuntimeError("The columnar store requires NumPy")
+        self.products = products
+        self.users = users
+        self.transactions = transactions
+
+        # Products
+        product_data = [p["data"] for p in products]
+        self.price = np.array([d.get("price", 0) for d in product_data], dtype=np.float64)
+        self.rating_count = np.array([(d.get("rating") or {}).get("count") or 0 for d in product_data], dtype=np.int32)
+        self.category, self.categories = dictionary_encode([d.get("category", "Unknown") for d in product_data], keep=bool)
+        self.title, self.titles = dictionary_encode([d.get("title", "Unknown") for d in product_data], keep=bool)
+
+        # Users
+        user_data = [u.get("data", {}) for u in users]
+        birth_years = (birth_year(d.get("dob"), THIS_YEAR) for d in user_data)
+        self.birth_year = np.array([UNKNOWN_YEAR if year is None else year for year in birth_years], dtype=np.int32)
+        self.gender, self.genders = dictionary_encode([d.get("gender", "Unknown") for d in user_data])
+        self.user_names = list(dict.fromkeys(d.get("name") for d in user_data if "name" in d))
+
+        # Transactions
+        self.transaction_user, self.transaction_users = dictionary_encode([t["data"].get("user_name", "Unknown") for t in transactions])
+
+    def product_aggregates(self, top_rated=5):
+        """Same result as aggregations.aggregate_products."""
+        size = len(self.categories)
+        revenue = group_sum(self.category, self.price, size)
+        counts = group_count(self.category, size)
+        rating_totals = group_sum(self.category, self.rating_count.astype(np.float64), size)
+
+        # Last rating count seen for every title
+        last_position = np.full(len(self.titles), -1, dtype=np.int64)
+        titled = np.flatnonzero(self.title >= 0)
+        np.maximum.at(last_position, self.title[titled], titled)
+
+        # Stable descending order, so ties keep list order like sorted(..., reverse=True)
+        most_rated = np.argsort(-self.rating_count.astype(np.int64), kind="stable")[:top_rated]
+
+        cheapest = most_expensive = None
+        if len(self.price):
+            cheapest = self.products[int(np.argmin(self.price))]  # First of the cheapest
+            most_expensive = self.products[len(self.price) - 1 - int(np.argmax(self.price[::-1]))]  # Last of the most expensive
+
+        return {
+            "category_rating_count": dict(zip(self.categories, rating_totals.astype(np.int64).tolist())),
+            "category_revenue": dict(zip(self.categories, revenue.tolist())),
+            "category_average_price": dict(zip(self.categories, (revenue / counts).tolist())),
+            "sales_by_title": dict(zip(self.titles, self.rating_count[last_position].tolist())),
+            "most_rated": [self.products[p] for p in most_rated.tolist()],
+            "cheapest": cheapest,
+            "most_expensive": most_expensive
+        }
+
+    def user_aggregates(self):
+        """Same result as aggregations.aggregate_users."""
+        current_year = datetime.utcnow().year
+        birth_year = np.where(self.birth_year != THIS_YEAR, self.birth_year, current_year)
+        buckets = np.searchsorted(np.array(AGE_BOUNDS), current_year - birth_year, side="left")
+        buckets[self.birth_year == UNKNOWN_YEAR] = len(AGE_BUCKETS)  # The None bucket
+        bucket_counts = np.bincount(buckets, minlength=len(AGE_BUCKETS) + 1)
+
+        # Buckets in first-seen order, like a grouped Count
+        keys = AGE_BUCKETS + (None,)
+        seen = np.unique(buckets, return_index=True)[1] if len(buckets) else np.array([], dtype=np.int64)
+        age_count = {keys[buckets[i]]: int(bucket_counts[buckets[i]]) for i in np.sort(seen).tolist()}
+
+        return {
+            "total_users": len(self.users),
+            "gender_count": dict(zip(self.genders, group_count(self.gender, len(self.genders)).tolist())),
+            "age_count": age_count,
+            "user_names": list(self.user_names)
+        }
+
+    def transaction_aggregates(self):
+        """Same result as aggregations.aggregate_transactions."""
+        counts = group_count(self.transaction_user, len(self.transaction_users))
+        return {"transactions_per_user": dict(zip(self.transaction_users, counts.tolist()))}
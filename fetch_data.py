@@ -1,48 +1,195 @@
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import HTTPCache
+from metrics import FETCH_BYTES, FETCH_ERRORS, count_records, timed
+from records import FailedFetch
+
+# API Endpoints for fetching data (overridable through the environment, e.g. to point at a local stub server)
+PRODUCTS_API = os.environ.get("PRODUCTS_API", "https://fakestoreapi.com/products")  # E-commerce product data
+USERS_API = os.environ.get("USERS_API", "https://randomuser.me/api/?results=20")  # User profiles
+TRANSACTIONS_API = os.environ.get("TRANSACTIONS_API", "https://my.api.mockaroo.com/orders.json?key=e49e6840")  # Transaction data
+
+# Fetch tuning
+REQUEST_TIMEOUT = 10  # Seconds per HTTP request
+MAX_RETRIES = 3  # Retries after the first attempt
+BACKOFF_BASE = 0.5  # Seconds, doubled on every retry
+BACKOFF_MAX = 8.0  # Upper bound for a single backoff sleep
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+POOL_SIZE = 10  # Keep-alive connections per host
+USERS_PAGE_SIZE = 5000  # randomuser.me caps the number of results per request
+MAX_PAGE_WORKERS = 4  # Pages fetched in parallel for a single source
+USERS_SEED = "data_pipeline"  # randomuser.me needs a fixed seed to page consistently
+HTTP_CACHE = os.environ.get("HTTP_CACHE", "0") == "1"  # Conditional-request response cache (see http_cache.py), off unless enabled
+
+_session = None
+_http_cache = None
+
+# Shared HTTP session with a pooled keep-alive connection per host
+def get_session():
+    """Returns the process-wide requests session, creating it on first use."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+# Shared on-disk response cache
+def get_http_cache():
+    """Returns the process-wide HTTPCache, or None when HTTP_CACHE is disabled."""
+    global _http_cache
+    if not HTTP_CACHE:
+        return None
+    if _http_cache is None:
+        _http_cache = HTTPCache()
+    return _http_cache
+
+# Exponential backoff with full jitter
+def backoff_delay(attempt):
+    """Returns the sleep time before retry number `attempt` (0-based)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+# GET with retries
+def get_with_retries(url, session=None, params=None, headers=None):
+    """Requests `url`, retrying transient failures with backoff and jitter; returns the response (2xx or 304)."""
+    session = session or get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+            if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                time.sleep(backoff_delay(attempt))
+                continue
+            response.raise_for_status()  # Raise exception for HTTP errors (4xx, 5xx)
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+
+# GET a JSON document, through the response cache when it is enabled
+def get_json(url, session=None, params=None, source="other"):
+    """Fetches `url` and decodes the JSON body.
+
+    With the HTTP cache on, unchanged sources cost a 304 (or no request at all within the
+    source's TTL) and a cached body is used if the source is unreachable. A cached body
+    that does not decode is dropped and fetched again; a malformed upstream body raises ValueError.
+    """
+    cache = get_http_cache()
+    if cache is None:
+        response = get_with_retries(url, session, params)
+        FETCH_BYTES.inc(len(response.content), source=source)
+        return response.json()
 
-# API Endpoints for fetching data
-PRODUCTS_API = "https://fakestoreapi.com/products"  # E-commerce product data
-USERS_API = "https://randomuser.me/api/?results=20"  # User profiles
-TRANSACTIONS_API = "https://my.api.mockaroo.com/orders.json?key=e49e6840"  # Transaction data
+    body, response = cache.fetch(url, lambda headers: get_with_retries(url, session, params, headers), params, source)
+    if response is not None:
+        FETCH_BYTES.inc(len(body), source=source)
+    try:
+        return json.loads(body)
+    except ValueError:
+        cache.discard(url, params)  # Never reuse a body that does not decode
+        if response is not None:
+            raise
+    return get_json(url, session, params, source)  # A corrupt cached body is a miss
+
+# Result count a randomuser.me style `?results=N` URL asks for
+def requested_results(url):
+    return int(dict(parse_qsl(urlsplit(url).query)).get("results", 0) or 0)
+
+# Split a randomuser.me style `?results=N` URL into page URLs
+def paginate_url(url, page_size):
+    """Returns one URL per page when the requested result count exceeds `page_size`.
+
+    Every page asks for `page_size` results, since randomuser.me starts page P at
+    (P - 1) * results; a smaller last page would shift its window. Callers truncate the
+    combined results to `requested_results(url)`.
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    total = requested_results(url)
+    if total <= page_size:
+        return [url]
+
+    pages = []
+    for page in range(1, (total + page_size - 1) // page_size + 1):
+        page_query = dict(query, results=page_size, page=page, seed=query.get("seed", USERS_SEED))
+        pages.append(urlunsplit(parts._replace(query=urlencode(page_query))))
+    return pages
 
 # Fetch Product Data
-def fetch_products():
+def fetch_products(url=None, session=None):
     """Fetches product data with error handling."""
     try:
-        response = requests.get(PRODUCTS_API, timeout=10)
-        response.raise_for_status()  # Raise exception for HTTP errors (4xx, 5xx)
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return get_json(url or PRODUCTS_API, session, source="products")
+    except (requests.exceptions.RequestException, ValueError) as e:  # ValueError: malformed JSON body
         print(f"Error fetching products: {e}")
-        return []  # Return empty list on failure
+        FETCH_ERRORS.inc(source="products")
+        return FailedFetch()  # Empty, but distinct from a source without records
 
 # Fetch User Data
-def fetch_users():
-    """Fetches user data with error handling."""
+def fetch_users(url=None, session=None, page_size=None):
+    """Fetches user data with error handling, paging through large result counts in parallel."""
     try:
-        response = requests.get(USERS_API, timeout=10)
-        response.raise_for_status()
-        return response.json().get("results", [])  # Extract user list
-    except requests.exceptions.RequestException as e:
+        pages = paginate_url(url or USERS_API, page_size or USERS_PAGE_SIZE)
+        if len(pages) == 1:
+            return get_json(pages[0], session, source="users").get("results", [])  # Extract user list
+
+        with ThreadPoolExecutor(max_workers=min(MAX_PAGE_WORKERS, len(pages))) as executor:
+            bodies = list(executor.map(lambda page_url: get_json(page_url, session, source="users"), pages))  # Keeps page order
+        return [user for body in bodies for user in body.get("results", [])][:requested_results(url or USERS_API)]  # The last page may overshoot
+    except (requests.exceptions.RequestException, ValueError) as e:  # ValueError: malformed JSON body
         print(f"Error fetching users: {e}")
-        return []
+        FETCH_ERRORS.inc(source="users")
+        return FailedFetch()
 
 # Fetch Transaction Data
-def fetch_transactions():
+def fetch_transactions(url=None, session=None):
     """Fetches transaction data with error handling."""
     try:
-        response = requests.get(TRANSACTIONS_API, timeout=10)
-        response.raise_for_status()
-        return response.json()  # Return transaction records
-    except requests.exceptions.RequestException as e:
+        return get_json(url or TRANSACTIONS_API, session, source="transactions")  # Return transaction records
+    except (requests.exceptions.RequestException, ValueError) as e:  # ValueError: malformed JSON body
         print(f"Error fetching transactions: {e}")
-        return []
+        FETCH_ERRORS.inc(source="transactions")
+        return FailedFetch()
+
+# Run a fetcher and record how long it took
+def _timed(fetcher, latencies, name):
+    start = time.perf_counter()
+    try:
+        with timed("fetch", name=name):
+            records = fetcher()
+        count_records("fetch", len(records), name=name)
+        return records
+    finally:
+        latencies[name] = time.perf_counter() - start
 
 # Fetch All Data
-def fetch_data():
-    """Fetches all data sources and returns as a dictionary."""
-    return {
-        "products": fetch_products(),
-        "users": fetch_users(),
-        "transactions": fetch_transactions()
+def fetch_data(latencies=None):
+    """Fetches all data sources concurrently and returns them as a dictionary.
+
+    If a `latencies` dict is given it is filled with the wall time in seconds of every
+    source plus the overall `total`, which is bounded by the slowest source.
+    """
+    latencies = {} if latencies is None else latencies
+    sources = {
+        "products": fetch_products,
+        "users": fetch_users,
+        "transactions": fetch_transactions
     }
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        futures = {name: executor.submit(_timed, fetcher, latencies, name) for name, fetcher in sources.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    latencies["total"] = time.perf_counter() - start
+
+    return results
@@ -0,0 +1,113 @@
+import heapq
+import os
+import pickle
+import tempfile
+import zlib
+from operator import itemgetter
+
+# Build-side rows held in memory; larger build sides are hash-partitioned and spilled to disk
+JOIN_BUILD_BUDGET = int(os.environ.get("JOIN_BUILD_BUDGET", "500000"))
+JOIN_PARTITIONS = int(os.environ.get("JOIN_PARTITIONS", "16"))
+JOIN_SPILL_DIR = os.environ.get("JOIN_SPILL_DIR") or None  # Defaults to the system temp directory
+MAX_PARTITION_DEPTH = 3  # Re-partitioning rounds for a partition that still exceeds the budget
+
+# Partition of a join key; `depth` salts the hash so every round splits keys differently
+def partition_of(key, depth, partitions):
+    return zlib.crc32(f"{depth}:{key}".encode("utf-8")) % partitions
+
+# Spill files hold a sequence of pickled tuples
+def read_spill(path):
+    with open(path, "rb") as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+def write_spill(files, partition, item):
+    pickle.dump(item, files[partition], protocol=pickle.HIGHEST_PROTOCOL)
+
+# Left hash join of a streamed probe side against a build side
+def hash_join(probe, build, probe_key, build_key, combine, build_value=None, budget=None, partitions=None, spill_dir=None):
+    """Lazily yields `combine(row, match)` for every row of `probe`, in probe order.
+
+    `match` is the `build_value` of the last build row whose `build_key` equals the row's
+    `probe_key` (None without a match), like a dict lookup built over `build`. Both sides
+    may be generators. While the build side fits in `budget` rows the join is a plain
+    in-memory hash join; past it, both sides are hash-partitioned into spill files and
+    joined one partition at a time, so memory stays bounded by the budget.
+    """
+    budget = budget or JOIN_BUILD_BUDGET
+    build_value = build_value or (lambda row: row)
+
+    build = iter(build)
+    table = {}
+    for row in build:
+        table[build_key(row)] = build_value(row)
+        if len(table) > budget:
+            remaining = ((build_key(row), build_value(row)) for row in build)
+            spilled = grace_join(((probe_key(row), row) for row in probe), drain(table, remaining), combine, budget,
+                                 partitions or JOIN_PARTITIONS, spill_dir or JOIN_SPILL_DIR)
+            for _, joined in spilled:
+                yield joined
+            return
+
+    for row in probe:
+        yield combine(row, table.get(probe_key(row)))
+
+# Empty the in-memory table while it is being spilled, then continue with the rest of the build side
+def drain(table, remaining):
+    while table:
+        yield table.popitem()
+    yield from remaining
+
+# Partitioned (grace) hash join over spill files
+def grace_join(probe, build_items, combine, budget, partitions, spill_dir, depth=0):
+    """Joins `(key, row)` probe items with `(key, value)` build items and yields `(sequence, joined)` in probe order.
+
+    Each partition is joined into its own output file; the sorted outputs are merged lazily.
+    """
+    with tempfile.TemporaryDirectory(prefix="join-", dir=spill_dir, ignore_cleanup_errors=True) as directory:
+        path = lambda kind, partition: os.path.join(directory, f"{kind}-{partition}")
+
+        build_files = [open(path("build", p), "wb") for p in range(partitions)]
+        try:
+            for key, value in build_items:
+                write_spill(build_files, partition_of(key, depth, partitions), (key, value))
+        finally:
+            for file in build_files:
+                file.close()
+
+        probe_files = [open(path("probe", p), "wb") for p in range(partitions)]
+        try:
+            for sequence, (key, row) in enumerate(probe):
+                write_spill(probe_files, partition_of(key, depth, partitions), (sequence, key, row))
+        finally:
+            for file in probe_files:
+                file.close()
+
+        for p in range(partitions):
+            with open(path("out", p), "wb") as output:
+                for item in join_partition(path("probe", p), path("build", p), combine, budget, partitions, directory, depth):
+                    pickle.dump(item, output, protocol=pickle.HIGHEST_PROTOCOL)
+            os.remove(path("probe", p))
+            os.remove(path("build", p))
+
+        yield from heapq.merge(*(read_spill(path("out", p)) for p in range(partitions)), key=itemgetter(0))
+
+# Join one spilled partition, re-partitioning it if its build side is still too large
+def join_partition(probe_path, build_path, combine, budget, partitions, spill_dir, depth):
+    table = {}
+    for key, value in read_spill(build_path):
+        table[key] = value
+        if len(table) > budget and depth < MAX_PARTITION_DEPTH:
+            table.clear()
+            probe = ((key, (sequence, row)) for sequence, key, row in read_spill(probe_path))  # Keep the original order
+            inner = grace_join(probe, read_spill(build_path), lambda item, match: (item[0], combine(item[1], match)),
+                               budget, partitions, spill_dir, depth + 1)
+            for _, item in inner:
+                yield item
+            return
+
+    for sequence, key, row in read_spill(probe_path):
+        yield sequence, combine(row, table.get(key))
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+from metrics import REGISTRY
+
+# On-disk cache of upstream responses, keyed by URL
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", os.path.join("json", "http_cache"))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("HTTP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # Least recently used entries are evicted beyond this
+
+# Seconds a cached response is used without contacting the source; afterwards it is revalidated
+# with If-None-Match / If-Modified-Since. The product catalog rarely changes.
+SOURCE_TTLS = {
+    "products": float(os.environ.get("HTTP_CACHE_TTL_PRODUCTS", "3600")),
+    "users": float(os.environ.get("HTTP_CACHE_TTL_USERS", "0")),
+    "transactions": float(os.environ.get("HTTP_CACHE_TTL_TRANSACTIONS", "0"))
+}
+
+# Seconds past the TTL during which the stale body is returned at once and revalidated in the background
+STALE_WHILE_REVALIDATE = float(os.environ.get("HTTP_CACHE_STALE_WHILE_REVALIDATE", "0"))
+
+CACHE_REQUESTS = REGISTRY.counter("http_cache_requests_total", "Upstream requests by cache outcome (fresh, stale, revalidated, miss, stale_on_error).")
+
+# Cache key of a request
+def cache_key(url, params=None):
+    if params:
+        url = f"{url}{'&' if '?' in url else '?'}{urlencode(sorted(dict(params).items()))}"
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+# Conditional request headers for a cached entry
+def validators(entry):
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+class HTTPCache:
+    """Stores response bodies (`<key>.body`) with their validators (`<key>.json`) in `directory`.
+
+    A body file's mtime is its last use, so eviction drops the least recently used entries
+    once the cache holds more than `max_bytes`.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, ttls=None, stale_while_revalidate=None):
+        self.directory = directory or HTTP_CACHE_DIR
+        self.max_bytes = HTTP_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttls = SOURCE_TTLS if ttls is None else ttls
+        self.stale_while_revalidate = STALE_WHILE_REVALIDATE if stale_while_revalidate is None else stale_while_revalidate
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def lookup(self, key):
+        """Returns the entry metadata, or None if the key is not cached."""
+        try:
+            with open(self._path(key, "json"), encoding="utf-8") as file:
+                entry = json.load(file)
+            if not os.path.exists(self._path(key, "body")):
+                return None
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def read_body(self, key):
+        """Returns the cached body, or None if it was evicted since the lookup."""
+        path = self._path(key, "body")
+        try:
+            with open(path, "rb") as file:
+                body = file.read()
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return body
+
+    def discard(self, url, params=None):
+        """Removes the entry of a request."""
+        key = cache_key(url, params)
+        with self._lock:
+            for suffix in ("json", "body"):
+                try:
+                    os.remove(self._path(key, suffix))
+                except OSError:
+                    pass
+
+    def _write(self, path, content):
+        temp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(temp_path, "wb") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+    def store(self, key, url, response):
+        """Caches a 200 response unless it is marked no-store; returns its body."""
+        body = response.content
+        if "no-store" in response.headers.get("Cache-Control", ""):
+            return body
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "stored_at": time.time(),
+            "size": len(body)
+        }
+        with self._lock:
+            self._write(self._path(key, "body"), body)  # Body first: metadata never points at a missing body
+            self._write(self._path(key, "json"), json.dumps(entry).encode("utf-8"))
+        self.evict()
+        return body
+
+    def freshen(self, key, entry, response):
+        """Restarts the TTL of an entry after a 304, keeping any updated validators."""
+        entry = dict(entry, stored_at=time.time())
+        entry["etag"] = response.headers.get("ETag") or entry.get("etag")
+        entry["last_modified"] = response.headers.get("Last-Modified") or entry.get("last_modified")
+        with self._lock:
+            self._write(self._path(key, "json"), json.dumps(entry).encode("utf-8"))
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in `max_bytes`."""
+        with self._lock:
+            bodies = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".body"):
+                    try:
+                        stat = os.stat(os.path.join(self.directory, name))
+                    except OSError:
+                        continue
+                    bodies.append((stat.st_mtime, stat.st_size, name[:-len(".body")]))
+            total = sum(size for _, size, _ in bodies)
+            for _, size, key in sorted(bodies):
+                if total <= self.max_bytes:
+                    break
+                for suffix in ("json", "body"):
+                    try:
+                        os.remove(self._path(key, suffix))
+                    except OSError:
+                        pass
+                total -= size
+
+    def _revalidate(self, key, url, entry, fetch):
+        try:
+            self._conditional_fetch(key, url, entry, fetch)
+        except Exception as e:
+            print(f"Error revalidating {url}: {e}")
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+    def _conditional_fetch(self, key, url, entry, fetch):
+        response = fetch(validators(entry) if entry else {})
+        if response.status_code == 304 and entry is not None:
+            body = self.read_body(key)
+            if body is not None:
+                self.freshen(key, entry, response)
+                CACHE_REQUESTS.inc(result="revalidated")
+                return body, None
+            response = fetch({})  # Evicted meanwhile: fetch the body unconditionally
+        response.raise_for_status()
+        CACHE_REQUESTS.inc(result="miss")
+        return self.store(key, url, response), response
+
+    def fetch(self, url, fetch, params=None, source="other"):
+        """Returns `(body, response)` for `url`, where `fetch(headers)` performs the actual request.
+
+        `response` is None when the body came from the cache. Fresh entries (younger than the
+        source's TTL) are returned without a request, stale ones are revalidated with a
+        conditional request and, within the stale-while-revalidate window, returned at once while
+        the revalidation runs in the background. If the request fails, a cached body is used instead.
+        """
+        key = cache_key(url, params)
+        entry = self.lookup(key)
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            ttl = self.ttls.get(source, 0)
+            body = self.read_body(key) if age < ttl + self.stale_while_revalidate else None
+            if body is not None and age < ttl:
+                CACHE_REQUESTS.inc(result="fresh")
+                return body, None
+            if body is not None:
+                with self._lock:
+                    start = key not in self._revalidating
+                    self._revalidating.add(key)
+                if start:
+                    threading.Thread(target=self._revalidate, args=(key, url, entry, fetch), daemon=True).start()
+                CACHE_REQUESTS.inc(result="stale")
+                return body, None
+
+        try:
+            return self._conditional_fetch(key, url, entry, fetch)
+        except Exception as e:
+            body = self.read_body(key) if entry is not None else None
+            if body is None:
+                raise
+            print(f"Error fetching {url}, serving the cached response: {e}")
+            CACHE_REQUESTS.inc(result="stale_on_error")
+            return body, None
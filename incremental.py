@@ -0,0 +1,411 @@
+import json
+import os
+import threading
+
+from aggregations import IncrementalAggregates, product_specs, transaction_specs, user_specs
+from business_rules import build_product_lookup, build_user_lookup, join_product_row, join_user_row
+from records import FailedFetch, TransactionRecord, from_dict, parse_entity_id, to_json
+from snapshot_writer import SNAPSHOT_ROOT, write_file_atomic
+from transform import (
+    build_lookup_index, iter_transform_transactions, resolve_product, resolve_user,
+    transform_product, transform_transaction, transform_user
+)
+from validation import DEAD_LETTERS, content_hash, validated
+from windows import TransactionWindows
+
+# Enable incremental ingestion for the API's background pipeline
+INCREMENTAL_INGEST = os.environ.get("INCREMENTAL_INGEST", "0") == "1"
+
+# Source key -> content hash (and last transformed record) of the previous run
+STATE_FILE = os.environ.get("INGEST_STATE_FILE", os.path.join(SNAPSHOT_ROOT, "ingest_state.json"))
+
+# Stable upstream key of every source record
+SOURCE_KEYS = {
+    "products": lambda p: str(p.get("id")),
+    "users": lambda u: str(u.get("login", {}).get("uuid")),
+    "transactions": lambda t: str(t.get("id"))
+}
+
+# Pair records with their source keys
+def keyed(records, key_fn):
+    """Yields `(source_key, record)`; repeated keys get an occurrence suffix so no record is lost."""
+    seen = {}
+    for record in records:
+        key = key_fn(record)
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        yield (key if occurrence == 0 else f"{key}#{occurrence}"), record
+
+# Load / save the ingestion state
+def load_state(path=None):
+    try:
+        with open(path or STATE_FILE, encoding="utf-8") as file:
+            state = json.load(file)
+        for entries in state.values():
+            for entry in entries.values():
+                entry["record"] = from_dict(entry["record"])  # Back to slotted records
+        return state
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error loading ingestion state, starting from scratch: {e}")
+        return {}
+
+def save_state(state, path=None):
+    path = path or STATE_FILE
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_file_atomic(path, json.dumps(state, ensure_ascii=False, separators=(",", ":"), default=to_json).encode("utf-8"))
+
+# Diff one source against its previous state
+def diff_source(raw_records, previous, key_fn, transform, refresh=None):
+    """Transforms only new or changed records and returns `(entries, delta)`.
+
+    `entries` maps source keys to `{"hash", "record"}` in upstream order. Changed records
+    keep their previous `entity_id`. `refresh(raw, record)` may return an updated copy of
+    an unchanged record (or None to keep it). `delta` lists `added` `(key, record)`,
+    `updated` `(key, old, new)` and `deleted` `(key, old)` entries.
+    """
+    entries = {}
+    delta = {"added": [], "updated": [], "deleted": []}
+
+    for key, raw in keyed(raw_records, key_fn):
+        digest = content_hash(raw)
+        old = previous.get(key)
+        if old is not None and old["hash"] == digest:
+            record = refresh(raw, old["record"]) if refresh else None
+            if record is None:
+                entries[key] = old
+                continue
+        else:
+            record = transform(raw)
+            if not record:
+                continue  # The transform already reported the error
+            if old is not None:
+                record["entity_id"] = old["record"]["entity_id"]  # Keep the identity of changed records
+
+        entries[key] = {"hash": digest, "record": record}
+        if old is not None:
+            delta["updated"].append((key, old["record"], record))
+        else:
+            delta["added"].append((key, record))
+
+    for key, old in previous.items():
+        if key not in entries:
+            delta["deleted"].append((key, old["record"]))
+
+    return entries, delta
+
+# Re-resolve the user/product references of an unchanged transaction
+def refresh_references(raw, record, index):
+    user = resolve_user(raw, index)
+    product = resolve_product(raw, index)
+    user_entity_id = parse_entity_id(user["entity_id"]) if user else None
+    product_entity_id = parse_entity_id(product["entity_id"]) if product else None
+
+    if not isinstance(record, TransactionRecord):
+        record = from_dict(record)
+    if record.user_entity_id == user_entity_id and record.product_entity_id == product_entity_id:
+        return None
+    return record.replace(user_entity_id=user_entity_id, product_entity_id=product_entity_id)
+
+# Does a delta contain any change?
+def has_changes(delta):
+    return any(delta.values())
+
+def empty_delta():
+    return {"added": [], "updated": [], "deleted": []}
+
+MAX_ORDINAL_DEPTH = 8  # Nesting of ordinals of keys inserted between others before all are renumbered
+
+# Ordinals of keys in list order that keep the ordinal of every key that was already there
+def assign_ordinals(keys, previous):
+    """Returns `{key: ordinal}` for `keys` (in list order), or None if the keys in `previous` changed their relative order.
+
+    Ordinals are int tuples. A key already in `previous` keeps its ordinal, so aggregate state
+    stored under it stays valid; new keys get ordinals between their neighbours, e.g. (4, 1)
+    between (4,) and (5,), or (k,) past the last one. None also means the ordinals nest too
+    deep; the caller then renumbers every key.
+    """
+    ordinals = {}
+    pending = []  # New keys since the last kept one
+    last = None
+
+    def place(low, high):
+        count = len(pending)
+        if low is None:
+            start = (high[0] if high else count) - count
+            ordinals.update((key, (start + i,)) for i, key in enumerate(pending))
+        elif high is None:
+            ordinals.update((key, (low[0] + 1 + i,)) for i, key in enumerate(pending))
+        else:
+            if len(low) >= MAX_ORDINAL_DEPTH:
+                return False
+            start = high[len(low)] - count if high[:len(low)] == low else 0  # Stay below `high` when it extends `low`
+            ordinals.update((key, low + (start + i,)) for i, key in enumerate(pending))
+        return True
+
+    for key in keys:
+        ordinal = previous.get(key)
+        if ordinal is None:
+            pending.append(key)
+            continue
+        if last is not None and ordinal <= last:
+            return None
+        if pending and not place(last, ordinal):
+            return None
+        ordinals[key] = last = ordinal
+        pending = []
+    if pending:
+        place(last, None)
+    return ordinals
+
+# Incremental pipeline state
+class IncrementalIngestor:
+    """Applies upstream deltas to the transformed data, joins and aggregates of the previous run.
+
+    The first run in a process builds joins and aggregates in full (transforming only what
+    changed since the persisted state); later runs only touch the records in the delta, the
+    join rows that depend on them and the aggregate groups they belong to. Records are
+    ordered for the aggregates by the ordinals of `assign_ordinals`. `ingest_stream` applies
+    streamed transactions between runs the same way, updating the join lists in place.
+    """
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path
+        self.state = None
+        self.products = []  # Record lists of the last run
+        self.users = []
+        self.transactions = []
+        self.transactions_with_products = []  # Rows of join_transactions_with_products
+        self.transactions_with_users = []  # Rows of join_transactions_with_users
+        self.positions = {}  # Transaction key -> position in the three transaction lists
+        self.ordinals = {}  # Source -> {key: ordinal}
+        self.by_parcel_id = {}  # Parcel id -> transaction keys
+        self.by_user_name = {}  # User name -> transaction keys
+        self.product_lookup = {}  # Lookups of the joins, built once per run
+        self.user_lookup = {}
+        self.aggregates = None
+        self.windows = None  # Time-windowed counts of streamed transactions (the only ones with an event time)
+        self.last_delta = None
+        self.lookup_index = None  # Users and products of the last run, for resolving streamed transactions
+        self.ready = threading.Event()  # Set once the first run has built joins and aggregates
+        self.sequence = 0  # Numbers every output, so a publisher can drop one that a newer output overtook
+        self._lock = threading.Lock()
+
+    def ingest(self, raw_data):
+        """Returns the pipeline output for `raw_data`: entity lists, joins and aggregates."""
+        with self._lock:
+            output = self._ingest(raw_data)
+        self.ready.set()
+        return output
+
+    def _ingest(self, raw_data):
+        if self.state is None:
+            self.state = load_state(self.state_path)
+
+        product_entries, product_delta = self._diff("products", raw_data.get("products", []), transform_product)
+        user_entries, user_delta = self._diff("users", raw_data.get("users", []), transform_user)
+        products = [entry["record"] for entry in product_entries.values()]
+        users = [entry["record"] for entry in user_entries.values()]
+
+        index = build_lookup_index(users, products)
+        refresh = None
+        if has_changes(product_delta) or has_changes(user_delta):  # Names and phones used for resolution may have changed
+            refresh = lambda raw, record: refresh_references(raw, record, index)
+        raw_transactions = raw_data.get("transactions", [])
+        transaction_entries, transaction_delta = self._diff(
+            "transactions", raw_transactions, lambda raw: transform_transaction(raw, users, products, index), refresh)
+
+        # Streamed transactions the upstream source does not list (yet) are kept; once it lists them it owns them
+        if not isinstance(raw_transactions, FailedFetch):
+            for key, entry in transaction_entries.items():
+                if entry.get("streamed"):
+                    transaction_entries[key] = {"hash": entry["hash"], "record": entry["record"]}
+        streamed = {key: entry for key, entry in self.state.get("transactions", {}).items()
+                    if entry.get("streamed") and transaction_entries.get(key, entry).get("streamed")}
+        transaction_delta["deleted"] = [(key, old) for key, old in transaction_delta["deleted"] if key not in streamed]
+        transaction_entries.update(streamed)
+
+        entries = {"products": product_entries, "users": user_entries, "transactions": transaction_entries}
+        deltas = {"products": product_delta, "users": user_delta, "transactions": transaction_delta}
+        self.products, self.users = products, users
+        self.product_lookup, self.user_lookup = build_product_lookup(products), build_user_lookup(users)
+        first_run = self.aggregates is None
+        self._apply_joins(transaction_entries, deltas, rebuild=first_run)
+        self._apply_aggregates(entries, deltas, rebuild=first_run)
+        self.windows = TransactionWindows((entry["record"] for entry in streamed.values()), event_times=True)
+
+        self.state = entries
+        save_state(self.state, self.state_path)
+        self.last_delta = {name: {kind: len(items) for kind, items in delta.items()} for name, delta in deltas.items()}
+        self.lookup_index = index
+        return self._output()
+
+    def _diff(self, source, raw_records, transform, refresh=None):
+        """diff_source of one source; a source whose fetch failed keeps its previous entries (an empty delta)."""
+        previous = self.state.get(source, {})
+        if isinstance(raw_records, FailedFetch):
+            return dict(previous), empty_delta()
+        return diff_source(validated(source, raw_records), previous, SOURCE_KEYS[source], transform, refresh)
+
+    def ingest_stream(self, raw_transactions):
+        """Adds streamed transactions (updating earlier ones with the same id) and returns the output like `ingest`.
+
+        Needs a first `ingest` run. Only the join rows, aggregate groups and windows of the
+        new records are touched, in O(batch); the output's transaction lists are shallow
+        copies of lists updated in place. The state file is written by the next run or `save()`.
+        """
+        with self._lock:
+            if self.aggregates is None:
+                raise RuntimeError("Streamed transactions need a first pipeline run")
+            index = self.lookup_index or build_lookup_index(self.users, self.products)
+
+            batch = {}  # The last version of a transaction within one batch wins
+            records = iter_transform_transactions(validated("transactions", raw_transactions, new_run=False), self.users, self.products, index)
+            for raw, record in records:
+                if record:
+                    batch[SOURCE_KEYS["transactions"](raw)] = (content_hash(raw), record)
+                else:
+                    DEAD_LETTERS.add("transactions", "transform error", raw)
+
+            transaction_entries = self.state["transactions"]
+            ordinals = self.ordinals["transactions"]
+            aggregates = self.aggregates["transactions"]
+            delta = empty_delta()
+            for key, (digest, record) in batch.items():
+                old = transaction_entries.get(key)
+                if old is not None:
+                    if old["hash"] == digest:
+                        continue
+                    record["entity_id"] = old["record"]["entity_id"]
+                    delta["updated"].append((key, old["record"], record))
+                    if old.get("streamed"):
+                        self.windows.remove(old["record"])
+                    self._index_transaction(key, old["record"], remove=True)
+                    aggregates.remove(key)
+                else:
+                    delta["added"].append((key, record))
+                    last = ordinals[next(reversed(transaction_entries))] if transaction_entries else (-1,)
+                    ordinals[key] = (last[0] + 1,)  # After every other transaction, like the entry
+                    self.positions[key] = len(self.transactions)
+                    self.transactions.append(None)
+                    self.transactions_with_products.append(None)
+                    self.transactions_with_users.append(None)
+                if old is None or old.get("streamed"):  # Keys of the upstream source stay owned by it
+                    transaction_entries[key] = {"hash": digest, "record": record, "streamed": True}
+                    self.windows.add(record)
+                else:
+                    transaction_entries[key] = {"hash": digest, "record": record}
+
+                self._index_transaction(key, record)
+                self._join(key, record)
+                aggregates.add(key, ordinals[key], record)
+
+            self.last_delta = {name: empty_delta() for name in ("products", "users")}
+            self.last_delta["transactions"] = delta
+            self.last_delta = {name: {kind: len(items) for kind, items in delta.items()} for name, delta in self.last_delta.items()}
+            return self._output()
+
+    def save(self):
+        """Writes the state file, e.g. after streamed batches."""
+        with self._lock:
+            if self.state is not None:
+                save_state(self.state, self.state_path)
+
+    def _output(self):
+        self.sequence += 1
+        return {
+            "sequence": self.sequence,
+            "products": self.products,
+            "users": self.users,
+            "transactions": list(self.transactions),  # Copies: streamed batches update the lists in place
+            "transactions_with_products": list(self.transactions_with_products),
+            "transactions_with_users": list(self.transactions_with_users),
+            "product_aggregates": self.aggregates["products"].results(),
+            "user_aggregates": self.aggregates["users"].results(),
+            "transaction_aggregates": self.aggregates["transactions"].results(),
+            "transaction_windows": self.windows.copy()  # Later batches keep changing self.windows
+        }
+
+    def _index_transaction(self, key, record, remove=False):
+        data = record.get("data", {})
+        for reverse_index, value in ((self.by_parcel_id, str(data.get("parcel_id", ""))), (self.by_user_name, data.get("user_name"))):
+            keys = reverse_index.setdefault(value, set())
+            if remove:
+                keys.discard(key)
+            else:
+                keys.add(key)
+
+    # Put a transaction and its join rows at its position
+    def _join(self, key, record):
+        position = self.positions[key]
+        self.transactions[position] = record
+        self.transactions_with_products[position] = join_product_row(record, self.product_lookup)
+        self.transactions_with_users[position] = join_user_row(record, self.user_lookup)
+
+    def _apply_joins(self, transaction_entries, deltas, rebuild=False):
+        """Lays out the transaction lists in entry order, joining only transactions in the delta or whose product or user changed."""
+        affected = set()
+        if rebuild:
+            self.by_parcel_id, self.by_user_name = {}, {}
+            for key, entry in transaction_entries.items():
+                self._index_transaction(key, entry["record"])
+            affected = set(transaction_entries)
+        else:
+            transaction_delta = deltas["transactions"]
+            for key, old in transaction_delta["deleted"]:
+                self._index_transaction(key, old, remove=True)
+            for key, old, new in transaction_delta["updated"]:
+                self._index_transaction(key, old, remove=True)
+                self._index_transaction(key, new)
+                affected.add(key)
+            for key, new in transaction_delta["added"]:
+                self._index_transaction(key, new)
+                affected.add(key)
+
+            # Join rows of transactions whose product or user changed
+            for name, reverse_index, field in (("products", self.by_parcel_id, "id"), ("users", self.by_user_name, "name")):
+                delta = deltas[name]
+                changed = [record for _, record in delta["added"]] + [record for _, record in delta["deleted"]]
+                changed += [record for _, old, new in delta["updated"] for record in (old, new)]
+                for record in changed:
+                    value = record["data"].get(field)
+                    affected |= reverse_index.get(str(value) if name == "products" else value, set())
+
+        previous = self.positions
+        rows = (self.transactions_with_products, self.transactions_with_users)
+        self.positions = {key: position for position, key in enumerate(transaction_entries)}
+        self.transactions = [entry["record"] for entry in transaction_entries.values()]
+        self.transactions_with_products = [None] * len(self.transactions)
+        self.transactions_with_users = [None] * len(self.transactions)
+        for key, position in self.positions.items():
+            if key in affected:
+                self._join(key, self.transactions[position])
+            else:
+                self.transactions_with_products[position] = rows[0][previous[key]]
+                self.transactions_with_users[position] = rows[1][previous[key]]
+
+    def _apply_aggregates(self, entries, deltas, rebuild=False):
+        """Applies the delta of every source to its aggregates, or rebuilds them if its records were reordered."""
+        if rebuild:
+            self.aggregates = {
+                "products": IncrementalAggregates(product_specs()),
+                "users": IncrementalAggregates(user_specs()),
+                "transactions": IncrementalAggregates(transaction_specs())
+            }
+        for name, delta in deltas.items():
+            aggregates = self.aggregates[name]
+            ordinals = None if rebuild else assign_ordinals(entries[name], self.ordinals.get(name, {}))
+            if ordinals is None:
+                self.ordinals[name] = {key: (position,) for position, key in enumerate(entries[name])}
+                aggregates.rebuild((key, self.ordinals[name][key], entry["record"]) for key, entry in entries[name].items())
+                continue
+
+            self.ordinals[name] = ordinals
+            for key, _ in delta["deleted"]:
+                aggregates.remove(key)
+            for key, _, new in delta["updated"]:
+                aggregates.remove(key)
+                aggregates.add(key, ordinals[key], new)
+            for key, new in delta["added"]:
+                aggregates.add(key, ordinals[key], new)
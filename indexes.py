@@ -0,0 +1,86 @@
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from collections.abc import Mapping
+
+# Marker for a missing field
+MISSING = object()
+
+# Fields with a hash index, per entity type (dotted paths into the entity envelope). A hash index
+# maps each value to all positions holding it, so it doubles as the inverted index of a category
+INDEXED_FIELDS = {
+    "product": ["data.id", "data.category"],
+    "user": ["data.id", "data.name", "data.email", "data.gender"],
+    "transaction": ["data.transaction_id", "data.status", "data.sender", "data.user_name"]
+}
+
+# Numeric fields with a sorted index for range filters
+SORTED_FIELDS = {
+    "product": ["data.price", "data.rating.rate"]
+}
+
+# Field that identifies a single record, per entity type
+PRIMARY_KEYS = {"product": "data.id", "user": "data.id", "transaction": "data.transaction_id"}
+
+# Read a dotted path such as "data.rating.count" from a record
+def get_path(record, path):
+    """Returns the value at `path`, or MISSING if any part of it is absent."""
+    value = record
+    for part in path.split("."):
+        if not isinstance(value, Mapping) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+# Hash index: value -> positions of the records holding it
+def build_hash_index(records, path):
+    """Maps the string form of every value at `path` to the sorted positions of its records (null values are left out)."""
+    index = defaultdict(list)
+    for position, record in enumerate(records):
+        value = get_path(record, path)
+        if value is not MISSING and value is not None:
+            index[str(value)].append(position)
+    return dict(index)
+
+# Sorted index: numeric values in ascending order, with the position of each one's record
+class SortedIndex:
+    """Answers range filters with two binary searches; `values` and `positions` may be any sequences (e.g. mapped arrays)."""
+
+    def __init__(self, values, positions):
+        self.values = values
+        self.positions = positions
+
+    def range(self, conditions):
+        """Positions (in value order) of the records satisfying every `(op, value)` of query.RANGE_OPERATORS."""
+        low, high = 0, len(self.values)
+        for op, value in conditions:
+            if op == "gte":
+                low = max(low, bisect_left(self.values, value))
+            elif op == "gt":
+                low = max(low, bisect_right(self.values, value))
+            elif op == "lte":
+                high = min(high, bisect_right(self.values, value))
+            elif op == "lt":
+                high = min(high, bisect_left(self.values, value))
+        return self.positions[low:high] if low < high else []
+
+def build_sorted_index(records, path):
+    """Sorts the values at `path` that range filters can compare (everything float() accepts, except NaN)."""
+    pairs = []
+    for position, record in enumerate(records):
+        value = get_path(record, path)
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if not math.isnan(value):
+            pairs.append((value, position))
+    pairs.sort()
+    return SortedIndex([value for value, _ in pairs], [position for _, position in pairs])
+
+# All indexes of one entity list
+def build_indexes(records, entity_type):
+    """Builds the hash indexes in INDEXED_FIELDS and the sorted indexes in SORTED_FIELDS for `entity_type`."""
+    indexes = {path: build_hash_index(records, path) for path in INDEXED_FIELDS.get(entity_type, [])}
+    indexes.update((path, build_sorted_index(records, path)) for path in SORTED_FIELDS.get(entity_type, []))
+    return indexes
@@ -0,0 +1,70 @@
+import json
+import threading
+
+try:
+    import orjson  # Optional, much faster encoder
+except ImportError:
+    orjson = None
+
+from records import to_json
+
+# Serialize a response body to the same compact JSON as FastAPI's default JSONResponse
+def serialize_response(content):
+    """Encodes `content` to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content, default=to_json, option=orjson.OPT_NON_STR_KEYS)  # e.g. the None key of unresolved users
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), default=to_json).encode("utf-8")
+
+# Materialized insight views
+class InsightCache:
+    """Keeps insight results computed once per data snapshot, together with their serialized bytes.
+
+    Entries are keyed by view name and tagged with the snapshot version they were computed
+    from; asking for a different version drops every entry, so nothing is recomputed
+    until the underlying data actually changes.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, name, version, compute):
+        """Returns `(content, body)` for view `name`, calling `compute()` only on a miss."""
+        with self._lock:
+            if version != self.version:
+                self._reset(version)
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+            content = compute()
+            entry = (content, serialize_response(content))
+            self.entries[name] = entry
+            return entry
+
+    def invalidate(self, version=None):
+        """Drops all cached views and records the snapshot version they will be rebuilt for."""
+        with self._lock:
+            self._reset(version)
+
+    def _reset(self, version):
+        if self.entries:
+            self.invalidations += 1
+        self.entries = {}
+        self.version = version
+
+    def stats(self):
+        """Returns the cache counters."""
+        return {
+            "version": self.version,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations
+        }
@@ -1,79 +1,55 @@
-from collections import defaultdict
-from datetime import datetime
+import heapq
+
+from aggregations import AGE_BUCKETS, aggregate_products, aggregate_transactions, aggregate_users
+
+# Views below read precomputed aggregates (see aggregations.py) when given, so a caller
+# computing several insights scans each entity list once instead of once per insight.
 
 ### ---- USER INSIGHTS ---- ###
 
 # Total Transactions Per User
-def total_transactions_per_user(transactions):
+def total_transactions_per_user(transactions, aggregates=None):
     """Counts the number of transactions for each user."""
     try:
-        user_transactions = defaultdict(int)
-        for transaction in transactions:
-            user_name = transaction["data"].get("user_name", "Unknown")
-            user_transactions[user_name] += 1  # Increment transaction count per user
-        return dict(user_transactions)
+        aggregates = aggregate_transactions(transactions) if aggregates is None else aggregates
+        return dict(aggregates["transactions_per_user"])
     except Exception as e:
         print(f"Error in total_transactions_per_user: {e}")
         return {}
 
 # User with Most Transactions
-def user_with_most_transactions(transactions):
+def user_with_most_transactions(transactions, aggregates=None):
     """Finds the user who made the most transactions."""
     try:
-        user_transactions = total_transactions_per_user(transactions)
+        user_transactions = total_transactions_per_user(transactions, aggregates)
         return max(user_transactions, key=user_transactions.get, default=None)
     except Exception as e:
         print(f"Error in user_with_most_transactions: {e}")
         return None
 
 # Users with No Transactions
-def users_with_no_transactions(users, transactions):
+def users_with_no_transactions(users, transactions, user_aggregates=None, transaction_aggregates=None):
     """Finds users who haven't made any transactions."""
     try:
-        user_names = {user["data"]["name"] for user in users}
-        users_with_transactions = {transaction["data"].get("user_name", "Unknown") for transaction in transactions}
+        user_aggregates = aggregate_users(users) if user_aggregates is None else user_aggregates
+        transaction_aggregates = aggregate_transactions(transactions) if transaction_aggregates is None else transaction_aggregates
+        user_names = set(user_aggregates["user_names"])
+        users_with_transactions = set(transaction_aggregates["transactions_per_user"])
         return list(user_names - users_with_transactions)
     except Exception as e:
         print(f"Error in users_with_no_transactions: {e}")
         return []
 
 # User Statistics (Total, Gender, Age Distribution)
-def calculate_user_statistics(users):
+def calculate_user_statistics(users, aggregates=None):
     """Calculates total users, gender distribution, and age distribution."""
     try:
-        total_users = len(users)
-        gender_count = defaultdict(int)
-        age_categories = {"0-18": 0, "19-30": 0, "31-45": 0, "46-60": 0, "61+": 0}
-        current_year = datetime.utcnow().year
-
-        for user in users:
-            user_data = user.get("data", {})
-            gender = user_data.get("gender", "Unknown")
-            dob = user_data.get("dob", "")
-
-            # Calculate age
-            birth_year = int(dob[:4]) if dob and len(dob) >= 4 else current_year  # Extract year safely
-            age = current_year - birth_year
-
-            # Categorize age
-            if age <= 18:
-                age_categories["0-18"] += 1
-            elif age <= 30:
-                age_categories["19-30"] += 1
-            elif age <= 45:
-                age_categories["31-45"] += 1
-            elif age <= 60:
-                age_categories["46-60"] += 1
-            else:
-                age_categories["61+"] += 1
-
-            # Count gender
-            gender_count[gender] += 1
-
+        aggregates = aggregate_users(users) if aggregates is None else aggregates
+        age_count = aggregates["age_count"]
         return {
-            "total_users": total_users,
-            "gender_distribution": dict(gender_count),
-            "age_distribution": age_categories
+            "total_users": aggregates["total_users"],
+            "gender_distribution": dict(aggregates["gender_count"]),
+            "age_distribution": {bucket: age_count.get(bucket, 0) for bucket in AGE_BUCKETS}
         }
     except Exception as e:
         print(f"Error in calculate_user_statistics: {e}")
@@ -82,70 +58,56 @@ def calculate_user_statistics(users):
 ### ---- PRODUCT INSIGHTS ---- ###
 
 # Top-Selling Products
-def top_selling_products(products, top_n=5):
+def top_selling_products(products, top_n=5, aggregates=None):
     """Finds the top N best-selling products based on rating count."""
     try:
-        product_sales = {}
-
-        for product in products:
-            title = product["data"].get("title", "Unknown")
-            sales_count = product["data"].get("rating", {}).get("count", 0)  # Use rating count as sales metric
-
-            if title:
-                product_sales[title] = sales_count
-
-        return sorted(product_sales.items(), key=lambda x: x[1], reverse=True)[:top_n]  # Return top N products
+        aggregates = aggregate_products(products) if aggregates is None else aggregates
+        product_sales = aggregates["sales_by_title"]  # Rating count is used as sales metric
+        return heapq.nlargest(top_n, product_sales.items(), key=lambda x: x[1])  # Return top N products
     except Exception as e:
         print(f"Error in top_selling_products: {e}")
         return []
 
 # Most Expensive & Cheapest Products
-def expensive_and_cheapest_products(products):
+def expensive_and_cheapest_products(products, aggregates=None):
     """Finds the most expensive and cheapest products."""
     try:
-        sorted_products = sorted(products, key=lambda x: x["data"].get("price", 0))
+        aggregates = aggregate_products(products) if aggregates is None else aggregates
+        cheapest, most_expensive = aggregates["cheapest"], aggregates["most_expensive"]
         return {
-            "cheapest_product": sorted_products[0]["data"] if sorted_products else None,
-            "most_expensive_product": sorted_products[-1]["data"] if sorted_products else None
+            "cheapest_product": cheapest["data"] if cheapest else None,
+            "most_expensive_product": most_expensive["data"] if most_expensive else None
         }
     except Exception as e:
         print(f"Error in expensive_and_cheapest_products: {e}")
         return {"cheapest_product": None, "most_expensive_product": None}
 
 # Category-Wise Revenue
-def category_wise_revenue(products):
+def category_wise_revenue(products, aggregates=None):
     """Calculates total revenue generated per product category."""
     try:
-        category_revenue = defaultdict(float)
-
-        for product in products:
-            category = product["data"].get("category", "Unknown")
-            price = product["data"].get("price", 0)
-
-            if category:
-                category_revenue[category] += price  # Sum revenue per category
-
-        return dict(category_revenue)
+        aggregates = aggregate_products(products) if aggregates is None else aggregates
+        return dict(aggregates["category_revenue"])
     except Exception as e:
         print(f"Error in category_wise_revenue: {e}")
         return {}
 
 # Top Revenue-Generating Categories
-def top_revenue_categories(products, top_n=5):
+def top_revenue_categories(products, top_n=5, aggregates=None):
     """Finds the top N revenue-generating product categories."""
     try:
-        revenue_data = category_wise_revenue(products)
-        sorted_categories = sorted(revenue_data.items(), key=lambda x: x[1], reverse=True)
-        return sorted_categories[:top_n]
+        revenue_data = category_wise_revenue(products, aggregates)
+        return heapq.nlargest(top_n, revenue_data.items(), key=lambda x: x[1])
     except Exception as e:
         print(f"Error in top_revenue_categories: {e}")
         return []
 
 # Most Rated Products
-def most_rated_products(products):
+def most_rated_products(products, aggregates=None):
     """Finds the top 5 most rated products based on customer reviews."""
     try:
-        return sorted(products, key=lambda x: x["data"].get("rating", {}).get("count", 0), reverse=True)[:5]
+        aggregates = aggregate_products(products) if aggregates is None else aggregates
+        return list(aggregates["most_rated"])
     except Exception as e:
         print(f"Error in most_rated_products: {e}")
         return []
@@ -1,10 +1,24 @@
-from fastapi import FastAPI, HTTPException
+import hmac
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 import uvicorn
-import json
 
 # Import functions to fetch and transform data
 from fetch_data import fetch_data
-from transform import transform_data
+from transform import shutdown_pool, transform_data
+from insight_cache import InsightCache, serialize_response
+from indexes import PRIMARY_KEYS
+from query import lookup_record, make_etag, query_records
+from runner import PipelineRunner
+from sqlite_store import STORAGE_BACKEND
+from incremental import INCREMENTAL_INGEST, IncrementalIngestor
+from metrics import HTTP_SECONDS, REGISTRY, timed
+from streaming import STREAM_SOURCE, StreamIngestor
+from validation import DEAD_LETTERS
+from windows import parse_window
 
 # Import user and product insights
 from insights import (
@@ -13,88 +27,181 @@ from insights import (
 )
 
 # Import business logic functions
-from business_rules import (
-    join_transactions_with_products, join_transactions_with_users, 
-    calculate_user_spending, most_popular_categories, average_transaction_value
-)
+from business_rules import calculate_user_spending, most_popular_categories, average_transaction_value
 
-# Initializing FastAPI
-app = FastAPI()
+# With INCREMENTAL_INGEST=1 only new or changed records are transformed between runs (streaming needs it too)
+ingestor = IncrementalIngestor() if INCREMENTAL_INGEST or STREAM_SOURCE else None
+
+# Token required (X-Profile-Token header) by the /metrics/profile endpoints; they are disabled without one
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
 
 # Fetching and transforming data
 def pipeline():
     """Runs the data pipeline to fetch and transform data."""
     try:
         raw_data = fetch_data()
-        transformed_data = transform_data(raw_data)
+        if ingestor is not None:
+            return ingestor.ingest(raw_data)
+        transformed_data = transform_data(raw_data, lazy=STORAGE_BACKEND == "sqlite")  # The SQLite load streams transactions in
         return transformed_data
     except Exception as e:
         print(f"Error in pipeline: {e}")
         return {"products": [], "users": [], "transactions": []}  # Return empty lists on failure
 
-# Loading transformed data
-try:
-    data = pipeline()
-    products = data["products"]
-    users = data["users"]
-    transactions = data["transactions"]
+# Compute one insight, timed as its own pipeline stage
+def insight(function, *args, **kwargs):
+    with timed("insight", name=function.__name__):
+        return function(*args, **kwargs)
 
-    # Enrich transactions with product and user details
-    transactions_with_products = join_transactions_with_products(transactions, products)
-    transactions_with_users = join_transactions_with_users(transactions, users)
+# User insights view
+def build_user_insights(snapshot):
+    """Computes the user insights served by /insights/users."""
+    users, transactions = snapshot.users, snapshot.transactions
+    return {
+        "total user spending": insight(calculate_user_spending, transactions, snapshot.transaction_aggregates),
+        "user statistics": insight(calculate_user_statistics, users, snapshot.user_aggregates),
+        "user_with_most_transactions": insight(user_with_most_transactions, transactions, snapshot.transaction_aggregates),
+        "users_with_no_transactions": insight(users_with_no_transactions, users, transactions, snapshot.user_aggregates, snapshot.transaction_aggregates)
+    }
 
-    # Compute insights
-    user_spending = calculate_user_spending(transactions)
-    most_popular_category = most_popular_categories(products)
-    average_transaction_values = average_transaction_value(products)
+# Product insights view
+def build_product_insights(snapshot):
+    """Computes the product insights served by /insights/products."""
+    products, aggregates = snapshot.products, snapshot.product_aggregates
+    return {
+        "most popular category": insight(most_popular_categories, products, aggregates),
+        "average transaction values": insight(average_transaction_value, products, aggregates),
+        "top_selling_products": insight(top_selling_products, products, aggregates=aggregates),
+        "expensive_and_cheapest_products details": insight(expensive_and_cheapest_products, products, aggregates),
+        "category_wise_revenue": insight(category_wise_revenue, products, aggregates),
+        "most_rated_products details": insight(most_rated_products, products, aggregates),
+        "top_revenue_categories": insight(top_revenue_categories, products, aggregates=aggregates)
+    }
 
-    # Save processed data into JSON files
-    try:
-        with open("json/transactions.json", "w", encoding="utf-8") as file:
-            json.dump(transactions, file, indent=4)
-        with open("json/users.json", "w", encoding="utf-8") as file:
-            json.dump(users, file, indent=4)
-        with open("json/products.json", "w", encoding="utf-8") as file:
-            json.dump(products, file, indent=4)
-        with open("json/transactions_with_products.json", "w", encoding="utf-8") as file:
-            json.dump(transactions_with_products, file, indent=4)
-        with open("json/transactions_with_users.json", "w", encoding="utf-8") as file:
-            json.dump(transactions_with_users, file, indent=4)
-    except Exception as e:
-        print(f"Error saving JSON files: {e}")
+# Insight results are materialized once per data snapshot
+insight_cache = InsightCache()
+
+# Materialize the insight views as soon as a snapshot is published
+def warm_insight_cache(snapshot):
+    insight_cache.get("users", snapshot.version, lambda: build_user_insights(snapshot))
+    insight_cache.get("products", snapshot.version, lambda: build_product_insights(snapshot))
+
+# The pipeline runs in the background; requests are served from the latest published snapshot
+runner = PipelineRunner(pipeline)
+runner.on_publish.append(warm_insight_cache)
+
+# With STREAM_SOURCE set, transactions streamed as NDJSON are applied in micro-batches between runs
+stream = StreamIngestor(STREAM_SOURCE, ingestor, runner.publish_increment) if STREAM_SOURCE else None
 
-except Exception as e:
-    print(f"Error loading data pipeline: {e}")
-    products, users, transactions = [], [], []  # Ensure data is an empty list on failure
+@asynccontextmanager
+async def lifespan(app):
+    runner.start()
+    if stream is not None:
+        stream.start()
+    yield
+    if stream is not None:
+        stream.stop()
+    await runner.stop()
+    shutdown_pool()
+
+# Initializing FastAPI
+app = FastAPI(lifespan=lifespan)
+
+# Per-route latency histogram for every request
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")  # Route template, e.g. /data/{entity_type}
+    HTTP_SECONDS.observe(time.perf_counter() - start, route=route.path if route else "unmatched", method=request.method, status=response.status_code)
+    return response
+
+# Current snapshot, or 503 while the first one is still loading
+def current_snapshot():
+    snapshot = runner.snapshot  # Read the reference once so the whole request sees one snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Data not ready yet, the pipeline is still running")
+    return snapshot
+
+# API Endpoint: Pipeline status
+@app.get("/status")
+def status():
+    """Report whether data is loaded and when it was last refreshed."""
+    status = runner.status()
+    status["dead_letters"] = DEAD_LETTERS.counts
+    if stream is not None:
+        status["stream"] = stream.status()
+    return status
 
 # API Endpoint: Fetch stored data (products, users, transactions)
 @app.get("/data/{entity_type}")
-def get_data(entity_type: str):
-    """Fetch stored data by entity type."""
+def get_data(entity_type: str, request: Request):
+    """Fetch stored data by entity type.
+
+    Query parameters: `limit` (default 100) with `offset` or the `cursor` from the
+    X-Next-Cursor header, `fields=data.title,data.price` to project, and filters such as
+    `data.category=electronics` or `data.price__gte=10` (also `__gt`, `__lte`, `__lt`), or
+    their short forms such as `category=electronics&price_min=10` (see query.FILTER_ALIASES).
+    The total match count is returned in X-Total-Count.
+    """
     entity_types = ["product", "user", "transaction"]
+    if entity_type not in entity_types:
+        raise HTTPException(status_code=400, detail=f"Invalid entity type. Choose from: {entity_types}")
+    snapshot = current_snapshot()
+
+    params = list(request.query_params.multi_items())
+    etag = make_etag(snapshot.version, entity_type, params)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
 
+    records = {"product": snapshot.products, "user": snapshot.users, "transaction": snapshot.transactions}[entity_type]
     try:
-        if entity_type == "product":
-            return products
-        elif entity_type == "user":
-            return users
-        elif entity_type == "transaction":
-            return transactions
-        raise HTTPException(status_code=400, detail=f"Invalid entity type. Choose from: {entity_types}")
+        if snapshot.store is not None:
+            page, total, next_cursor = snapshot.store.query(entity_type, params, snapshot.version)  # Pushed down to SQLite
+        else:
+            page, total, next_cursor = query_records(records, snapshot.indexes[entity_type], params, snapshot.version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        headers = {"ETag": etag, "X-Total-Count": str(total)}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return Response(content=serialize_response(page), media_type="application/json", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving data: {e}")
 
+# API Endpoint: Fetch one record by its key (product/user id, transaction_id)
+@app.get("/data/{entity_type}/{key}")
+def get_record(entity_type: str, key: str, request: Request):
+    """Fetch a single record through the primary key index (see indexes.PRIMARY_KEYS)."""
+    entity_types = ["product", "user", "transaction"]
+    if entity_type not in entity_types:
+        raise HTTPException(status_code=400, detail=f"Invalid entity type. Choose from: {entity_types}")
+    snapshot = current_snapshot()
+
+    etag = make_etag(snapshot.version, entity_type, [("key", key)])
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if snapshot.store is not None:
+        page, _, _ = snapshot.store.query(entity_type, [(PRIMARY_KEYS[entity_type], key), ("limit", "1")], snapshot.version)
+        record = page[0] if page else None
+    else:
+        records = {"product": snapshot.products, "user": snapshot.users, "transaction": snapshot.transactions}[entity_type]
+        record = lookup_record(records, snapshot.indexes[entity_type], entity_type, key)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"No {entity_type} with key '{key}'")
+    return Response(content=serialize_response(record), media_type="application/json", headers={"ETag": etag})
+
 # API Endpoint: User Insights 
 @app.get("/insights/users")
 def user_spending_insights():
     """Retrieve user insights including spending patterns."""
+    snapshot = current_snapshot()
     try:
-        return {
-            "total user spending": user_spending,
-            "user statistics": calculate_user_statistics(users),
-            "user_with_most_transactions": user_with_most_transactions(transactions),
-            "users_with_no_transactions": users_with_no_transactions(users, transactions)
-        }
+        _, body = insight_cache.get("users", snapshot.version, lambda: build_user_insights(snapshot))
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving user insights: {e}")
 
@@ -102,19 +209,73 @@ def user_spending_insights():
 @app.get("/insights/products")
 def product_insights():
     """Retrieve product insights including popularity and revenue metrics."""
+    snapshot = current_snapshot()
     try:
-        return {
-            "most popular category": most_popular_category,
-            "average transaction values": average_transaction_values,
-            "top_selling_products": top_selling_products(products),
-            "expensive_and_cheapest_products details": expensive_and_cheapest_products(products),
-            "category_wise_revenue": category_wise_revenue(products),
-            "most_rated_products details": most_rated_products(products),
-            "top_revenue_categories": top_revenue_categories(products)
-        }
+        _, body = insight_cache.get("products", snapshot.version, lambda: build_product_insights(snapshot))
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving product insights: {e}")
 
+# API Endpoint: Time-windowed transaction insights
+@app.get("/insights/transactions")
+def transaction_insights(window: str = "1h", mode: str = "sliding", count: int = 1, top: int = 10):
+    """Transaction counts by status, sender and user over a time window such as 15m, 1h or 7d.
+
+    `mode=sliding` covers the last `window` up to now; `mode=tumbling` returns the last `count`
+    aligned windows. Each dimension lists its `top` values.
+    """
+    snapshot = current_snapshot()
+    try:
+        seconds = parse_window(window)
+        if mode == "sliding":
+            content = {"window": window, "mode": mode, **snapshot.transaction_windows.sliding(seconds, top=top)}
+        elif mode == "tumbling":
+            content = {"window": window, "mode": mode, "windows": snapshot.transaction_windows.tumbling(seconds, count, top=top)}
+        else:
+            raise ValueError("mode must be 'sliding' or 'tumbling'")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=serialize_response(content), media_type="application/json")
+
+# API Endpoint: Insight cache counters
+@app.get("/insights/cache")
+def insight_cache_stats():
+    """Retrieve hit/miss counters of the insight cache."""
+    return insight_cache.stats()
+
+# API Endpoint: Prometheus metrics
+@app.get("/metrics")
+def metrics():
+    """Pipeline stage timings, record and byte counters, and request latencies in the Prometheus text format."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Reject profiling requests without the configured token
+def check_profile_token(token):
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled, set PROFILE_TOKEN to enable it")
+    if not hmac.compare_digest((token or "").encode("utf-8"), PROFILE_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Profile-Token header")
+
+# API Endpoint: Profile the next pipeline run
+@app.post("/metrics/profile", status_code=202)
+def request_profile(mode: str = "cprofile", x_profile_token: str = Header(None)):
+    """Run the next pipeline refresh under `cprofile` or `tracemalloc`; the report is served by GET /metrics/profile."""
+    check_profile_token(x_profile_token)
+    try:
+        runner.request_profile(mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"mode": mode, "status": "scheduled"}
+
+# API Endpoint: Last profiling report
+@app.get("/metrics/profile")
+def last_profile(x_profile_token: str = Header(None)):
+    """Retrieve the report of the last profiled pipeline run."""
+    check_profile_token(x_profile_token)
+    if runner.last_profile is None:
+        raise HTTPException(status_code=404, detail="No pipeline run has been profiled yet")
+    return Response(content=runner.last_profile["report"], media_type="text/plain")
+
 # Running FastAPI Server
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8080, reload=True)
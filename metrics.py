@@ -0,0 +1,187 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Where profiling reports of single pipeline runs are written
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join("json", "profiles"))
+PROFILE_MODES = ("cprofile", "tracemalloc")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prometheus label set, as a hashable key
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+### ---- METRIC TYPES ---- ###
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self.values.items())
+        for key, value in items:
+            lines.extend(self.render_value(key, value))
+        return lines
+
+    def render_value(self, key, value):
+        return [f"{self.name}{format_labels(key)} {format_value(value)}"]
+
+# Monotonic total
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+# Last observed value
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[label_key(labels)] = value
+
+# Distribution of observations over fixed buckets
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][position] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["buckets"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels(key, [('le', format_value(bound))])} {cumulative}")
+        lines.append(f"{self.name}_bucket{format_labels(key, [('le', '+Inf')])} {state['count']}")
+        lines.append(f"{self.name}_sum{format_labels(key)} {format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{format_labels(key)} {state['count']}")
+        return lines
+
+### ---- REGISTRY ---- ###
+
+class Registry:
+    """Holds every metric of the process and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Both stage metrics are labelled by `stage` and `name` only (the source, entity type, table or dataset)
+STAGE_SECONDS = REGISTRY.histogram("pipeline_stage_seconds", "Duration of pipeline stages (fetch, transform, join, aggregate, insight, write).")
+STAGE_RECORDS = REGISTRY.counter("pipeline_stage_records_total", "Records produced by pipeline stages.")
+RECORDS_DROPPED = REGISTRY.counter("transform_records_dropped_total", "Records dropped because their transform failed.")
+FETCH_BYTES = REGISTRY.counter("fetch_bytes_total", "Response bytes fetched from upstream sources.")
+FETCH_ERRORS = REGISTRY.counter("fetch_errors_total", "Upstream fetches that failed after all retries.")
+WRITE_BYTES = REGISTRY.counter("snapshot_bytes_written_total", "Uncompressed bytes written to snapshot files.")
+PIPELINE_RUNS = REGISTRY.counter("pipeline_runs_total", "Background pipeline runs by outcome.")
+SNAPSHOT_CREATED = REGISTRY.gauge("snapshot_created_timestamp_seconds", "Creation time of the snapshot being served.")
+HTTP_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "API request latency by route.")
+
+# Time a block as a pipeline stage
+@contextmanager
+def timed(stage, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, name=name)
+
+def count_records(stage, count, name):
+    STAGE_RECORDS.inc(count, stage=stage, name=name)
+
+### ---- PROFILING ---- ###
+
+# Run a callable once under cProfile or tracemalloc
+def run_profiled(fn, mode, top=40):
+    """Returns `(result, report)`, where report is the text of the top `top` entries."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', use one of {PROFILE_MODES}")
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(fn)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(top)
+        return result, output.getvalue()
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(25)
+    try:
+        result = fn()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    lines = [f"current={current} bytes peak={peak} bytes", ""]
+    lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:top])
+    return result, "\n".join(lines) + "\n"
+
+# Keep a profiling report on disk
+def save_profile(report, mode, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}.{mode}.txt")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(report)
+    return path
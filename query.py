@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import math
+import operator
+from bisect import bisect_right
+from collections import defaultdict
+
+from indexes import MISSING, PRIMARY_KEYS, SortedIndex, get_path
+
+# Query parameters of /data/{entity_type}
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+RESERVED_PARAMS = {"offset", "limit", "cursor", "fields"}
+RANGE_OPERATORS = {"gte": operator.ge, "gt": operator.gt, "lte": operator.le, "lt": operator.lt}
+
+# Short parameter names for common filters, e.g. /data/product?category=jewelery&price_min=10
+FILTER_ALIASES = {
+    "category": "data.category",
+    "status": "data.status",
+    "name": "data.name",
+    "email": "data.email",
+    "price_min": "data.price__gte",
+    "price_max": "data.price__lte",
+    "rating_min": "data.rating.rate__gte",
+    "rating_max": "data.rating.rate__lte"
+}
+
+# Split query parameters into filters
+def parse_filters(params):
+    """Turns `path=value` and `path__gte=value` style parameters into `(path, op, value)` tuples."""
+    filters = []
+    for name, value in params:
+        if name in RESERVED_PARAMS:
+            continue
+        name = FILTER_ALIASES.get(name, name)
+        path, _, op = name.partition("__")
+        if op and op not in RANGE_OPERATORS:
+            raise ValueError(f"Unknown filter operator '{op}', use one of {sorted(RANGE_OPERATORS)}")
+        if op:
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f"Range filter '{name}' needs a number")
+            if not math.isfinite(value):
+                raise ValueError(f"Range filter '{name}' needs a finite number")
+        filters.append((path, op or "eq", value))
+    return filters
+
+# Check one filter against a record
+def matches(record, path, op, value):
+    field = get_path(record, path)
+    if field is MISSING or field is None:  # A null field matches no filter, like a missing one
+        return False
+    if op == "eq":
+        return str(field) == value  # Query strings are compared with the string form of the field
+    try:
+        return RANGE_OPERATORS[op](float(field), value)
+    except (TypeError, ValueError):
+        return False
+
+# Positions of all records passing the filters
+def select_positions(records, indexes, filters):
+    """Answers equality filters from hash indexes and range filters from sorted indexes, then scans only the remaining candidates."""
+    is_sorted = lambda path: isinstance(indexes.get(path), SortedIndex)
+    uses_index = lambda path, op: path in indexes and (op == "eq") != is_sorted(path)
+    indexed = [(path, value) for path, op, value in filters if op == "eq" and uses_index(path, op)]
+    ranges = defaultdict(list)  # All range filters on one sorted field make a single range
+    for path, op, value in filters:
+        if op != "eq" and uses_index(path, op):
+            ranges[path].append((op, value))
+    remaining = [f for f in filters if not uses_index(f[0], f[1])]
+
+    candidate_lists = [indexes[path].get(value, []) for path, value in indexed]
+    candidate_lists += [sorted(indexes[path].range(conditions)) for path, conditions in ranges.items()]
+    if candidate_lists:
+        candidate_lists.sort(key=len)
+        others = [set(positions) for positions in candidate_lists[1:]]
+        candidates = [p for p in candidate_lists[0] if all(p in other for other in others)]
+    else:
+        candidates = range(len(records))
+
+    if not remaining:
+        return candidates
+    return [p for p in candidates if all(matches(records[p], *f) for f in remaining)]
+
+# Keep only the requested dotted paths of a record
+def project(record, paths):
+    projected = {}
+    for path in paths:
+        value = get_path(record, path)
+        if value is MISSING:
+            continue
+        parts = path.split(".")
+        target = projected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return projected
+
+# Opaque cursors: the snapshot version plus the position of the last returned record
+def encode_cursor(version, position):
+    return base64.urlsafe_b64encode(f"{version}:{position}".encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor, version):
+    """Returns the position a cursor points after; cursors from another snapshot are rejected."""
+    try:
+        cursor_version, _, position = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rpartition(":")
+        position = int(position)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if cursor_version != str(version):
+        raise ValueError("Cursor belongs to an older data snapshot, restart from the first page")
+    return position
+
+# Paging and projection parameters
+def parse_options(params, version):
+    """Returns `(limit, offset, cursor_position, fields)`; cursor_position is None without a cursor."""
+    options = dict(params)
+    limit = int(options.get("limit", DEFAULT_LIMIT))
+    offset = int(options.get("offset", 0))
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    cursor = decode_cursor(options["cursor"], version) if options.get("cursor") else None
+    fields = [path for path in options.get("fields", "").split(",") if path]
+    return limit, offset, cursor, fields
+
+# Run a query against one entity list
+def query_records(records, indexes, params, version):
+    """Returns `(page, total, next_cursor)` for the filter, projection and paging parameters in `params`.
+
+    `params` is a list of `(name, value)` query pairs. Without a cursor, `offset` skips
+    matching records; with one, the page starts right after the cursor's record.
+    """
+    limit, offset, cursor, fields = parse_options(params, version)
+    positions = select_positions(records, indexes, parse_filters(params))
+    total = len(positions)
+
+    start = offset if cursor is None else bisect_right(positions, cursor)
+    page_positions = positions[start:start + limit]
+
+    next_cursor = None
+    if start + limit < total:
+        next_cursor = encode_cursor(version, page_positions[-1])
+
+    page = [project(records[p], fields) if fields else records[p] for p in page_positions]
+    return page, total, next_cursor
+
+# Look up one record by its primary key
+def lookup_record(records, indexes, entity_type, key):
+    """Returns the first record whose PRIMARY_KEYS field equals `key` (compared as strings), or None."""
+    path = PRIMARY_KEYS[entity_type]
+    if path in indexes:
+        positions = indexes[path].get(key, [])
+        return records[positions[0]] if len(positions) else None
+    return next((record for record in records if matches(record, path, "eq", key)), None)
+
+# ETag of a query result: the same snapshot and the same query always produce the same body
+def make_etag(version, entity_type, params):
+    query = "&".join(f"{name}={value}" for name, value in sorted(params))
+    digest = hashlib.blake2b(f"{version}|{entity_type}|{query}".encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
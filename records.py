@@ -0,0 +1,141 @@
+import copy
+import datetime
+import random
+import sys
+from collections.abc import Mapping
+
+# Compact entity ids: a random 63-bit int, rendered as 16 hex characters
+def new_entity_id():
+    return random.getrandbits(63)
+
+def format_entity_id(entity_id):
+    return f"{entity_id:016x}" if isinstance(entity_id, int) else entity_id
+
+def parse_entity_id(value):
+    """Turns a rendered compact id back into its int; any other id (e.g. an older uuid4) is kept as is."""
+    if isinstance(value, str) and len(value) == 16:
+        try:
+            return int(value, 16)
+        except ValueError:
+            pass
+    return value
+
+# One timestamp string shared by every record of a batch
+def batch_timestamp():
+    return sys.intern(datetime.datetime.utcnow().isoformat())
+
+# Record list of a source whose fetch failed
+class FailedFetch(list):
+    """An empty record list that tells a source that could not be fetched apart from one that
+    returned no records, so consumers can keep the records they had instead of deleting them."""
+
+# Base record type
+class Record(Mapping):
+    """Slotted transformed entity that reads like the `{entity_id, entity_type, timestamp, data, metadata}` dict.
+
+    `data` is kept as the payload dict every consumer reads; the envelope (type, source,
+    timestamps and metadata) is rebuilt on access and only materialized as a dict by
+    `to_dict()` at the serialization boundary.
+    """
+
+    __slots__ = ("entity_id", "timestamp", "data")
+    entity_type = None
+    source = None
+    KEYS = ("entity_id", "entity_type", "timestamp", "data", "metadata")
+
+    def __init__(self, data, timestamp=None, entity_id=None):
+        self.data = data
+        self.timestamp = timestamp or batch_timestamp()
+        self.entity_id = new_entity_id() if entity_id is None else entity_id
+
+    def metadata(self):
+        return {"source": self.source, "processed_at": self.timestamp}
+
+    def __getitem__(self, key):
+        if key == "data":
+            return self.data
+        if key == "entity_id":
+            return format_entity_id(self.entity_id)
+        if key == "entity_type":
+            return self.entity_type
+        if key == "timestamp":
+            return self.timestamp
+        if key == "metadata":
+            return self.metadata()
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key != "entity_id":
+            raise TypeError(f"Record field '{key}' is read-only")
+        self.entity_id = parse_entity_id(value)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        """Returns the JSON shape of the record."""
+        return {key: self[key] for key in self.KEYS}
+
+    def replace(self, **changes):
+        """Returns a copy with the given slots changed."""
+        record = copy.copy(self)
+        for name, value in changes.items():
+            setattr(record, name, value)
+        return record
+
+class ProductRecord(Record):
+    __slots__ = ()
+    entity_type = "product"
+    source = "fakestoreapi"
+
+class UserRecord(Record):
+    __slots__ = ()
+    entity_type = "user"
+    source = "randomuserapi"
+
+class TransactionRecord(Record):
+    __slots__ = ("user_entity_id", "product_entity_id")
+    entity_type = "transaction"
+    source = "mockaroo"
+
+    def __init__(self, data, timestamp=None, entity_id=None, user_entity_id=None, product_entity_id=None):
+        super().__init__(data, timestamp, entity_id)
+        self.user_entity_id = user_entity_id
+        self.product_entity_id = product_entity_id
+
+    def metadata(self):
+        return {
+            "source": self.source,
+            "processed_at": self.timestamp,
+            "user_entity_id": format_entity_id(self.user_entity_id) if self.user_entity_id is not None else None,
+            "product_entity_id": format_entity_id(self.product_entity_id) if self.product_entity_id is not None else None
+        }
+
+RECORD_TYPES = {cls.entity_type: cls for cls in (ProductRecord, UserRecord, TransactionRecord)}
+
+# JSON encoders call this for anything they cannot serialize natively
+def to_json(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Rebuild a record from its JSON shape
+def from_dict(entity):
+    """Returns the Record for a dict written by `to_dict()`; anything else is returned unchanged."""
+    cls = RECORD_TYPES.get(entity.get("entity_type")) if isinstance(entity, dict) else None
+    if cls is None or "data" not in entity:
+        return entity
+
+    timestamp = sys.intern(entity.get("timestamp") or "")  # Records of one batch share the string again
+    record = cls(entity["data"], timestamp, parse_entity_id(entity.get("entity_id")))
+    if cls is TransactionRecord:
+        metadata = entity.get("metadata", {})
+        record.user_entity_id = parse_entity_id(metadata.get("user_entity_id"))
+        record.product_entity_id = parse_entity_id(metadata.get("product_entity_id"))
+    return record
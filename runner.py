@@ -0,0 +1,425 @@
+import asyncio
+import os
+import threading
+import time
+from collections import namedtuple
+
+from aggregations import aggregate_products, aggregate_transactions, aggregate_users
+import binary_snapshot
+import columnar
+from business_rules import JoinedRows, iter_transactions_with_products, iter_transactions_with_users
+from indexes import build_indexes
+from metrics import PIPELINE_RUNS, PROFILE_MODES, REGISTRY, SNAPSHOT_CREATED, run_profiled, save_profile, timed
+from records import FailedFetch, from_dict
+from snapshot_writer import new_version, read_snapshot, write_snapshot
+import sqlite_store
+from windows import TransactionWindows
+
+# Seconds between background pipeline runs; 0 runs the pipeline once at startup only
+REFRESH_INTERVAL = float(os.environ.get("PIPELINE_REFRESH_SECONDS", "3600"))
+
+# Shortest interval between binary snapshot writes of streamed increments (full runs always write one)
+BINARY_INCREMENT_SECONDS = float(os.environ.get("BINARY_INCREMENT_SECONDS", "10"))
+
+# Seconds requests still holding a replaced snapshot get before its store is closed
+RETIRE_GRACE_SECONDS = float(os.environ.get("SNAPSHOT_RETIRE_GRACE_SECONDS", "30"))
+
+# Set to "cprofile" or "tracemalloc" to profile the first pipeline run (reports go to metrics.PROFILE_DIR)
+PROFILE_MODE = os.environ.get("PIPELINE_PROFILE") or None
+
+STALE_SNAPSHOTS = REGISTRY.counter("stale_snapshots_dropped_total", "Snapshots not published because a newer ingestion was published first.")
+
+# Immutable view of one pipeline run: base entities, joins and aggregates
+Snapshot = namedtuple("Snapshot", [
+    "version", "created_at",
+    "products", "users", "transactions",
+    "transactions_with_products", "transactions_with_users",
+    "product_aggregates", "user_aggregates", "transaction_aggregates",
+    "indexes", "transaction_windows", "store", "sequence", "mapped"
+], defaults=(None, None, None, None))
+
+# Build a snapshot from transformed (or persisted) data
+def build_snapshot(data, version=None):
+    """Computes joins and aggregates for `data` and returns them as a Snapshot.
+
+    Joins and aggregates already present in `data` (persisted joins, or the output of
+    incremental ingestion) are reused instead of being recomputed. Other joins are only
+    run while the snapshot is written (JoinedRows), as nothing else reads them.
+    """
+    products = data.get("products", [])
+    users = data.get("users", [])
+    transactions = data.get("transactions", [])
+
+    transactions_with_products = data.get("transactions_with_products")
+    if transactions_with_products is None:
+        transactions_with_products = JoinedRows(iter_transactions_with_products, transactions, products)
+    transactions_with_users = data.get("transactions_with_users")
+    if transactions_with_users is None:
+        transactions_with_users = JoinedRows(iter_transactions_with_users, transactions, users)
+
+    # Aggregates come from the columnar store (vectorized) or the single-pass row engine
+    aggregators = (aggregate_products, aggregate_users, aggregate_transactions)
+    if columnar.COLUMNAR_INSIGHTS and columnar.available() and "product_aggregates" not in data:
+        try:
+            with timed("aggregate", name="columnar_store"):
+                store = columnar.ColumnarStore(products, users, transactions)
+            aggregators = (lambda _: store.product_aggregates(), lambda _: store.user_aggregates(), lambda _: store.transaction_aggregates())
+        except Exception as e:
+            print(f"Error building the columnar store, using the row engine: {e}")  # e.g. a value that does not fit its column type
+
+    aggregates = {}
+    for (name, records), aggregator in zip((("product", products), ("user", users), ("transaction", transactions)), aggregators):
+        aggregates[name] = data.get(f"{name}_aggregates")
+        if not aggregates[name]:
+            with timed("aggregate", name=name):
+                aggregates[name] = aggregator(records)
+
+    indexes = {}
+    for name, records in (("product", products), ("user", users), ("transaction", transactions)):
+        with timed("index", name=name):
+            indexes[name] = build_indexes(records, name)
+
+    transaction_windows = data.get("transaction_windows")
+    if transaction_windows is None:
+        transaction_windows = TransactionWindows()  # Batch-stamped transactions have no event time to window on
+
+    return Snapshot(
+        version=version or new_version(),
+        created_at=time.time(),
+        products=products,
+        users=users,
+        transactions=transactions,
+        transactions_with_products=transactions_with_products,
+        transactions_with_users=transactions_with_users,
+        product_aggregates=aggregates["product"],
+        user_aggregates=aggregates["user"],
+        transaction_aggregates=aggregates["transaction"],
+        indexes=indexes,
+        transaction_windows=transaction_windows,
+        sequence=data.get("sequence")
+    )
+
+# Build a snapshot served from a SQLite store
+def build_store_snapshot(store, data=None):
+    """Returns a Snapshot whose record lists are views over `store` and whose aggregates are computed in SQL.
+
+    Aggregates already present in `data` (the output of incremental ingestion) are reused.
+    """
+    data = data or {}
+    aggregates = {}
+    for name in ("product", "user", "transaction"):
+        aggregates[name] = data.get(f"{name}_aggregates")
+        if not aggregates[name]:
+            with timed("aggregate", name=name):
+                aggregates[name] = getattr(store, f"{name}_aggregates")()
+    transaction_windows = data.get("transaction_windows")
+    if transaction_windows is None:
+        transaction_windows = TransactionWindows()  # Batch-stamped transactions have no event time to window on
+
+    return Snapshot(
+        version=store.version,
+        created_at=time.time(),
+        products=store.records("product"),
+        users=store.records("user"),
+        transactions=store.records("transaction"),
+        transactions_with_products=store.records("transactions_with_products"),
+        transactions_with_users=store.records("transactions_with_users"),
+        product_aggregates=aggregates["product"],
+        user_aggregates=aggregates["user"],
+        transaction_aggregates=aggregates["transaction"],
+        indexes={},  # Filters are answered by the store's SQL indexes
+        transaction_windows=transaction_windows,
+        store=store,
+        sequence=data.get("sequence")
+    )
+
+# Build a snapshot served from a memory-mapped binary snapshot file
+def build_binary_snapshot(mapped):
+    """Returns a Snapshot whose record lists and indexes are views over `mapped` (a BinarySnapshot)."""
+    aggregates = mapped.aggregates()
+    return Snapshot(
+        version=mapped.version,
+        created_at=mapped.created_at,
+        products=mapped.records("products"),
+        users=mapped.records("users"),
+        transactions=mapped.records("transactions"),
+        transactions_with_products=mapped.records("transactions_with_products"),
+        transactions_with_users=mapped.records("transactions_with_users"),
+        product_aggregates=aggregates["product"],
+        user_aggregates=aggregates["user"],
+        transaction_aggregates=aggregates["transaction"],
+        indexes=mapped.indexes(),
+        transaction_windows=mapped.windows(),
+        mapped=mapped
+    )
+
+# Background pipeline runner
+class PipelineRunner:
+    """Runs `pipeline()` in the background and publishes each result as a new Snapshot.
+
+    The current snapshot is a single attribute that is replaced, never mutated, so a
+    request that reads `runner.snapshot` once sees a consistent view for its whole lifetime.
+    `on_publish` callbacks run after every swap (e.g. to warm caches).
+
+    With binary_snapshot.BINARY_SNAPSHOTS on, the one process holding the producer lock
+    runs the pipeline and writes every snapshot as a binary file; the other processes
+    (e.g. uvicorn workers) never run the pipeline and only map the file CURRENT points at.
+    """
+
+    def __init__(self, pipeline, interval=None, persist=True):
+        self.pipeline = pipeline
+        self.interval = REFRESH_INTERVAL if interval is None else interval
+        self.persist = persist
+        self.snapshot = None
+        self.on_publish = []
+        self.last_refresh = None
+        self.last_error = None
+        self.profile_mode = PROFILE_MODE  # Profile the next run under cProfile or tracemalloc
+        self.last_profile = None
+        self.role = "standalone"  # "producer" or "reader" with binary snapshots
+        self.retire_grace = RETIRE_GRACE_SECONDS
+        self.binary_increment_seconds = BINARY_INCREMENT_SECONDS
+        self._producer_lock = None
+        self._publish_lock = threading.Lock()
+        self._binary_lock = threading.Lock()
+        self._binary_written = 0.0
+        self._binary_timer = None
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.snapshot is not None
+
+    def publish(self, snapshot):
+        """Swaps in `snapshot` as the current one, then retires the store or mapped file of the previous one.
+
+        A snapshot whose ingestion `sequence` is older than the current one's (a streamed batch
+        overtaken by a full run) is dropped. Returns True if `snapshot` was published.
+        """
+        with self._publish_lock:
+            previous = self.snapshot
+            if previous is not None and None not in (previous.sequence, snapshot.sequence) and snapshot.sequence < previous.sequence:
+                STALE_SNAPSHOTS.inc()
+                return False
+            self.snapshot = snapshot
+        for callback in self.on_publish:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Error in snapshot publish callback: {e}")
+        if previous is not None and previous.store is not None and previous.store is not snapshot.store:
+            self.retire(previous.store.close)
+        if previous is not None and previous.mapped is not None and previous.mapped is not snapshot.mapped:
+            self.retire(previous.mapped.close)
+        return True
+
+    def retire(self, close):
+        """Calls `close` once requests still reading the previous snapshot have had `retire_grace` seconds to finish.
+
+        A `close` that returns False (still in use) is retried after another `retire_grace` seconds.
+        """
+        if self.retire_grace <= 0:
+            close()
+            return
+
+        def attempt():
+            try:
+                if close() is False:
+                    self.retire(close)
+            except Exception as e:
+                print(f"Error retiring snapshot: {e}")
+
+        timer = threading.Timer(self.retire_grace, attempt)
+        timer.daemon = True
+        timer.start()
+
+    def load_persisted(self):
+        """Publishes the last persisted snapshot, if there is one. Returns True on success."""
+        try:
+            if binary_snapshot.BINARY_SNAPSHOTS and self.follow():
+                return True
+
+            store = sqlite_store.open_current_store() if sqlite_store.STORAGE_BACKEND == "sqlite" else None
+            if store is not None:
+                snapshot = build_store_snapshot(store)
+                self.publish(snapshot)
+                SNAPSHOT_CREATED.set(snapshot.created_at)
+                return True
+
+            version, datasets = read_snapshot()
+            if version is None:
+                return False
+            for name in ("products", "users", "transactions"):
+                datasets[name] = [from_dict(entity) for entity in datasets.get(name, [])]  # Back to slotted records
+            snapshot = build_snapshot(datasets, version)
+            self.publish(snapshot)
+            SNAPSHOT_CREATED.set(snapshot.created_at)
+            return True
+        except Exception as e:
+            print(f"Error loading persisted snapshot: {e}")
+            return False
+
+    def request_profile(self, mode):
+        """Profiles the next pipeline run with `mode` ('cprofile' or 'tracemalloc')."""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}', use one of {PROFILE_MODES}")
+        self.profile_mode = mode
+
+    def compute(self):
+        """Runs the pipeline and builds the snapshot, without publishing it."""
+        with timed("pipeline", name="fetch_transform"):
+            data = self.pipeline()
+        if self.snapshot is not None and not any(data.get(name) for name in ("products", "users", "transactions")):
+            raise RuntimeError("pipeline returned no data, keeping the current snapshot")
+        data = self.keep_failed_sources(data)
+        if sqlite_store.STORAGE_BACKEND == "sqlite":
+            return build_store_snapshot(sqlite_store.write_store(data, new_version()), data)  # The database is the persisted snapshot
+        return build_snapshot(data)
+
+    def keep_failed_sources(self, data):
+        """Replaces the records of every source whose fetch failed with those of the current snapshot."""
+        failed = [name for name in ("products", "users", "transactions") if isinstance(data.get(name), FailedFetch)]
+        if not failed or self.snapshot is None:
+            return data
+        data = dict(data)
+        for name in failed:
+            print(f"Error fetching {name}, keeping the current snapshot's {name}")
+            data[name] = getattr(self.snapshot, name)  # A view over the current database with the SQLite backend
+        return data
+
+    def publish_increment(self, data):
+        """Publishes a snapshot of `data` between pipeline runs (e.g. streamed micro-batches).
+
+        Joins and aggregates are taken from `data`, but the indexes are rebuilt, so every
+        increment costs O(records). Only a binary snapshot for reader workers is written, at
+        most every `binary_increment_seconds`; the next pipeline run persists the rest.
+        """
+        snapshot = build_snapshot(data)
+        if not self.publish(snapshot):
+            return
+        SNAPSHOT_CREATED.set(snapshot.created_at)
+        self.last_refresh = snapshot.created_at
+        if self.persist and binary_snapshot.BINARY_SNAPSHOTS:
+            self.write_binary_increment()
+
+    def write_binary_increment(self, scheduled=False):
+        """Writes the current snapshot as a binary snapshot now, or schedules it when the last write is too recent."""
+        with self._binary_lock:
+            if scheduled:
+                self._binary_timer = None
+            elif self._binary_timer is not None:
+                return  # The scheduled write takes the latest snapshot
+            wait = self._binary_written + self.binary_increment_seconds - time.monotonic()
+            if wait > 0:
+                self._binary_timer = threading.Timer(wait, self.write_binary_increment, kwargs={"scheduled": True})
+                self._binary_timer.daemon = True
+                self._binary_timer.start()
+                return
+            try:
+                self.write_binary(self.snapshot)
+            except Exception as e:
+                print(f"Error writing binary snapshot: {e}")
+
+    def write_binary(self, snapshot):
+        with timed("write", name="binary_snapshot"):
+            binary_snapshot.write_binary_snapshot(snapshot)
+        self._binary_written = time.monotonic()
+
+    def refresh(self):
+        """Runs the pipeline once and publishes (then persists) the result."""
+        try:
+            mode, self.profile_mode = self.profile_mode, None
+            if mode:
+                snapshot, report = run_profiled(self.compute, mode)
+                self.last_profile = {"mode": mode, "version": snapshot.version, "path": save_profile(report, mode, snapshot.version), "report": report}
+            else:
+                snapshot = self.compute()
+            if not self.publish(snapshot):
+                PIPELINE_RUNS.inc(status="ok")  # A streamed batch published a newer ingestion meanwhile
+                return
+            SNAPSHOT_CREATED.set(snapshot.created_at)
+            self.last_refresh = snapshot.created_at
+            self.last_error = None
+
+            if self.persist and snapshot.store is None:
+                write_snapshot({
+                    "transactions": snapshot.transactions,
+                    "users": snapshot.users,
+                    "products": snapshot.products,
+                    "transactions_with_products": snapshot.transactions_with_products,
+                    "transactions_with_users": snapshot.transactions_with_users
+                }, version=snapshot.version)
+            if self.persist and binary_snapshot.BINARY_SNAPSHOTS:
+                with self._binary_lock:
+                    self.write_binary(snapshot)
+            PIPELINE_RUNS.inc(status="ok")
+        except Exception as e:
+            self.last_error = str(e)
+            PIPELINE_RUNS.inc(status="error")
+            print(f"Error refreshing pipeline: {e}")
+
+    def claim_producer(self):
+        """Takes the binary snapshot producer lock unless another process holds it. Returns True if this process holds it."""
+        if self._producer_lock is None:
+            self._producer_lock = binary_snapshot.acquire_producer_lock()
+            self.role = "producer" if self._producer_lock is not None else "reader"
+        return self._producer_lock is not None
+
+    def follow(self):
+        """Publishes the binary snapshot CURRENT points at, unless it is already the current one. Returns True if one is current."""
+        version = binary_snapshot.current_version()
+        if version is None:
+            return False
+        if self.snapshot is None or self.snapshot.version != version:
+            mapped = binary_snapshot.open_binary_snapshot(version)
+            if mapped is None:
+                return False
+            snapshot = build_binary_snapshot(mapped)
+            self.publish(snapshot)
+            SNAPSHOT_CREATED.set(snapshot.created_at)
+            self.last_refresh = snapshot.created_at
+        return True
+
+    async def run(self):
+        """Loads the persisted snapshot, then refreshes now and every `interval` seconds until cancelled.
+
+        Readers of binary snapshots poll CURRENT instead and take over as the producer if it exits.
+        """
+        while binary_snapshot.BINARY_SNAPSHOTS and not self.claim_producer():
+            try:
+                await asyncio.to_thread(self.follow)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error following binary snapshot: {e}")
+            await asyncio.sleep(binary_snapshot.POLL_SECONDS)
+        if self.snapshot is None:
+            await asyncio.to_thread(self.load_persisted)
+        while True:
+            await asyncio.to_thread(self.refresh)
+            if self.interval <= 0:
+                return
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Starts the background loop without waiting for any data."""
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self):
+        snapshot = self.snapshot
+        return {
+            "ready": snapshot is not None,
+            "version": snapshot.version if snapshot else None,
+            "last_refresh": self.last_refresh,
+            "last_error": self.last_error,
+            "refresh_interval": self.interval,
+            "role": self.role
+        }
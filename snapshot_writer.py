@@ -0,0 +1,213 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import WRITE_BYTES, count_records, timed
+from records import to_json
+
+try:
+    import zstandard  # Optional, only needed for SNAPSHOT_COMPRESSION=zstd
+except ImportError:
+    zstandard = None
+
+# Snapshot settings (overridable through the environment)
+SNAPSHOT_ROOT = os.environ.get("SNAPSHOT_ROOT", "json")  # Snapshots live in SNAPSHOT_ROOT/snapshots/<version>/
+SNAPSHOT_FORMAT = os.environ.get("SNAPSHOT_FORMAT", "ndjson")  # "ndjson" or "json" (compact array)
+SNAPSHOT_COMPRESSION = os.environ.get("SNAPSHOT_COMPRESSION") or None  # None, "gzip" or "zstd"
+PERSIST_JOINS = os.environ.get("PERSIST_JOINS", "1") != "0"  # Derived joins can be rebuilt from the base data
+SNAPSHOTS_TO_KEEP = 3
+WRITE_WORKERS = 4
+
+# Datasets derived from the base entities
+DERIVED_DATASETS = {"transactions_with_products", "transactions_with_users"}
+
+EXTENSIONS = {"ndjson": ".ndjson", "json": ".json"}
+COMPRESSED_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# Snapshot version names sort chronologically
+def new_version():
+    now = time.time_ns()
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(now // 1_000_000_000)) + f"-{now % 1_000_000_000:09d}"
+
+# Compact, UTF-8 JSON encoding of a single record
+def encode_record(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=to_json).encode("utf-8")
+
+# Open a (possibly compressed) binary file for writing
+def open_output(path, compression):
+    if compression is None:
+        return open(path, "wb")
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+    raise ValueError(f"Unknown compression: {compression}")
+
+# File name of a dataset inside a snapshot
+def dataset_filename(name, fmt, compression):
+    return f"{name}{EXTENSIONS[fmt]}{COMPRESSED_EXTENSIONS[compression]}"
+
+# Stream records to a file one at a time
+def write_records(path, records, fmt="ndjson", compression=None):
+    """Writes `records` incrementally and returns `(record_count, bytes_written)` before compression."""
+    count = 0
+    size = 0
+    with open_output(path, compression) as file:
+        if fmt == "json":
+            file.write(b"[")
+            size += 1
+        for record in records:
+            chunk = encode_record(record)
+            if fmt == "ndjson":
+                chunk += b"\n"
+            elif count:
+                chunk = b"," + chunk
+            file.write(chunk)
+            size += len(chunk)
+            count += 1
+        if fmt == "json":
+            file.write(b"]")
+            size += 1
+        file.flush()
+    return count, size
+
+# Flush a written file to disk
+def fsync_file(path):
+    with open(path, "ab") as file:
+        os.fsync(file.fileno())
+
+# Flush a directory's entries (new, renamed or removed files) to disk
+def fsync_directory(path):
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return  # Windows cannot open directories; NTFS journals renames itself
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# Replace a small file atomically
+def write_file_atomic(path, content):
+    """Writes `content` (bytes) to a temp file next to `path` and renames it into place, durably."""
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    fsync_directory(os.path.dirname(path))
+
+# Remove all but the newest snapshots, and staging directories a crash left behind
+def prune_snapshots(snapshots_dir, keep=SNAPSHOTS_TO_KEEP):
+    names = os.listdir(snapshots_dir)
+    versions = sorted(name for name in names if not name.startswith("."))
+    for version in versions[:-keep] if keep else []:
+        shutil.rmtree(os.path.join(snapshots_dir, version), ignore_errors=True)
+    for name in names:
+        if name.startswith(".tmp-"):
+            shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+
+# Write a versioned snapshot
+def write_snapshot(datasets, root=None, fmt=None, compression=None, persist_joins=None, workers=WRITE_WORKERS, version=None):
+    """Persists `datasets` ({name: records}) as a new versioned snapshot and returns its directory.
+
+    Every dataset is streamed into a staging directory in parallel; the staging directory
+    is renamed to `<root>/snapshots/<version>` once all files are complete and `<root>/CURRENT`
+    is then switched to the new version, so readers never see a half-written snapshot.
+    Every file and the staging directory are fsynced before the rename, so after a crash
+    CURRENT never names a version with truncated files.
+    """
+    root = root or SNAPSHOT_ROOT
+    fmt = fmt or SNAPSHOT_FORMAT
+    compression = compression if compression is not None else SNAPSHOT_COMPRESSION
+    persist_joins = PERSIST_JOINS if persist_joins is None else persist_joins
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+
+    if not persist_joins:
+        datasets = {name: records for name, records in datasets.items() if name not in DERIVED_DATASETS}
+
+    snapshots_dir = os.path.join(root, "snapshots")
+    os.makedirs(snapshots_dir, exist_ok=True)
+    version = version or new_version()
+    staging_dir = os.path.join(snapshots_dir, f".tmp-{version}")
+    os.makedirs(staging_dir)
+
+    try:
+        def write_dataset(name):
+            filename = dataset_filename(name, fmt, compression)
+            with timed("write", name=name):
+                count, size = write_records(os.path.join(staging_dir, filename), datasets[name], fmt, compression)
+                fsync_file(os.path.join(staging_dir, filename))
+            count_records("write", count, name=name)
+            WRITE_BYTES.inc(size, dataset=name)
+            return name, {"file": filename, "records": count, "bytes": size}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(datasets)))) as executor:
+            files = dict(executor.map(write_dataset, datasets))
+
+        manifest = {"version": version, "format": fmt, "compression": compression, "datasets": files}
+        write_file_atomic(os.path.join(staging_dir, "manifest.json"), json.dumps(manifest, indent=4).encode("utf-8"))  # Also syncs the directory
+
+        snapshot_dir = os.path.join(snapshots_dir, version)
+        os.rename(staging_dir, snapshot_dir)
+        fsync_directory(snapshots_dir)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)  # Never leave a partial snapshot behind
+        raise
+
+    write_file_atomic(os.path.join(root, "CURRENT"), version.encode("utf-8"))
+    prune_snapshots(snapshots_dir)
+    return snapshot_dir
+
+# Open a (possibly compressed) binary file for reading
+def open_input(path, compression):
+    if compression is None:
+        return open(path, "rb")
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    raise ValueError(f"Unknown compression: {compression}")
+
+# Stream records back from a dataset file
+def read_records(path, fmt="ndjson", compression=None):
+    """Yields the records of a file written by write_records."""
+    with open_input(path, compression) as file:
+        if fmt == "json":
+            yield from json.loads(file.read())
+            return
+        for line in io.BufferedReader(file) if compression == "zstd" else file:
+            if line.strip():
+                yield json.loads(line)
+
+# Load the latest complete snapshot
+def read_snapshot(root=None):
+    """Returns `(version, {name: records})` for the snapshot named by `<root>/CURRENT`, or `(None, {})`."""
+    root = root or SNAPSHOT_ROOT
+    try:
+        with open(os.path.join(root, "CURRENT"), encoding="utf-8") as file:
+            version = file.read().strip()
+    except FileNotFoundError:
+        return None, {}
+
+    snapshot_dir = os.path.join(root, "snapshots", version)
+    with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as file:
+        manifest = json.load(file)
+
+    datasets = {
+        name: list(read_records(os.path.join(snapshot_dir, info["file"]), manifest["format"], manifest["compression"]))
+        for name, info in manifest["datasets"].items()
+    }
+    return version, datasets
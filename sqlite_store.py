@@ -0,0 +1,395 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Sequence
+from datetime import datetime
+
+from indexes import MISSING, get_path
+from metrics import timed
+from query import encode_cursor, matches, parse_filters, parse_options, project
+from records import from_dict
+from snapshot_writer import SNAPSHOTS_TO_KEEP, encode_record, write_file_atomic
+
+# Optional storage backend: STORAGE_BACKEND=sqlite keeps every snapshot in an indexed SQLite database
+# (json/sqlite/<version>.db) and answers queries, joins and aggregates in SQL instead of from Python lists
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+SQLITE_ROOT = os.environ.get("SQLITE_ROOT", os.path.join("json", "sqlite"))
+FETCH_BATCH = 1000  # Rows read per round trip when streaming a table
+SQL_OPERATORS = {"gte": ">=", "gt": ">", "lte": "<=", "lt": "<"}  # query.RANGE_OPERATORS in SQL
+
+# Entity tables, by entity type
+TABLES = {"product": "products", "user": "users", "transaction": "transactions"}
+
+# Columns extracted from every entity: name -> (dotted path, kind). "key" columns hold the string
+# form of the value, which is what equality filters compare (NULL for a missing or null value, which
+# no filter matches); "number" columns hold the numeric value used by range filters and aggregates.
+COLUMNS = {
+    "product": {
+        "id": ("data.id", "key"),
+        "category": ("data.category", "key"),
+        "title": ("data.title", "key"),
+        "price": ("data.price", "number"),
+        "rating_count": ("data.rating.count", "number"),
+        "rating_rate": ("data.rating.rate", "number")
+    },
+    "user": {
+        "id": ("data.id", "key"),
+        "name": ("data.name", "key"),
+        "email": ("data.email", "key"),
+        "gender": ("data.gender", "key"),
+        "dob": ("data.dob", "key")
+    },
+    "transaction": {
+        "transaction_id": ("data.transaction_id", "key"),
+        "status": ("data.status", "key"),
+        "sender": ("data.sender", "key"),
+        "user_name": ("data.user_name", "key"),
+        "parcel_id": ("data.parcel_id", "key")
+    }
+}
+
+# Secondary indexes, created after the bulk load (the B-trees on numbers also serve range filters)
+INDEXES = {
+    "product": [("id",), ("category",), ("price",), ("rating_rate",)],
+    "user": [("id",), ("name",), ("email",)],
+    "transaction": [("transaction_id",), ("status",), ("user_name",), ("parcel_id",)]
+}
+
+DERIVED_TABLES = ("transactions_with_products", "transactions_with_users")
+
+# Column value of one entity
+def column_value(record, path, kind):
+    value = get_path(record, path)
+    if value is MISSING or value is None:
+        return None
+    if kind == "key":
+        return str(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# Rows for executemany
+def entity_rows(records, entity_type):
+    columns = list(COLUMNS[entity_type].values())
+    for position, record in enumerate(records):
+        yield (position, encode_record(record).decode("utf-8"), *(column_value(record, path, kind) for path, kind in columns))
+
+def document_rows(records):
+    for position, record in enumerate(records):
+        yield position, encode_record(record).decode("utf-8")
+
+# SQL for a JSON field of a table's documents, with the default used when the field is absent
+def json_field(alias, path, default="'Unknown'"):
+    return f"CASE WHEN json_type({alias}.doc, '$.{path}') IS NULL THEN {default} ELSE json_extract({alias}.doc, '$.{path}') END"
+
+# join_transactions_with_products in SQL: the last product whose id matches the transaction's parcel_id
+JOIN_PRODUCTS_SQL = f"""
+INSERT INTO transactions_with_products (pos, doc)
+SELECT t.pos, json_object(
+    'transaction_id', {json_field("t", "data.transaction_id")},
+    'user_name', {json_field("t", "data.user_name")},
+    'user_phone', {json_field("t", "data.user_phone")},
+    'status', {json_field("t", "data.status")},
+    'sender', {json_field("t", "data.sender")},
+    'product', CASE WHEN p.pos IS NULL THEN 'Product Not Found' ELSE {json_field("p", "data.title", "'Product Not Found'")} END
+)
+FROM transactions t
+LEFT JOIN products p ON p.pos = (SELECT MAX(pos) FROM products WHERE id = t.parcel_id)
+ORDER BY t.pos
+"""
+
+# join_transactions_with_users in SQL: the last user whose name matches the transaction's user_name
+JOIN_USERS_SQL = f"""
+INSERT INTO transactions_with_users (pos, doc)
+SELECT t.pos, json_object(
+    'transaction_id', {json_field("t", "data.transaction_id")},
+    'user', CASE WHEN u.pos IS NULL THEN 'User Not Found' ELSE json_extract(u.doc, '$.data') END,
+    'user_phone', {json_field("t", "data.user_phone")},
+    'status', {json_field("t", "data.status")},
+    'sender', {json_field("t", "data.sender")},
+    'parcel_id', {json_field("t", "data.parcel_id")}
+)
+FROM transactions t
+LEFT JOIN users u ON u.pos = (SELECT MAX(pos) FROM users WHERE name = t.user_name)
+ORDER BY t.pos
+"""
+
+# SQL for a key column with the default the Python aggregates use when the field is absent (a null field stays NULL)
+def key_or_default(column, path, default="'Unknown'"):
+    return f"COALESCE({column}, CASE WHEN json_type(doc, '$.{path}') IS NULL THEN {default} END)"
+
+# Connection tuned for one bulk load
+def connect_for_write(path):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA temp_store=MEMORY")
+    return connection
+
+# Write one snapshot into a new database
+def write_store(data, version, root=None):
+    """Bulk-loads `data` into `<root>/<version>.db`, runs the joins in SQL and points `<root>/CURRENT` at it.
+
+    Joins already present in `data` (incremental ingestion) are stored as they are.
+    Returns the SQLiteStore of the new database. If the load fails (e.g. a lazily
+    transformed source raises), the partial database is removed and CURRENT is unchanged.
+    """
+    root = root or SQLITE_ROOT
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"{version}.db")
+
+    connection = connect_for_write(path)
+    loaded = False
+    try:
+        with connection:  # One transaction for the whole load
+            for entity_type, table in TABLES.items():
+                columns = COLUMNS[entity_type]
+                definitions = ", ".join(f"{name} {'TEXT' if kind == 'key' else 'NUMERIC'}" for name, (_, kind) in columns.items())
+                connection.execute(f"CREATE TABLE {table} (pos INTEGER PRIMARY KEY, doc TEXT NOT NULL, {definitions})")
+                placeholders = ", ".join("?" * (len(columns) + 2))
+                with timed("write", name=table):
+                    connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})", entity_rows(data.get(table, []), entity_type))
+                with timed("index", name=table):
+                    for index_columns in INDEXES[entity_type]:
+                        connection.execute(f"CREATE INDEX {table}_{'_'.join(index_columns)} ON {table} ({', '.join(index_columns)})")
+
+            for table, sql in zip(DERIVED_TABLES, (JOIN_PRODUCTS_SQL, JOIN_USERS_SQL)):
+                connection.execute(f"CREATE TABLE {table} (pos INTEGER PRIMARY KEY, doc TEXT NOT NULL)")
+                if data.get(table) is None:
+                    with timed("join", name=table):
+                        connection.execute(sql)
+                else:
+                    with timed("write", name=table):
+                        connection.executemany(f"INSERT INTO {table} VALUES (?, ?)", document_rows(data[table]))
+        connection.execute("ANALYZE")
+        loaded = True
+    finally:
+        connection.close()
+        if not loaded:
+            remove_store_files(root, version)  # Never leave a partial database behind
+
+    write_file_atomic(os.path.join(root, "CURRENT"), version.encode("utf-8"))
+    prune_stores(root)
+    return SQLiteStore(path, version)
+
+# Remove all but the newest databases
+def prune_stores(root, keep=SNAPSHOTS_TO_KEEP):
+    versions = sorted({name.split(".db")[0] for name in os.listdir(root) if ".db" in name})
+    for version in versions[:-keep] if keep else []:
+        remove_store_files(root, version)
+
+def remove_store_files(root, version):
+    for suffix in ("", "-wal", "-shm"):
+        path = os.path.join(root, f"{version}.db{suffix}")
+        if os.path.exists(path):
+            os.remove(path)
+
+# Open the database CURRENT points at
+def open_current_store(root=None):
+    """Returns the SQLiteStore of the last written snapshot, or None if there is none."""
+    root = root or SQLITE_ROOT
+    try:
+        with open(os.path.join(root, "CURRENT"), encoding="utf-8") as file:
+            version = file.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(root, f"{version}.db")
+    return SQLiteStore(path, version) if os.path.exists(path) else None
+
+# Records of one table, read on demand
+class StoredRecords(Sequence):
+    """Read-only sequence view of a store table, so code written for record lists works unchanged."""
+
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self._length = None
+
+    def __len__(self):
+        if self._length is None:
+            self._length = self.store.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return self._length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            start, stop, step = position.indices(len(self))
+            if step != 1:
+                return [self[p] for p in range(start, stop, step)]
+            rows = self.store.execute(f"SELECT doc FROM {self.table} WHERE pos >= ? AND pos < ? ORDER BY pos", (start, stop))
+            return [decode(doc) for doc, in rows]
+        if position < 0:
+            position += len(self)
+        row = self.store.execute(f"SELECT doc FROM {self.table} WHERE pos = ?", (position,)).fetchone()
+        if row is None:
+            raise IndexError(position)
+        return decode(row[0])
+
+    def __iter__(self):
+        return self.store.iter_documents(self.table)
+
+def decode(doc):
+    return from_dict(json.loads(doc))
+
+# Read side of one snapshot database
+class SQLiteStore:
+    """Queries, joins and aggregates over one snapshot database.
+
+    Every thread gets its own connection; the database is never written after `write_store`.
+    `close` closes the connections of all threads, so the file of a replaced (and pruned)
+    version does not stay open.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.closed = False
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            with self._lock:
+                if self.closed:
+                    raise sqlite3.ProgrammingError(f"Store {self.version} is closed")
+                connection = self._local.connection = sqlite3.connect(self.path, check_same_thread=False)
+                connection.execute("PRAGMA query_only=ON")
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def iter_documents(self, table, where="", params=()):
+        """Streams the decoded documents of `table` in position order."""
+        cursor = self.execute(f"SELECT doc FROM {table} {where} ORDER BY pos", params)
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH)
+            if not rows:
+                return
+            for doc, in rows:
+                yield decode(doc)
+
+    def records(self, name):
+        """Sequence view of an entity table (by entity type) or a join table."""
+        return StoredRecords(self, TABLES.get(name, name))
+
+    ### ---- QUERIES ---- ###
+
+    def where_clause(self, entity_type, filters):
+        """Splits `filters` into a SQL condition on extracted columns and the filters left for Python."""
+        paths = {path: (name, kind) for name, (path, kind) in COLUMNS[entity_type].items()}
+        conditions, params, remaining = [], [], []
+        for path, op, value in filters:
+            name, kind = paths.get(path, (None, None))
+            if op == "eq" and kind == "key":
+                conditions.append(f"{name} = ?")
+            elif op != "eq" and kind == "number":
+                conditions.append(f"{name} {SQL_OPERATORS[op]} ?")
+            else:
+                remaining.append((path, op, value))
+                continue
+            params.append(value)
+        return conditions, params, remaining
+
+    def query(self, entity_type, params, version):
+        """Same result as query.query_records, with filters on extracted columns answered by SQLite.
+
+        Filters on other paths are checked in Python while the candidate rows are streamed, so
+        only one page of records is ever held in memory.
+        """
+        limit, offset, cursor, fields = parse_options(params, version)
+        table = TABLES[entity_type]
+        conditions, values, remaining = self.where_clause(entity_type, parse_filters(params))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        if not remaining:
+            total = self.execute(f"SELECT COUNT(*) FROM {table} {where}", values).fetchone()[0]
+            if cursor is None:
+                start = offset
+                rows = self.execute(f"SELECT pos, doc FROM {table} {where} ORDER BY pos LIMIT ? OFFSET ?", (*values, limit, offset))
+            else:
+                before = " AND ".join(conditions + ["pos <= ?"])
+                start = self.execute(f"SELECT COUNT(*) FROM {table} WHERE {before}", (*values, cursor)).fetchone()[0]
+                after = " AND ".join(conditions + ["pos > ?"])
+                rows = self.execute(f"SELECT pos, doc FROM {table} WHERE {after} ORDER BY pos LIMIT ?", (*values, cursor, limit))
+            page = [(position, decode(doc)) for position, doc in rows]
+        else:
+            total, before, page = 0, 0, []
+            for position, doc in self.execute(f"SELECT pos, doc FROM {table} {where} ORDER BY pos", values):
+                record = decode(doc)
+                if not all(matches(record, *f) for f in remaining):
+                    continue
+                if cursor is not None:
+                    if position <= cursor:
+                        before += 1
+                    elif len(page) < limit:
+                        page.append((position, record))
+                elif offset <= total < offset + limit:
+                    page.append((position, record))
+                total += 1
+            start = offset if cursor is None else before
+
+        next_cursor = None
+        if start + limit < total:
+            next_cursor = encode_cursor(version, page[-1][0])
+        return [project(record, fields) if fields else record for _, record in page], total, next_cursor
+
+    ### ---- AGGREGATES (same groups and ordering as aggregations.aggregate_*) ---- ###
+    # Float sums may differ from the Python engine in the last bits: SQLite 3.43+ uses
+    # Kahan-Babuska-Neumaier summation, Python adds left to right.
+
+    def product_aggregates(self, top_rated=5):
+        categories = self.execute(
+            f"SELECT {key_or_default('category', 'data.category')} AS k, SUM(COALESCE(rating_count, 0)), SUM(COALESCE(price, 0)), COUNT(*) "
+            "FROM products WHERE k != '' GROUP BY k ORDER BY MIN(pos)"
+        ).fetchall()
+        sales_by_title = self.execute(
+            "SELECT k, rating_count FROM ("
+            " SELECT k, rating_count, ROW_NUMBER() OVER (PARTITION BY k ORDER BY pos DESC) AS latest, MIN(pos) OVER (PARTITION BY k) AS first_seen"
+            f" FROM (SELECT pos, {key_or_default('title', 'data.title')} AS k, COALESCE(rating_count, 0) AS rating_count FROM products)"
+            " WHERE k != '') WHERE latest = 1 ORDER BY first_seen"
+        ).fetchall()
+        most_rated = self.execute("SELECT doc FROM products ORDER BY COALESCE(rating_count, 0) DESC, pos LIMIT ?", (top_rated,)).fetchall()
+        cheapest = self.execute("SELECT doc FROM products ORDER BY COALESCE(price, 0), pos LIMIT 1").fetchone()
+        most_expensive = self.execute("SELECT doc FROM products ORDER BY COALESCE(price, 0) DESC, pos DESC LIMIT 1").fetchone()
+
+        return {
+            "category_rating_count": {category: rating_count for category, rating_count, _, _ in categories},
+            "category_revenue": {category: float(revenue) for category, _, revenue, _ in categories},
+            "category_average_price": {category: revenue / count for category, _, revenue, count in categories},
+            "sales_by_title": dict(sales_by_title),
+            "most_rated": [decode(doc) for doc, in most_rated],
+            "cheapest": decode(cheapest[0]) if cheapest else None,
+            "most_expensive": decode(most_expensive[0]) if most_expensive else None
+        }
+
+    def user_aggregates(self):
+        current_year = datetime.utcnow().year
+        birth_year = (f"CASE WHEN dob IS NULL OR length(dob) < 4 THEN {current_year} "  # NULL (unknown bucket) without a leading year, see aggregations.birth_year
+                      "WHEN substr(dob, 1, 4) GLOB '[0-9][0-9][0-9][0-9]' THEN CAST(substr(dob, 1, 4) AS INTEGER) END")
+        age = f"({current_year} - {birth_year})"
+        bucket = f"CASE WHEN {age} IS NULL THEN NULL WHEN {age} <= 18 THEN '0-18' WHEN {age} <= 30 THEN '19-30' WHEN {age} <= 45 THEN '31-45' WHEN {age} <= 60 THEN '46-60' ELSE '61+' END"
+
+        return {
+            "total_users": self.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            "gender_count": dict(self.execute(f"SELECT {key_or_default('gender', 'data.gender')} AS k, COUNT(*) FROM users GROUP BY k ORDER BY MIN(pos)").fetchall()),
+            "age_count": dict(self.execute(f"SELECT {bucket} AS k, COUNT(*) FROM users GROUP BY k ORDER BY MIN(pos)").fetchall()),
+            "user_names": [name for name, in self.execute("SELECT name FROM users WHERE json_type(doc, '$.data.name') IS NOT NULL GROUP BY name ORDER BY MIN(pos)")]
+        }
+
+    def transaction_aggregates(self):
+        rows = self.execute(f"SELECT {key_or_default('user_name', 'data.user_name')} AS k, COUNT(*) FROM transactions GROUP BY k ORDER BY MIN(pos)")
+        return {"transactions_per_user": dict(rows.fetchall())}
@@ -0,0 +1,230 @@
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+from metrics import REGISTRY, count_records, timed
+
+# Streaming ingestion settings (overridable through the environment)
+STREAM_SOURCE = os.environ.get("STREAM_SOURCE") or None  # "stdin", "file:<path>", "tcp:<host>:<port>" or "unix:<path>"
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "500"))
+STREAM_BATCH_SECONDS = float(os.environ.get("STREAM_BATCH_SECONDS", "1"))  # Longest wait before a partial batch is applied
+STREAM_QUEUE_SIZE = int(os.environ.get("STREAM_QUEUE_SIZE", "10000"))  # Lines buffered before reading from the source pauses
+TAIL_POLL_SECONDS = 0.2
+
+STREAM_LINES = REGISTRY.counter("stream_lines_total", "NDJSON lines read by streaming ingestion, by outcome (ok, invalid).")
+STREAM_BATCH_ERRORS = REGISTRY.counter("stream_batch_errors_total", "Streamed micro-batches that failed to apply.")
+STREAM_QUEUE_DEPTH = REGISTRY.gauge("stream_queue_depth", "Streamed lines waiting for the next micro-batch.")
+
+# Lines of a file, including the ones appended later
+def follow_file(path, stop):
+    """Yields every complete line of `path`, then waits for more like `tail -F`.
+
+    The file is read from the start; a file that is truncated or replaced (log rotation)
+    is read again from its start.
+    """
+    file, position = None, 0
+    try:
+        while not stop.is_set():
+            if file is None:
+                try:
+                    file, position = open(path, "rb"), 0
+                except FileNotFoundError:
+                    stop.wait(TAIL_POLL_SECONDS)
+                    continue
+            line = file.readline()
+            if line.endswith(b"\n"):
+                position = file.tell()
+                yield line
+                continue
+
+            file.seek(position)  # Leave a partial line until the writer finishes it
+            stop.wait(TAIL_POLL_SECONDS)
+            try:
+                stat = os.stat(path)
+                rotated = stat.st_ino != os.fstat(file.fileno()).st_ino or stat.st_size < position
+            except FileNotFoundError:
+                rotated = False  # Wait for the replacement
+            if rotated:
+                file.close()
+                file = None
+    finally:
+        if file is not None:
+            file.close()
+
+# Lines from standard input
+def read_stdin(stop):
+    for line in sys.stdin.buffer:
+        if stop.is_set():
+            return
+        yield line
+
+# Socket server whose connections send NDJSON lines
+class LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not self.server.put(line):
+                return
+
+class TCPLineServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class UnixLineServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    UnixLineServer = None  # Windows
+
+def make_server(source, put):
+    """Returns the socket server of a "tcp:<host>:<port>" or "unix:<path>" source."""
+    kind, _, address = source.partition(":")
+    if kind == "tcp":
+        host, _, port = address.rpartition(":")
+        server = TCPLineServer((host or "127.0.0.1", int(port)), LineHandler)
+    elif kind == "unix" and UnixLineServer is not None:
+        if os.path.exists(address):
+            os.remove(address)  # Left over from an earlier run
+        server = UnixLineServer(address, LineHandler)
+    else:
+        raise ValueError(f"Unsupported stream source '{source}'")
+    server.put = put
+    return server
+
+# Parse NDJSON lines, skipping the invalid ones
+def parse_lines(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("not a JSON object")
+        except ValueError:
+            STREAM_LINES.inc(status="invalid")  # Counted, not printed: a bad producer would flood the log
+            continue
+        STREAM_LINES.inc(status="ok")
+        yield record
+
+# Micro-batch streaming ingestion of transactions
+class StreamIngestor:
+    """Reads NDJSON transactions from `source` and applies them in micro-batches.
+
+    A reader thread feeds lines into a bounded queue; when the queue is full the reader
+    blocks, which pauses the file tail or, through TCP flow control, the socket's senders.
+    The consumer thread takes up to `batch_size` lines (waiting at most `batch_seconds`
+    for a partial batch), runs them through `ingestor.ingest_stream` and passes the
+    output to `publish`. Nothing is read before the ingestor's first pipeline run.
+    """
+
+    def __init__(self, source, ingestor, publish, batch_size=None, batch_seconds=None, queue_size=None):
+        self.source = source
+        self.ingestor = ingestor
+        self.publish = publish
+        self.batch_size = batch_size or STREAM_BATCH_SIZE
+        self.batch_seconds = batch_seconds or STREAM_BATCH_SECONDS
+        self.queue = queue.Queue(maxsize=queue_size or STREAM_QUEUE_SIZE)
+        self.batches = 0
+        self.last_batch = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def put(self, line):
+        """Queues one line, blocking while the queue is full. Returns False once stopped."""
+        while not self._stop.is_set():
+            try:
+                self.queue.put(line, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self):
+        """Reader thread: moves lines from the source into the queue."""
+        if self.source in ("-", "stdin"):
+            lines = read_stdin(self._stop)
+        elif self.source.startswith("file:"):
+            lines = follow_file(self.source[len("file:"):], self._stop)
+        else:
+            self._server = make_server(self.source, self.put)
+            self._server.serve_forever(poll_interval=0.5)
+            return
+        for line in lines:
+            if not self.put(line):
+                return
+
+    def micro_batches(self):
+        """Yields lists of at most `batch_size` lines until stopped."""
+        while not self._stop.is_set():
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            STREAM_QUEUE_DEPTH.set(self.queue.qsize())
+            yield batch
+
+    def apply(self, batch):
+        """Ingests and publishes one batch of lines."""
+        with timed("stream", name="batch"):
+            data = self.ingestor.ingest_stream(parse_lines(batch))
+        count_records("stream", self.ingestor.last_delta["transactions"]["added"], name="transaction")
+        self.publish(data)
+        self.batches += 1
+        self.last_batch = time.time()
+
+    def run(self):
+        """Consumer thread: waits for the first pipeline run, starts the reader and applies batches."""
+        while not self.ingestor.ready.wait(0.5):
+            if self._stop.is_set():
+                return
+        reader = threading.Thread(target=self.read, name="stream-reader", daemon=True)
+        reader.start()
+        self._threads.append(reader)
+        for batch in self.micro_batches():
+            try:
+                self.apply(batch)
+                self.last_error = None
+            except Exception as e:
+                STREAM_BATCH_ERRORS.inc()
+                if str(e) != self.last_error:  # Once per distinct error, not once per batch
+                    print(f"Error applying streamed batch: {e}")
+                self.last_error = str(e)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="stream-consumer", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """Stops reading, then saves the ingestion state so streamed transactions survive a restart."""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            if thread.name != "stream-reader" or self.source not in ("-", "stdin"):  # A stdin read cannot be interrupted
+                thread.join(timeout=5)
+        self.ingestor.save()
+
+    def status(self):
+        return {
+            "source": self.source,
+            "batches": self.batches,
+            "last_batch": self.last_batch,
+            "last_error": self.last_error,
+            "queued": self.queue.qsize()
+        }
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Every test runs in its own directory, so json/ outputs never touch the checkout
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+# The shared dead-letter writer, started afresh for every test
+@pytest.fixture(autouse=True)
+def dead_letters(workdir):
+    from validation import DEAD_LETTERS
+    DEAD_LETTERS.close()
+    DEAD_LETTERS.__init__()
+    yield DEAD_LETTERS
+    DEAD_LETTERS.close()
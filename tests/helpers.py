@@ -0,0 +1,33 @@
+import json
+import math
+
+from insight_cache import serialize_response
+
+# Plain JSON form of records and aggregates, so results of different engines compare as data
+def as_json(value):
+    return json.loads(serialize_response(value))
+
+# Equality that allows float sums to differ in the last bits
+def assert_close(actual, expected, path="$"):
+    if isinstance(expected, float) or isinstance(actual, float):
+        assert math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-9), f"{path}: {actual} != {expected}"
+    elif isinstance(expected, dict):
+        assert isinstance(actual, dict) and list(actual) == list(expected), f"{path}: keys {list(actual)} != {list(expected)}"
+        for key in expected:
+            assert_close(actual[key], expected[key], f"{path}.{key}")
+    elif isinstance(expected, list):
+        assert isinstance(actual, list) and len(actual) == len(expected), f"{path}: {actual} != {expected}"
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            assert_close(a, e, f"{path}[{i}]")
+    else:
+        assert actual == expected, f"{path}: {actual} != {expected}"
+
+# Entity envelopes replaced by their data, since entity ids and timestamps differ between runs
+def strip_envelopes(value):
+    if isinstance(value, dict):
+        if "entity_id" in value and "data" in value:
+            return strip_envelopes(value["data"])
+        return {key: strip_envelopes(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [strip_envelopes(item) for item in value]
+    return value
@@ -0,0 +1,42 @@
+import copy
+
+from aggregations import AGE_BUCKETS, Count, Sum, aggregate_products, aggregate_users, run_aggregates
+from benchmarks.generate import generate_dataset
+from business_rules import most_popular_categories
+from insights import calculate_user_statistics, most_rated_products, top_selling_products
+from runner import build_snapshot
+from transform import transform_data
+
+def test_null_ratings_and_unreadable_birth_years_keep_the_snapshot():
+    raw = copy.deepcopy(generate_dataset(50, seed=8))
+    raw["products"][0]["rating"] = None
+    raw["users"][0]["dob"]["date"] = "unknown"
+    snapshot = build_snapshot(transform_data(raw))
+
+    assert sum(count for _, count in most_popular_categories(snapshot.products, snapshot.product_aggregates)) == \
+        sum(p["rating"]["count"] for p in raw["products"][1:])
+    assert len(most_rated_products(snapshot.products, snapshot.product_aggregates)) == 5
+    statistics = calculate_user_statistics(snapshot.users, snapshot.user_aggregates)
+    assert statistics["total_users"] == len(raw["users"])
+    assert sum(statistics["age_distribution"].values()) == len(raw["users"]) - 1  # The unreadable one is in no bucket
+    assert list(statistics["age_distribution"]) == list(AGE_BUCKETS)
+
+def test_a_failing_aggregate_only_empties_its_own_insights(capsys):
+    products = transform_data(generate_dataset(20, seed=8))["products"]
+    products[3]["data"]["rating"] = {"count": "many"}
+    aggregates = aggregate_products(products)
+    assert aggregates["category_rating_count"] is None and aggregates["most_rated"] is None
+    assert aggregates["category_revenue"] and aggregates["cheapest"] is not None
+    assert most_popular_categories(products, aggregates) == [] and most_rated_products(products, aggregates) == []
+    assert top_selling_products(products, aggregates=aggregates) == []  # Ranks the bad count, as the sort before did
+    assert "category_rating_count" in capsys.readouterr().out
+
+def test_failures_are_contained_per_spec():
+    records = [{"n": 1}, {"n": "x"}, {"n": 2}]
+    results = run_aggregates(records, [Sum("total", lambda r: r["n"]), Count("rows"), Count("by_n", key=lambda r: r["n"])])
+    assert results == {"total": None, "rows": 3, "by_n": {1: 1, "x": 1, 2: 1}}
+
+def test_missing_birth_dates_still_count_as_this_year():
+    users = transform_data(generate_dataset(10, seed=8))["users"]
+    users[0]["data"]["dob"] = ""
+    assert aggregate_users(users)["age_count"]["0-18"] >= 1
@@ -0,0 +1,46 @@
+import copy
+
+import pytest
+
+from aggregations import aggregate_products, aggregate_transactions, aggregate_users
+from benchmarks.generate import generate_dataset
+from helpers import as_json, assert_close
+from transform import transform_data
+
+np = pytest.importorskip("numpy")
+
+from columnar import ColumnarStore  # noqa: E402
+
+# Fixture data with ties in every ordered result
+def tied_dataset():
+    raw = copy.deepcopy(generate_dataset(300, seed=11))
+    products = raw["products"]
+    top = max(p["rating"]["count"] for p in products) + 1
+    for product in products[::4]:
+        product["rating"] = dict(product["rating"], count=top)  # Ties in the top-N by rating count
+    for i in (2, 9, 17):
+        products[i]["price"] = min(p["price"] for p in products)  # Several cheapest
+        products[-i]["price"] = max(p["price"] for p in products)  # Several most expensive
+    products[5]["title"] = products[1]["title"]  # A title seen twice: the last one counts
+    products[6]["rating"] = None
+    raw["users"][3]["dob"]["date"] = "unknown"
+    raw["users"][4]["dob"]["date"] = ""
+    return transform_data(raw)
+
+def test_columnar_aggregates_match_the_row_engine():
+    data = tied_dataset()
+    store = ColumnarStore(data["products"], data["users"], data["transactions"])
+    for columnar, row in ((store.product_aggregates(), aggregate_products(data["products"])),
+                          (store.user_aggregates(), aggregate_users(data["users"])),
+                          (store.transaction_aggregates(), aggregate_transactions(data["transactions"]))):
+        assert_close(as_json(columnar), as_json(row))
+
+    products = store.product_aggregates()
+    assert products["most_rated"] == data["products"][:20:4]  # The first of the tied, in list order
+    assert products["cheapest"] is data["products"][2] and products["most_expensive"] is data["products"][-2]
+
+def test_columnar_aggregates_of_empty_sources_match_the_row_engine():
+    store = ColumnarStore([], [], [])
+    assert as_json(store.product_aggregates()) == as_json(aggregate_products([]))
+    assert as_json(store.user_aggregates()) == as_json(aggregate_users([]))
+    assert as_json(store.transaction_aggregates()) == as_json(aggregate_transactions([]))
@@ -0,0 +1,75 @@
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import fetch_data
+from benchmarks.generate import generate_users
+from benchmarks.stub_server import StubServer
+from http_cache import HTTPCache, cache_key
+from records import FailedFetch
+
+@pytest.fixture
+def stub():
+    with StubServer(60, seed=3) as server:
+        yield server
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = HTTPCache(str(tmp_path / "http_cache"))
+    monkeypatch.setattr(fetch_data, "HTTP_CACHE", True)
+    monkeypatch.setattr(fetch_data, "_http_cache", cache)
+    return cache
+
+class FakeResponse:
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"ETag": '"v1"'}
+
+    def raise_for_status(self):
+        pass
+
+def test_malformed_body_only_empties_its_source(monkeypatch, stub):
+    body = stub.body
+    monkeypatch.setattr(stub, "body", lambda path, query: b'[{"id": 1' if path == "/products" else body(path, query))
+    urls = stub.urls
+    products = fetch_data.fetch_products(urls["PRODUCTS_API"])
+    transactions = fetch_data.fetch_transactions(urls["TRANSACTIONS_API"])
+    assert products == [] and isinstance(products, FailedFetch)
+    assert len(transactions) == 60 and not isinstance(transactions, FailedFetch)
+
+def test_corrupt_cached_body_is_a_miss(stub, cache):
+    url = stub.urls["PRODUCTS_API"]
+    products = fetch_data.fetch_products(url)
+    assert products
+    with open(os.path.join(cache.directory, f"{cache_key(url)}.body"), "wb") as file:
+        file.write(b"[{trunc")  # Within the products TTL, so this body would be served as fresh
+
+    requests_before = stub.requests
+    assert fetch_data.fetch_products(url) == products
+    assert stub.requests == requests_before + 1
+
+def test_read_body_of_evicted_entry(cache):
+    assert cache.read_body("missing") is None
+
+def test_revalidation_refetches_an_evicted_body(cache):
+    responses = [FakeResponse(200, b"[1]"), FakeResponse(304), FakeResponse(200, b"[2]")]
+    fetch = lambda headers: responses.pop(0)
+    cache.fetch("http://upstream/x", fetch, source="users")
+    os.remove(os.path.join(cache.directory, f"{cache_key('http://upstream/x')}.body"))
+    entry = {"etag": '"v1"', "stored_at": 0}
+    body, response = cache._conditional_fetch(cache_key("http://upstream/x"), "http://upstream/x", entry, fetch)
+    assert body == b"[2]" and response is not None
+
+def test_pages_all_ask_for_the_page_size():
+    pages = fetch_data.paginate_url("https://randomuser.me/api/?results=25", 10)
+    assert [parse_qs(urlsplit(page).query)["results"] for page in pages] == [["10"]] * 3
+    assert [parse_qs(urlsplit(page).query)["page"] for page in pages] == [["1"], ["2"], ["3"]]
+
+def test_paged_users_match_a_single_request(stub):
+    url = stub.urls["USERS_API"]
+    total = stub.counts["users"]
+    users = fetch_data.fetch_users(url, page_size=7)
+    assert total % 7 != 0  # A short last page
+    assert [user["login"]["uuid"] for user in users] == [user["login"]["uuid"] for user in generate_users(total, stub.seed)]
@@ -0,0 +1,66 @@
+import os
+
+import hash_join
+from benchmarks.generate import generate_dataset
+from business_rules import iter_transactions_with_products, iter_transactions_with_users
+from helpers import as_json
+from runner import build_snapshot
+from snapshot_writer import read_snapshot, write_snapshot
+from transform import transform_data
+
+# Plain dict lookup, the result every join path must match
+def reference(probe, build):
+    table = {key: value for key, value in build}
+    return [(row, table.get(row)) for row in probe]
+
+def join(probe, build, **kwargs):
+    return list(hash_join.hash_join(probe, build, lambda row: row, lambda item: item[0], lambda row, match: (row, match),
+                                    build_value=lambda item: item[1], **kwargs))
+
+# Depth of every grace_join call
+def record_depths(monkeypatch):
+    depths = []
+    original = hash_join.grace_join
+
+    def recording(*args, **kwargs):
+        depths.append(args[6] if len(args) > 6 else kwargs.get("depth", 0))
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(hash_join, "grace_join", recording)
+    return depths
+
+def spill_dirs(tmp_path):
+    return [name for name in os.listdir(tmp_path) if name.startswith("join-")]
+
+def test_in_memory_join_matches_a_lookup():
+    build = [(key % 7, f"v{key}") for key in range(20)]  # Duplicate keys: the last one wins
+    probe = [3, 9, 0, 6, 3]
+    assert join(probe, build) == reference(probe, build)
+
+def test_spilled_join_keeps_probe_order(tmp_path, monkeypatch):
+    depths = record_depths(monkeypatch)
+    build = [(key % 300, f"v{key}") for key in range(600)]
+    probe = list(range(-20, 320)) * 2
+    assert join(probe, build, budget=50, partitions=16, spill_dir=str(tmp_path)) == reference(probe, build)
+    assert depths == [0]  # Spilled once, every partition fit the budget
+    assert spill_dirs(tmp_path) == []
+
+def test_oversized_partition_is_repartitioned(tmp_path, monkeypatch):
+    depths = record_depths(monkeypatch)
+    build = [(key, f"v{key}") for key in range(400)]
+    probe = list(reversed(range(-10, 410)))
+    assert join(probe, build, budget=30, partitions=2, spill_dir=str(tmp_path)) == reference(probe, build)
+    assert depths[0] == 0 and max(depths) >= 1
+    assert spill_dirs(tmp_path) == []
+
+def test_snapshot_joins_stream_into_the_writer(tmp_path):
+    data = transform_data(generate_dataset(200))
+    snapshot = build_snapshot(data)
+    assert not isinstance(snapshot.transactions_with_products, list)  # Joined while written, never held
+
+    write_snapshot({"transactions_with_products": snapshot.transactions_with_products,
+                    "transactions_with_users": snapshot.transactions_with_users}, root=str(tmp_path), version="v1")
+    _, datasets = read_snapshot(str(tmp_path))
+    spilled = list(iter_transactions_with_products(data["transactions"], data["products"], budget=5))
+    assert as_json(datasets["transactions_with_products"]) == as_json(spilled)
+    assert as_json(datasets["transactions_with_users"]) == as_json(list(iter_transactions_with_users(data["transactions"], data["users"], budget=3)))
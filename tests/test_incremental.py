@@ -0,0 +1,105 @@
+import copy
+
+from aggregations import IncrementalAggregates, aggregate_products, aggregate_transactions, aggregate_users, transaction_specs
+from benchmarks.generate import generate_dataset
+from business_rules import join_transactions_with_products, join_transactions_with_users
+from helpers import as_json, strip_envelopes
+from incremental import MAX_ORDINAL_DEPTH, IncrementalIngestor, assign_ordinals
+from records import FailedFetch
+from transform import transform_data
+
+AGGREGATES = {
+    "product_aggregates": ("products", aggregate_products),
+    "user_aggregates": ("users", aggregate_users),
+    "transaction_aggregates": ("transactions", aggregate_transactions)
+}
+
+# Updates, deletes and inserts across all three sources
+def changed(raw):
+    raw = copy.deepcopy(raw)
+    products, users, transactions = raw["products"], raw["users"], raw["transactions"]
+    for product in products[3:40:3]:
+        product["price"] = round(product["price"] * 1.1 + 0.07, 2)
+    products[5]["category"] = products[0]["category"]
+    del products[0]  # The first product of its category: group order changes
+    products.insert(10, dict(products[10], id=10_000, title="Inserted", price=0.1))
+    users[2]["gender"] = "female" if users[2].get("gender") == "male" else "male"
+    del users[0]
+    for transaction in transactions[5:50:5]:
+        transaction["user_name"] = transactions[60]["user_name"]
+    del transactions[:3]
+    transactions.insert(20, dict(transactions[20], id=90_000, status="pending"))
+    return raw
+
+def normalized(aggregates):
+    return strip_envelopes(as_json(aggregates))
+
+def assert_same_as_full_run(output, raw):
+    full = transform_data(raw)
+    for name, (source, aggregate) in AGGREGATES.items():
+        assert normalized(output[name]) == normalized(aggregate(full[source])), name
+    assert normalized(output["transactions_with_products"]) == normalized(join_transactions_with_products(full["transactions"], full["products"]))
+    assert normalized(output["transactions_with_users"]) == normalized(join_transactions_with_users(full["transactions"], full["users"]))
+
+def test_deltas_give_the_same_aggregates_as_a_full_run(tmp_path):
+    raw = generate_dataset(400, seed=7)
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    assert_same_as_full_run(ingestor.ingest(raw), raw)
+
+    for _ in range(3):
+        raw = changed(raw)
+        output = ingestor.ingest(raw)
+        assert ingestor.last_delta["products"]["updated"] > 0
+        assert_same_as_full_run(output, raw)
+
+def test_removing_everything_and_adding_it_back(tmp_path):
+    raw = generate_dataset(100, seed=2)
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    ingestor.ingest(raw)
+    ingestor.ingest({"products": raw["products"][:1], "users": raw["users"][:1], "transactions": raw["transactions"][:1]})
+    assert_same_as_full_run(ingestor.ingest(raw), raw)
+
+def test_failed_fetch_keeps_the_source(tmp_path):
+    raw = generate_dataset(100, seed=2)
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    ids = {t["data"]["transaction_id"]: t["entity_id"] for t in ingestor.ingest(raw)["transactions"]}
+
+    output = ingestor.ingest(dict(raw, transactions=FailedFetch()))  # Upstream outage
+    assert ingestor.last_delta["transactions"] == {"added": 0, "updated": 0, "deleted": 0}
+    assert len(output["transactions"]) == 100
+    assert_same_as_full_run(output, raw)
+
+    restarted = IncrementalIngestor(str(tmp_path / "state.json"))  # The saved state kept them too
+    output = restarted.ingest(raw)
+    assert {t["data"]["transaction_id"]: t["entity_id"] for t in output["transactions"]} == ids
+
+def test_ordinals_keep_kept_keys_and_fit_new_ones_between():
+    previous = {"a": (0,), "b": (1,), "c": (2,)}
+    ordinals = assign_ordinals(["x", "a", "y", "z", "b", "c", "w"], previous)
+    assert [ordinals[key] for key in "abc"] == [(0,), (1,), (2,)]
+    assert sorted(ordinals, key=ordinals.get) == ["x", "a", "y", "z", "b", "c", "w"]
+    assert assign_ordinals(["b", "a"], previous) is None  # Reordered
+
+    ordinals = {"a": (0,), "b": (1,)}
+    for _ in range(MAX_ORDINAL_DEPTH - 1):  # Always inserted right before "b": one level deeper each time
+        ordinals = assign_ordinals([key for key in ordinals if key != "b"] + [object(), "b"], ordinals)
+    assert ordinals is not None and sorted(ordinals.values()) == list(ordinals.values())
+    assert len(max(ordinals.values(), key=len)) == MAX_ORDINAL_DEPTH
+    assert assign_ordinals([key for key in ordinals if key != "b"] + ["new", "b"], ordinals) is None  # Too deep
+
+def test_stream_batches_only_refold_the_groups_they_touch(tmp_path, monkeypatch):
+    raw = generate_dataset(300, seed=4)
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    ingestor.ingest(raw)
+
+    folds = []
+    fold = IncrementalAggregates.fold
+    monkeypatch.setattr(IncrementalAggregates, "fold", lambda self, spec, state: folds.append(spec.name) or fold(self, spec, state))
+    streamed = [dict(raw["transactions"][10], id=80_000), dict(raw["transactions"][20], status="delivered")]
+    output = ingestor.ingest_stream(streamed)
+    assert len(folds) <= 2 * len(transaction_specs())
+
+    raw["transactions"] = raw["transactions"] + streamed[:1]
+    raw["transactions"][20] = streamed[1]
+    assert output["transactions_with_products"][-1]["transaction_id"] == 80_000
+    assert_same_as_full_run(output, raw)
@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+import insight_cache
+from insight_cache import serialize_response
+
+def test_non_str_keys_are_serialized_like_the_stdlib():
+    content = {"transactions_per_user": {None: 2, "Ann Lee": 1}, "by_id": {3: "x"}}
+    assert json.loads(serialize_response(content)) == json.loads(json.dumps(content))
+
+def test_stdlib_fallback(monkeypatch):
+    monkeypatch.setattr(insight_cache, "orjson", None)
+    assert serialize_response({None: 1}) == b'{"null":1}'
+
+@pytest.mark.skipif(insight_cache.orjson is None, reason="orjson is not installed")
+def test_orjson_matches_the_stdlib_encoding(monkeypatch):
+    content = {None: [1, 2.5, "é"], "a": {"b": True}}
+    fast = serialize_response(content)
+    monkeypatch.setattr(insight_cache, "orjson", None)
+    assert fast == serialize_response(content)
@@ -0,0 +1,139 @@
+import copy
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+
+import columnar
+import insights
+from benchmarks.generate import generate_dataset
+from business_rules import average_transaction_value, calculate_user_spending, most_popular_categories
+from helpers import as_json, assert_close
+from runner import build_snapshot
+from transform import transform_data
+
+### ---- INSIGHTS BEFORE THE AGGREGATE SPECS (known-good reference) ---- ###
+
+def old_transactions_per_user(transactions):
+    counts = defaultdict(int)
+    for transaction in transactions:
+        counts[transaction["data"].get("user_name", "Unknown")] += 1
+    return dict(counts)
+
+def old_user_statistics(users):
+    gender_count = defaultdict(int)
+    age_categories = {"0-18": 0, "19-30": 0, "31-45": 0, "46-60": 0, "61+": 0}
+    current_year = datetime.utcnow().year
+    for user in users:
+        data = user.get("data", {})
+        dob = data.get("dob", "")
+        age = current_year - (int(dob[:4]) if dob and len(dob) >= 4 else current_year)
+        bucket = "0-18" if age <= 18 else "19-30" if age <= 30 else "31-45" if age <= 45 else "46-60" if age <= 60 else "61+"
+        age_categories[bucket] += 1
+        gender_count[data.get("gender", "Unknown")] += 1
+    return {"total_users": len(users), "gender_distribution": dict(gender_count), "age_distribution": age_categories}
+
+def old_top_selling_products(products, top_n=5):
+    sales = {}
+    for product in products:
+        title = product["data"].get("title", "Unknown")
+        if title:
+            sales[title] = product["data"].get("rating", {}).get("count", 0)
+    return sorted(sales.items(), key=lambda x: x[1], reverse=True)[:top_n]
+
+def old_expensive_and_cheapest_products(products):
+    ordered = sorted(products, key=lambda x: x["data"].get("price", 0))
+    return {"cheapest_product": ordered[0]["data"] if ordered else None, "most_expensive_product": ordered[-1]["data"] if ordered else None}
+
+def old_category_totals(products, value):
+    totals = defaultdict(int)
+    for product in products:
+        category = product["data"].get("category", "Unknown")
+        if category:
+            totals[category] += value(product["data"])
+    return dict(totals)
+
+def old_average_prices(products):
+    prices = defaultdict(list)
+    for product in products:
+        category = product["data"].get("category", "Unknown")
+        if category:
+            prices[category].append(product["data"].get("price", 0))
+    return {category: sum(values) / len(values) for category, values in prices.items()}
+
+def old_insights(data):
+    products, users, transactions = data["products"], data["users"], data["transactions"]
+    per_user = old_transactions_per_user(transactions)
+    revenue = old_category_totals(products, lambda d: d.get("price", 0))
+    return {
+        "total_transactions_per_user": per_user,
+        "user_with_most_transactions": max(per_user, key=per_user.get, default=None),
+        "users_with_no_transactions": {u["data"]["name"] for u in users} - set(per_user),
+        "calculate_user_statistics": old_user_statistics(users),
+        "top_selling_products": old_top_selling_products(products),
+        "expensive_and_cheapest_products": old_expensive_and_cheapest_products(products),
+        "category_wise_revenue": revenue,
+        "top_revenue_categories": sorted(revenue.items(), key=lambda x: x[1], reverse=True)[:5],
+        "most_rated_products": sorted(products, key=lambda x: x["data"].get("rating", {}).get("count", 0), reverse=True)[:5],
+        "calculate_user_spending": per_user,
+        "most_popular_categories": sorted(old_category_totals(products, lambda d: d.get("rating", {}).get("count", 0)).items(),
+                                          key=lambda x: x[1], reverse=True),
+        "average_transaction_value": old_average_prices(products)
+    }
+
+def new_insights(snapshot):
+    products, users, transactions = snapshot.products, snapshot.users, snapshot.transactions
+    p, u, t = snapshot.product_aggregates, snapshot.user_aggregates, snapshot.transaction_aggregates
+    return {
+        "total_transactions_per_user": insights.total_transactions_per_user(transactions, t),
+        "user_with_most_transactions": insights.user_with_most_transactions(transactions, t),
+        "users_with_no_transactions": set(insights.users_with_no_transactions(users, transactions, u, t)),
+        "calculate_user_statistics": insights.calculate_user_statistics(users, u),
+        "top_selling_products": insights.top_selling_products(products, aggregates=p),
+        "expensive_and_cheapest_products": insights.expensive_and_cheapest_products(products, p),
+        "category_wise_revenue": insights.category_wise_revenue(products, p),
+        "top_revenue_categories": insights.top_revenue_categories(products, aggregates=p),
+        "most_rated_products": insights.most_rated_products(products, p),
+        "calculate_user_spending": calculate_user_spending(transactions, t),
+        "most_popular_categories": most_popular_categories(products, p),
+        "average_transaction_value": average_transaction_value(products, p)
+    }
+
+# Generated data with ties in every ranked insight
+def tied_data():
+    raw = copy.deepcopy(generate_dataset(300, seed=5))
+    products = raw["products"]
+    top = max(p["rating"]["count"] for p in products) + 1
+    for product in products[1::3]:
+        product["rating"]["count"] = top  # Tied most rated products and top sellers
+    for i in (3, 8):
+        products[i]["price"] = min(p["price"] for p in products)
+        products[-i]["price"] = max(p["price"] for p in products)
+    products[7]["title"] = products[1]["title"]  # A repeated title: its last rating count counts
+    names = list(dict.fromkeys(t["user_name"] for t in raw["transactions"]))[:5]
+    for i, transaction in enumerate(raw["transactions"]):
+        if i < 200:
+            transaction["user_name"] = names[i % 4]  # Four users tied for the most transactions
+        elif transaction["user_name"] in names[:4]:
+            transaction["user_name"] = names[4]
+    return transform_data(raw)
+
+@pytest.mark.parametrize("engine", ["rows", "columnar"])
+def test_insights_match_the_implementation_before_the_aggregate_specs(engine, monkeypatch):
+    if engine == "columnar":
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(columnar, "COLUMNAR_INSIGHTS", engine == "columnar")
+    data = tied_data()
+    expected = old_insights(data)
+    actual = new_insights(build_snapshot(data))
+    for name in expected:
+        if name == "users_with_no_transactions":
+            assert actual[name] == expected[name]  # The old result was an unordered set difference
+        else:
+            assert_close(as_json(actual[name]), as_json(expected[name]), name)
+
+    # The ties above are really exercised
+    assert len({p["data"]["rating"]["count"] for p in expected["most_rated_products"]}) == 1
+    assert len({count for _, count in expected["top_selling_products"]}) == 1
+    counts = expected["total_transactions_per_user"]
+    assert list(counts.values()).count(counts[expected["user_with_most_transactions"]]) > 1
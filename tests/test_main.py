@@ -0,0 +1,29 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.generate import generate_dataset
+from snapshot_writer import write_snapshot
+from transform import transform_data
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)  # Not entered: the lifespan (pipeline start) does not run
+
+def test_profiling_is_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_TOKEN", "")
+    assert client.post("/metrics/profile").status_code == 404
+    assert client.get("/metrics/profile", headers={"X-Profile-Token": ""}).status_code == 404
+
+def test_profiling_needs_the_configured_token(client, monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(main.runner, "request_profile", lambda mode: None)
+    assert client.post("/metrics/profile").status_code == 403
+    assert client.post("/metrics/profile", headers={"X-Profile-Token": "wrong"}).status_code == 403
+    assert client.post("/metrics/profile", headers={"X-Profile-Token": "secret"}).status_code == 202
+
+def test_stage_metrics_use_one_label_schema():
+    write_snapshot(transform_data(generate_dataset(20)), root="snapshot_root")
+    for metric in ("pipeline_stage_seconds", "pipeline_stage_records_total"):
+        label_sets = {tuple(sorted(dict(key))) for key in main.REGISTRY.metrics[metric].values}
+        assert label_sets <= {("name", "stage")}
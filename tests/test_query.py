@@ -0,0 +1,77 @@
+import pytest
+
+import binary_snapshot
+from benchmarks.generate import generate_dataset
+from helpers import as_json
+from query import lookup_record, parse_filters, query_records
+from runner import build_snapshot
+from transform import transform_data
+
+QUERIES = {
+    "product": [
+        [("category", "men's clothing")],
+        [("price_min", "100"), ("price_max", "500")],
+        [("data.price__gt", "250"), ("category", "jewelery"), ("limit", "3")],
+        [("rating_min", "4"), ("fields", "data.title,data.rating.rate")],
+        [("data.id", "7")],
+        [("category", "no such category")]
+    ],
+    "user": [
+        [("data.gender", "female"), ("limit", "5")],
+        [("email", "lumi.carpentier0@example.com")]
+    ],
+    "transaction": [
+        [("status", "delivered"), ("limit", "10")],
+        [("status", "cancelled"), ("data.sender", "Twinder")],
+        [("data.transaction_id", "12")]
+    ]
+}
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return build_snapshot(transform_data(generate_dataset(200)), "v1")
+
+@pytest.fixture
+def backends(snapshot):
+    """{backend: (records_of(entity_type), indexes_of(entity_type))} for the in-memory and the memory-mapped snapshot."""
+    binary_snapshot.write_binary_snapshot(snapshot)
+    mapped = binary_snapshot.open_binary_snapshot("v1")
+    yield {
+        "memory": (lambda entity_type: getattr(snapshot, binary_snapshot.ENTITY_DATASETS[entity_type]), lambda entity_type: snapshot.indexes[entity_type]),
+        "binary": (lambda entity_type: mapped.records(binary_snapshot.ENTITY_DATASETS[entity_type]), mapped.indexes().get)
+    }
+
+# Every page of a query, following the cursors
+def all_pages(records, indexes, params):
+    pages, cursor = [], None
+    while True:
+        page, total, cursor = query_records(records, indexes, params + ([("cursor", cursor)] if cursor else []), "v1")
+        pages.append((as_json(page), total))
+        if cursor is None:
+            return pages
+
+@pytest.mark.parametrize("backend", ["memory", "binary"])
+@pytest.mark.parametrize("entity_type, params", [(entity_type, params) for entity_type, queries in QUERIES.items() for params in queries])
+def test_index_and_scan_agree(backends, backend, entity_type, params):
+    records_of, indexes_of = backends[backend]
+    records, indexes = records_of(entity_type), indexes_of(entity_type)
+    assert indexes
+    assert all_pages(records, indexes, params) == all_pages(records, {}, params)
+
+@pytest.mark.parametrize("backend", ["memory", "binary"])
+def test_lookup_with_and_without_index(backends, backend):
+    records_of, indexes_of = backends[backend]
+    records = records_of("product")
+    for key in ("1", "42", "999"):
+        assert as_json(lookup_record(records, indexes_of("product"), "product", key)) == as_json(lookup_record(records, {}, "product", key))
+
+def test_backends_agree(backends):
+    memory, binary = (backends[name] for name in ("memory", "binary"))
+    for entity_type, queries in QUERIES.items():
+        for params in queries:
+            assert all_pages(binary[0](entity_type), binary[1](entity_type), params) == all_pages(memory[0](entity_type), memory[1](entity_type), params)
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", "NaN", "1e999"])
+def test_non_finite_range_values_are_rejected(value):
+    with pytest.raises(ValueError, match="finite"):
+        parse_filters([("price_min", value)])
@@ -0,0 +1,92 @@
+import itertools
+import os
+import time
+
+import binary_snapshot
+import sqlite_store
+from benchmarks.generate import generate_dataset
+from records import FailedFetch
+from runner import PipelineRunner, build_snapshot
+from transform import transform_data
+
+EMPTY = {"products": [], "users": [], "transactions": []}
+
+def sqlite_runner(monkeypatch, raw):
+    monkeypatch.setattr(sqlite_store, "STORAGE_BACKEND", "sqlite")
+    runner = PipelineRunner(lambda: transform_data(raw, lazy=True), interval=0, persist=False)
+    runner.refresh()
+    assert runner.last_error is None
+    return runner
+
+def test_lazy_transform_of_empty_source_is_empty():
+    assert transform_data(EMPTY, lazy=True)["transactions"] == []
+
+def test_lazy_transform_yields_every_transaction():
+    raw = generate_dataset(50)
+    assert len(list(transform_data(raw, lazy=True)["transactions"])) == 50
+
+def test_empty_lazy_pipeline_keeps_current_snapshot(monkeypatch):
+    runner = sqlite_runner(monkeypatch, generate_dataset(100))
+    good = runner.snapshot
+    assert len(good.transactions) == 100
+
+    runner.pipeline = lambda: transform_data(EMPTY, lazy=True)  # Upstream outage
+    runner.refresh()
+    assert runner.snapshot is good
+    assert "no data" in runner.last_error
+
+def test_failed_lazy_load_leaves_no_partial_database(monkeypatch):
+    raw = generate_dataset(100)
+    runner = sqlite_runner(monkeypatch, raw)
+    good = runner.snapshot
+
+    def failing():
+        raise RuntimeError("upstream broke")
+        yield
+
+    def broken_pipeline():
+        data = transform_data(raw, lazy=True)
+        data["transactions"] = itertools.chain(data["transactions"], failing())
+        return data
+
+    runner.pipeline = broken_pipeline
+    runner.refresh()
+    assert runner.snapshot is good
+    assert "upstream broke" in runner.last_error
+    databases = [name for name in os.listdir(sqlite_store.SQLITE_ROOT) if name.endswith(".db")]
+    assert databases == [f"{good.version}.db"]
+
+def test_reader_unmaps_replaced_binary_snapshots(monkeypatch):
+    monkeypatch.setattr(binary_snapshot, "BINARY_SNAPSHOTS", True)
+    data = transform_data(generate_dataset(30))
+    reader = PipelineRunner(lambda: EMPTY, persist=False)
+    reader.retire_grace = 0.05
+
+    binary_snapshot.write_binary_snapshot(build_snapshot(data, "v1"))
+    assert reader.follow()
+    in_flight = reader.snapshot  # A request still reading v1
+    mapped = in_flight.mapped
+
+    binary_snapshot.write_binary_snapshot(build_snapshot(data, "v2"))
+    assert reader.follow() and reader.snapshot.version == "v2"
+    time.sleep(0.2)
+    assert not mapped.mmap.closed and len(in_flight.transactions) == 30
+
+    del in_flight
+    time.sleep(0.2)
+    assert mapped.mmap.closed and not reader.snapshot.mapped.mmap.closed
+
+def test_failed_source_keeps_the_current_snapshots_records(monkeypatch):
+    for backend in ("memory", "sqlite"):
+        monkeypatch.setattr(sqlite_store, "STORAGE_BACKEND", backend)
+        raw = generate_dataset(100)
+        runner = PipelineRunner(lambda: transform_data(raw, lazy=backend == "sqlite"), interval=0, persist=False)
+        runner.refresh()
+        users = [user["entity_id"] for user in runner.snapshot.users]
+
+        raw = dict(raw, users=FailedFetch(), transactions=raw["transactions"][:50])  # Users upstream is down
+        runner.refresh()
+        assert runner.last_error is None
+        assert [user["entity_id"] for user in runner.snapshot.users] == users
+        assert len(runner.snapshot.transactions) == 50
+        assert runner.snapshot.user_aggregates["total_users"] == len(users)
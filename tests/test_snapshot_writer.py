@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import snapshot_writer
+from benchmarks.generate import generate_dataset
+from snapshot_writer import read_snapshot, write_snapshot
+
+def datasets(size=20):
+    raw = generate_dataset(size)
+    return {name: raw[name] for name in ("products", "users", "transactions")}
+
+@pytest.mark.parametrize("fmt, compression", [("ndjson", None), ("json", "gzip")])
+def test_round_trip(tmp_path, fmt, compression):
+    data = datasets()
+    write_snapshot(data, root=str(tmp_path), fmt=fmt, compression=compression, version="v1")
+    version, loaded = read_snapshot(str(tmp_path))
+    assert version == "v1" and loaded == data
+
+def test_failed_write_keeps_the_previous_snapshot(tmp_path):
+    write_snapshot(datasets(), root=str(tmp_path), version="v1")
+
+    def broken():
+        yield {"id": 1}
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        write_snapshot(dict(datasets(), transactions=broken()), root=str(tmp_path), version="v2")
+    assert read_snapshot(str(tmp_path))[0] == "v1"
+    assert os.listdir(tmp_path / "snapshots") == ["v1"]
+
+def test_staging_left_by_a_crash_is_ignored_and_cleaned(tmp_path):
+    write_snapshot(datasets(), root=str(tmp_path), version="v1")
+    crashed = tmp_path / "snapshots" / ".tmp-v2"
+    crashed.mkdir()
+    (crashed / "transactions.ndjson").write_bytes(b'{"id": 1')  # Truncated, no manifest
+    assert read_snapshot(str(tmp_path))[0] == "v1"
+
+    write_snapshot(datasets(), root=str(tmp_path), version="v3")
+    assert sorted(os.listdir(tmp_path / "snapshots")) == ["v1", "v3"]
+
+def test_every_file_is_synced_before_the_rename(tmp_path, monkeypatch):
+    synced, renamed = [], []
+    fsync_file, rename = snapshot_writer.fsync_file, os.rename
+    monkeypatch.setattr(snapshot_writer, "fsync_file", lambda path: (synced.append(os.path.basename(path)), fsync_file(path)))
+    monkeypatch.setattr(snapshot_writer.os, "rename", lambda src, dst: (renamed.append(sorted(synced)), rename(src, dst)))
+    write_snapshot(datasets(), root=str(tmp_path), fmt="ndjson", compression=None, version="v1")
+    assert renamed == [["products.ndjson", "transactions.ndjson", "users.ndjson"]]
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+import sqlite_store
+from aggregations import aggregate_products, aggregate_transactions, aggregate_users
+from benchmarks.generate import generate_dataset
+from helpers import as_json, assert_close
+from query import query_records
+from runner import PipelineRunner, build_snapshot
+from snapshot_writer import new_version
+from transform import transform_data
+
+@pytest.fixture
+def data():
+    data = transform_data(generate_dataset(300, seed=5))
+    data["products"][0]["data"]["category"] = None
+    del data["products"][1]["data"]["title"]
+    data["products"][2]["data"]["rating"] = None
+    data["users"][0]["data"]["dob"] = "unknown"
+    data["users"][1]["data"]["dob"] = ""
+    data["transactions"][0]["data"]["user_name"] = None
+    del data["transactions"][1]["data"]["user_name"]
+    return data
+
+@pytest.fixture
+def store(data):
+    store = sqlite_store.write_store(data, new_version())
+    yield store
+    store.close()
+
+def test_aggregates_match_the_python_engine(data, store):
+    assert_close(as_json(store.product_aggregates()), as_json(aggregate_products(data["products"])))
+    assert_close(as_json(store.user_aggregates()), as_json(aggregate_users(data["users"])))
+    assert as_json(store.transaction_aggregates()) == as_json(aggregate_transactions(data["transactions"]))
+
+@pytest.mark.parametrize("entity_type, params", [
+    ("transaction", [("data.user_name", "None")]),
+    ("transaction", [("status", "shipped"), ("limit", "7")]),
+    ("product", [("data.category", "None")]),
+    ("product", [("price_min", "100"), ("price_max", "400")]),
+    ("user", [("data.gender", "female"), ("offset", "3")])
+])
+def test_filters_match_the_memory_engine(data, store, entity_type, params):
+    memory = build_snapshot(data)
+    records = getattr(memory, f"{entity_type}s")
+    expected = query_records(records, memory.indexes[entity_type], params, memory.version)
+    page, total, _ = store.query(entity_type, params, store.version)
+    assert total == expected[1]
+    assert as_json(page) == as_json(expected[0])
+
+def test_null_keys_are_stored_as_null(store):
+    assert store.execute("SELECT COUNT(*) FROM transactions WHERE user_name = 'None'").fetchone()[0] == 0
+    assert store.execute("SELECT COUNT(*) FROM transactions WHERE user_name IS NULL").fetchone()[0] == 2
+
+def test_close_closes_every_thread_connection(store):
+    store.execute("SELECT 1")
+    store.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.execute("SELECT 1")
+
+def test_publish_closes_the_replaced_store(monkeypatch):
+    monkeypatch.setattr(sqlite_store, "STORAGE_BACKEND", "sqlite")
+    raw = generate_dataset(50)
+    runner = PipelineRunner(lambda: transform_data(raw), interval=0, persist=False)
+    runner.retire_grace = 0
+    runner.refresh()
+    first = runner.snapshot.store
+    len(runner.snapshot.transactions)  # Opens a connection
+    runner.refresh()
+    assert first.closed and not runner.snapshot.store.closed
@@ -0,0 +1,75 @@
+import json
+import time
+
+import binary_snapshot
+from benchmarks.generate import generate_dataset
+from incremental import IncrementalIngestor
+from runner import PipelineRunner
+from streaming import StreamIngestor, parse_lines
+
+def incremental_runner(tmp_path, raw):
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    runner = PipelineRunner(lambda: ingestor.ingest(raw), interval=0, persist=False)
+    runner.refresh()
+    return ingestor, runner
+
+def new_transactions(raw, first_id, count):
+    return [dict(raw["transactions"][0], id=first_id + i) for i in range(count)]
+
+def test_stream_batch_overtaken_by_a_full_run_is_dropped(tmp_path):
+    raw = generate_dataset(60)
+    ingestor, runner = incremental_runner(tmp_path, raw)
+    batch = ingestor.ingest_stream(new_transactions(raw, 1000, 2))
+    runner.refresh()  # Ingests after the batch, publishes first
+    current = runner.snapshot
+    runner.publish_increment(batch)
+    assert runner.snapshot is current
+    assert len(current.transactions) == 62
+
+def test_only_new_keys_are_marked_streamed(tmp_path):
+    raw = generate_dataset(60)
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    ingestor.ingest(raw)
+    owned = dict(raw["transactions"][0], status="refunded")
+    output = ingestor.ingest_stream([owned] + new_transactions(raw, 1000, 1))
+    assert sum(t["data"]["status"] == "refunded" for t in output["transactions"]) == 1
+
+    # The source drops its transaction; the streamed one stays
+    ids = {t["data"]["transaction_id"] for t in ingestor.ingest(dict(raw, transactions=raw["transactions"][1:]))["transactions"]}
+    assert owned["id"] not in ids and 1000 in ids
+
+def test_invalid_lines_are_counted_not_printed(capsys):
+    records = list(parse_lines([b'{"id": 1}\n', b"not json\n", b"[1]\n", b"\n"]))
+    assert records == [{"id": 1}]
+    assert capsys.readouterr().out == ""
+
+def test_binary_writes_of_increments_are_throttled(tmp_path, monkeypatch):
+    raw = generate_dataset(30)
+    ingestor, runner = incremental_runner(tmp_path, raw)
+    writes = []
+    monkeypatch.setattr(binary_snapshot, "BINARY_SNAPSHOTS", True)
+    monkeypatch.setattr(binary_snapshot, "write_binary_snapshot", lambda snapshot: writes.append(snapshot.version))
+    runner.persist = True
+    runner.binary_increment_seconds = 60
+    for first_id in (1000, 2000, 3000):
+        runner.publish_increment(ingestor.ingest_stream(new_transactions(raw, first_id, 1)))
+    assert len(writes) == 1 and runner._binary_timer is not None
+    runner._binary_timer.cancel()
+
+def test_file_source_end_to_end(tmp_path):
+    raw = generate_dataset(40)
+    ingestor, runner = incremental_runner(tmp_path, raw)
+    path = tmp_path / "orders.ndjson"
+    path.write_text("".join(json.dumps(t) + "\n" for t in new_transactions(raw, 5000, 25)) + "garbage\n", encoding="utf-8")
+
+    stream = StreamIngestor(f"file:{path}", ingestor, runner.publish_increment, batch_size=10, batch_seconds=0.05)
+    stream.start()
+    try:
+        deadline = time.monotonic() + 10
+        while len(runner.snapshot.transactions) < 65 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stream.stop()
+    assert len(runner.snapshot.transactions) == 65
+    assert stream.last_error is None
+    assert runner.snapshot.transaction_windows.sliding(3600)["total"] == 25
@@ -0,0 +1,38 @@
+import pytest
+
+import transform
+from benchmarks.generate import generate_dataset
+from helpers import as_json, strip_envelopes
+from transform import transform_data
+
+@pytest.fixture
+def parallel(monkeypatch):
+    monkeypatch.setattr(transform, "PARALLEL_THRESHOLD", 10)
+    yield
+    transform.shutdown_pool()
+
+def resolved(data):
+    """Transactions with the data of the user and product they resolved to (entity ids differ between runs)."""
+    users = {user["entity_id"]: user["data"]["id"] for user in data["users"]}
+    products = {product["entity_id"]: product["data"]["id"] for product in data["products"]}
+    return [(t["data"], users.get(t["metadata"].get("user_entity_id")), products.get(t["metadata"].get("product_entity_id")))
+            for t in as_json(data["transactions"])]
+
+def test_parallel_transform_matches_serial(parallel):
+    raw = generate_dataset(300, seed=4)
+    serial = transform_data(raw, workers=1)
+    pooled = transform_data(raw, workers=2, chunk_size=40)
+    for name in ("products", "users"):
+        assert strip_envelopes(as_json(pooled[name])) == strip_envelopes(as_json(serial[name]))
+    assert resolved(pooled) == resolved(serial)
+    assert any(user is not None for _, user, _ in resolved(pooled))
+
+def test_pool_is_reused_and_gets_each_runs_index(parallel):
+    first = generate_dataset(200, seed=1)
+    transform_data(first, workers=2, chunk_size=40)
+    pool = transform.get_pool(2)
+
+    second = generate_dataset(200, seed=2)  # Different users, so a stale index would resolve nothing
+    pooled = transform_data(second, workers=2, chunk_size=40)
+    assert transform.get_pool(2) is pool
+    assert resolved(pooled) == resolved(transform_data(second, workers=1))
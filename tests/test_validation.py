@@ -0,0 +1,64 @@
+import json
+
+from transform import transform_data
+from validation import DeadLetters, validated
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+def test_invalid_records_are_routed_to_the_dead_letter_file(tmp_path):
+    letters = DeadLetters(str(tmp_path / "dead.ndjson"))
+    records = [
+        {"id": 1, "title": "Ok", "category": "c", "price": 1.5},
+        {"id": 2, "title": "No price", "category": "c"},
+        {"id": 3, "title": "Bool price", "category": "c", "price": True},
+        "not a record"
+    ]
+    assert [r["id"] for r in validated("products", records, letters)] == [1]
+    assert letters.counts == {"products": {"missing price": 1, "invalid price": 1, "not an object": 1}}
+    lines = read_lines(letters.path)
+    assert [line["reason"] for line in lines] == ["missing price", "invalid price", "not an object"]
+    assert all(line["source"] == "products" and line["hash"] for line in lines)
+
+def test_transaction_schema_requires_only_the_id(tmp_path):
+    letters = DeadLetters(str(tmp_path / "dead.ndjson"))
+    good = {"id": 1, "parcel_id": "2", "status": "shipped", "sender": "s", "user_name": "n", "user_phone": "p"}
+    sparse = {"id": 3}  # The transform fills in "Unknown"
+    bad = dict(good, id=2, status=None)
+    assert list(validated("transactions", [good, bad, sparse, {"status": "shipped"}], letters)) == [good, sparse]
+    assert letters.counts["transactions"] == {"invalid status": 1, "missing id": 1}
+
+def test_repeated_runs_write_each_record_once_and_count_per_run(tmp_path):
+    letters = DeadLetters(str(tmp_path / "dead.ndjson"))
+    bad = [{"id": 1}, {"id": 2}]
+    for _ in range(3):
+        assert list(validated("products", bad, letters)) == []
+        assert letters.counts["products"] == {"missing title": 2}
+    assert len(read_lines(letters.path)) == 2
+
+    # A restarted process remembers what the file already holds
+    letters.close()
+    restarted = DeadLetters(letters.path)
+    list(validated("products", bad + [{"id": 3}], restarted))
+    assert len(read_lines(letters.path)) == 3
+    restarted.close()
+
+def test_dead_letter_file_is_rotated(tmp_path):
+    letters = DeadLetters(str(tmp_path / "dead.ndjson"), max_bytes=200)
+    list(validated("products", [{"id": i, "padding": "x" * 100} for i in range(5)], letters))
+    letters.close()
+    assert len(read_lines(letters.path)) + len(read_lines(letters.path + ".1")) <= 5
+    assert len(read_lines(letters.path)) >= 1
+
+def test_transform_data_dead_letters_invalid_records(dead_letters):
+    raw = {
+        "products": [{"id": 1, "title": "P", "category": "c", "price": 2.0}, {"id": 2}],
+        "users": [],
+        "transactions": [{"id": 1, "parcel_id": "1", "status": "shipped", "sender": "s", "user_name": "n", "user_phone": "p"}, {"parcel_id": "2"}]
+    }
+    data = transform_data(raw)
+    assert len(data["products"]) == 1 and len(data["transactions"]) == 1
+    assert dead_letters.counts["products"] == {"missing title": 1}
+    assert dead_letters.counts["transactions"] == {"missing id": 1}
+    assert len(read_lines(dead_letters.path)) == 2
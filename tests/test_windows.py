@@ -0,0 +1,43 @@
+import pytest
+
+from benchmarks.generate import generate_dataset
+from incremental import IncrementalIngestor
+from runner import build_snapshot
+from transform import transform_data
+from windows import TransactionWindows
+
+def streamed(raw, first_id, count):
+    template = raw["transactions"][0]
+    return [dict(template, id=first_id + i, status="streamed") for i in range(count)]
+
+def test_batch_stamped_transactions_are_not_windowed():
+    snapshot = build_snapshot(transform_data(generate_dataset(50)))
+    with pytest.raises(ValueError, match="no event time"):
+        snapshot.transaction_windows.sliding(3600)
+    with pytest.raises(ValueError, match="no event time"):
+        snapshot.transaction_windows.tumbling(3600)
+
+def test_windows_count_streamed_transactions_only(tmp_path):
+    raw = generate_dataset(50)
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    assert ingestor.ingest(raw)["transaction_windows"].sliding(3600)["total"] == 0
+
+    output = ingestor.ingest_stream(streamed(raw, 1000, 5))
+    assert output["transaction_windows"].sliding(3600)["by_status"] == {"streamed": 5}
+
+    # Kept by the next full run, which does not list them
+    assert ingestor.ingest(raw)["transaction_windows"].sliding(3600)["total"] == 5
+
+def test_published_windows_do_not_change(tmp_path):
+    raw = generate_dataset(50)
+    ingestor = IncrementalIngestor(str(tmp_path / "state.json"))
+    ingestor.ingest(raw)
+    first = ingestor.ingest_stream(streamed(raw, 1000, 3))["transaction_windows"]
+    second = ingestor.ingest_stream(streamed(raw, 2000, 4))["transaction_windows"]
+    assert first.sliding(3600)["total"] == 3
+    assert second.sliding(3600)["total"] == 7
+
+def test_state_round_trip_keeps_the_event_time_flag():
+    windows = TransactionWindows(event_times=True)
+    restored = TransactionWindows.from_dict(windows.to_dict())
+    assert restored.event_times and restored.copy().event_times
@@ -1,103 +1,307 @@
 
+import itertools
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import threading
 import uuid
-import datetime
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-# Generate a unique ID for each transformed entity
+from metrics import RECORDS_DROPPED, count_records, timed
+from records import FailedFetch, ProductRecord, TransactionRecord, UserRecord, batch_timestamp, new_entity_id, parse_entity_id
+from validation import DEAD_LETTERS, validated
+
+# Parallel transform settings
+TRANSFORM_WORKERS = int(os.environ.get("TRANSFORM_WORKERS", "0")) or os.cpu_count() or 1
+TRANSFORM_CHUNK_SIZE = int(os.environ.get("TRANSFORM_CHUNK_SIZE", "5000"))
+PARALLEL_THRESHOLD = int(os.environ.get("TRANSFORM_PARALLEL_THRESHOLD", "50000"))  # Smaller lists are transformed serially
+
+# Source (validation.SCHEMAS) of each entity type
+SOURCES = {"product": "products", "user": "users", "transaction": "transactions"}
+
+# Generate a unique (compact) ID for each transformed entity
 def generate_unique_id():
-    return str(uuid.uuid4())
+    return new_entity_id()
+
+# Intern low-cardinality strings so every record shares one copy
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
 
 # Transform raw product data into a standardized format
-def transform_product(product):
+def transform_product(product, timestamp=None):
+    """Returns a ProductRecord; `timestamp` is the batch timestamp shared by all records of a run."""
     try:
-        return {
-            "entity_id": generate_unique_id(),
-            "entity_type": "product",
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "data": {
-                "id": product["id"],
-                "title": product["title"],
-                "category": product["category"],
-                "price": product["price"],
-                "rating": product.get("rating", {})  # Handle missing rating field
-            },
-            "metadata": {
-                "source": "fakestoreapi",
-                "processed_at": datetime.datetime.utcnow().isoformat()
-            }
-        }
+        return ProductRecord({
+            "id": product["id"],
+            "title": product["title"],
+            "category": intern(product["category"]),
+            "price": product["price"],
+            "rating": product.get("rating", {})  # Handle missing rating field
+        }, timestamp, generate_unique_id())
     except Exception as e:
         print(f"Error in transform_product: {e}")
         return {}
 
 # Transform raw user data into a standardized format
-def transform_user(user):
+def transform_user(user, timestamp=None):
+    """Returns a UserRecord; `timestamp` is the batch timestamp shared by all records of a run."""
     try:
-        return {
-            "entity_id": generate_unique_id(),
-            "entity_type": "user",
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "data": {
-                "id": user["login"]["uuid"],
-                "name": f"{user['name']['first']} {user['name']['last']}",
-                "gender": user.get("gender", "Unknown"),
-                "email": user.get("email", "Unknown"),
-                "location": f"{user['location'].get('state', 'Unknown')} , {user['location'].get('country', 'Unknown')}",
-                "user_name": user["login"]["username"],
-                "password": user["login"]["password"],
-                "dob": user["dob"]["date"],
-                "phone": user.get("phone", "Unknown")
-            },
-            "metadata": {
-                "source": "randomuserapi",
-                "processed_at": datetime.datetime.utcnow().isoformat()
-            }
-        }
+        return UserRecord({
+            "id": user["login"]["uuid"],
+            "name": f"{user['name']['first']} {user['name']['last']}",
+            "gender": intern(user.get("gender", "Unknown")),
+            "email": user.get("email", "Unknown"),
+            "location": f"{user['location'].get('state', 'Unknown')} , {user['location'].get('country', 'Unknown')}",
+            "user_name": user["login"]["username"],
+            "password": user["login"]["password"],
+            "dob": user["dob"]["date"],
+            "phone": user.get("phone", "Unknown")
+        }, timestamp, generate_unique_id())
     except Exception as e:
         print(f"Error in transform_user: {e}")
         return {}
 
+# Build hash indexes over transformed users and products
+def build_lookup_index(users, products):
+    """Builds the lookup tables used to resolve transactions to users and products in O(1).
+
+    Users are keyed on id, name and phone, products on id (as a string, the same way
+    `parcel_id` is matched in business_rules). The first record wins on duplicate keys.
+    """
+    index = {"user_id": {}, "user_name": {}, "user_phone": {}, "product_id": {}}
+
+    for user in users:
+        user_data = user.get("data")
+        if not user_data:
+            continue  # Skip users that failed to transform
+        index["user_id"].setdefault(user_data.get("id"), user)
+        index["user_name"].setdefault(user_data.get("name"), user)
+        index["user_phone"].setdefault(user_data.get("phone"), user)
+
+    for product in products:
+        product_data = product.get("data")
+        if not product_data:
+            continue  # Skip products that failed to transform
+        index["product_id"].setdefault(str(product_data.get("id")), product)
+
+    return index
+
+# Resolve the user a raw transaction belongs to
+def resolve_user(transaction, index):
+    """Finds the user by id, falling back to name and then phone."""
+    for field, key in (("user_id", "user_id"), ("user_name", "user_name"), ("user_phone", "user_phone")):
+        value = transaction.get(field)
+        if value and value in index[key]:
+            return index[key][value]
+    return None
+
+# Resolve the product a raw transaction refers to
+def resolve_product(transaction, index):
+    """Finds the product by id, falling back to the parcel id."""
+    for field in ("product_id", "parcel_id"):
+        value = transaction.get(field)
+        if value is not None and str(value) in index["product_id"]:
+            return index["product_id"][str(value)]
+    return None
+
 # Transform raw transaction data into a standardized format
-def transform_transaction(transaction, users, products):
+def transform_transaction(transaction, users, products, index=None, timestamp=None):
+    """Returns a TransactionRecord holding the entity ids of the resolved user and product."""
     try:
-        user_id = transaction.get("user_id")
-        product_id = transaction.get("product_id")
-
-        user = next((u for u in users if u["data"].get("id") == user_id), None) if user_id else None
-        product = next((p for p in products if p["data"].get("id") == product_id), None) if product_id else None
-
-        return {
-            "entity_id": generate_unique_id(),
-            "entity_type": "transaction",
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "data": {
-                "transaction_id": transaction.get("id"),
-                "parcel_id": transaction.get("parcel_id", "Unknown"),
-                "status": transaction.get("status", "Unknown"),
-                "sender": transaction.get("sender", "Unknown"),
-                "user_phone": transaction.get("user_phone", "Unknown"),
-                "user_name": transaction.get("user_name", "Unknown")
-            },
-            "metadata": {
-                "source": "mockaroo",
-                "processed_at": datetime.datetime.utcnow().isoformat()
-            }
-        }
+        if index is None:
+            index = build_lookup_index(users, products)  # Callers transforming many records should pass a prebuilt index
+
+        user = resolve_user(transaction, index)
+        product = resolve_product(transaction, index)
+
+        return TransactionRecord({
+            "transaction_id": transaction.get("id"),
+            "parcel_id": transaction.get("parcel_id", "Unknown"),
+            "status": intern(transaction.get("status", "Unknown")),
+            "sender": intern(transaction.get("sender", "Unknown")),
+            "user_phone": transaction.get("user_phone", "Unknown"),
+            "user_name": transaction.get("user_name", "Unknown")
+        }, timestamp, generate_unique_id(),
+            user_entity_id=parse_entity_id(user["entity_id"]) if user else None,  # Resolved references
+            product_entity_id=parse_entity_id(product["entity_id"]) if product else None)
     except Exception as e:
         print(f"Error in transform_transaction: {e}")
         return {}
 
+# Lazily transform a stream of transactions
+def iter_transform_transactions(transactions, users, products, index=None, timestamp=None):
+    """Yields `(raw, record)` for every raw transaction; each is transformed only when it is consumed."""
+    index = index if index is not None else build_lookup_index(users, products)
+    for transaction in transactions:
+        yield transaction, transform_transaction(transaction, users, products, index, timestamp)
+
+### ---- PARALLEL TRANSFORM ---- ###
+
+# Process pool shared by every run, started on first use
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# Lookup index of the current worker process: (path it was loaded from, index)
+_worker_index = (None, None)
+
+def get_pool(workers):
+    """Returns the process-wide transform pool of `workers` processes.
+
+    Workers are started with forkserver (spawn where it is unavailable): forking the
+    threaded server would copy locks other threads hold (metrics, dead letters, HTTP cache).
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            _pool_workers = workers
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+# Ship a lookup index to the pool's workers through a file each worker reads once per run
+def write_worker_index(index):
+    path = os.path.join(tempfile.gettempdir(), f"transform-index-{uuid.uuid4().hex}.pickle")
+    with open(path, "wb") as file:
+        pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+def load_worker_index(path):
+    global _worker_index
+    if path is not None and _worker_index[0] != path:
+        with open(path, "rb") as file:
+            _worker_index = (path, pickle.load(file))
+    return _worker_index[1] if path is not None else None
+
+def _run_chunk(chunk_transform, chunk, index_path=None, timestamp=None):
+    return chunk_transform(chunk, load_worker_index(index_path), timestamp)
+
+# Keep only what transactions need from the resolved records
+def slim_lookup_index(index):
+    """Returns a copy of `index` whose values only carry `entity_id`, so it is cheap to ship to workers."""
+    return {name: {key: {"entity_id": record["entity_id"]} for key, record in table.items()} for name, table in index.items()}
+
+def _transform_product_chunk(chunk, index=None, timestamp=None):
+    return [transform_product(p, timestamp) for p in chunk]
+
+def _transform_user_chunk(chunk, index=None, timestamp=None):
+    return [transform_user(u, timestamp) for u in chunk]
+
+def _transform_transaction_chunk(chunk, index=None, timestamp=None):
+    return [transform_transaction(t, None, None, index, timestamp) for t in chunk]
+
+# Map a chunk transform over a list on the process pool
+def parallel_map(chunk_transform, records, workers, chunk_size, index=None, timestamp=None):
+    """Transforms `records` in chunks of `chunk_size` on the shared pool of `workers` processes, keeping input order.
+
+    The lookup `index` is written to a temporary file that each worker loads once per call.
+    """
+    index_path = write_worker_index(slim_lookup_index(index)) if index is not None else None
+    try:
+        chunks = [records[start:start + chunk_size] for start in range(0, len(records), chunk_size)]
+        run_chunk = partial(_run_chunk, chunk_transform, index_path=index_path, timestamp=timestamp)
+        return [record for chunk in get_pool(workers).map(run_chunk, chunks) for record in chunk]
+    finally:
+        if index_path is not None:
+            os.remove(index_path)
+
+# Transform one entity list, in parallel only when it is large enough to pay off
+def transform_list(records, chunk_transform, workers, chunk_size, index=None, timestamp=None):
+    if workers > 1 and len(records) >= max(PARALLEL_THRESHOLD, chunk_size):
+        return parallel_map(chunk_transform, records, workers, chunk_size, index, timestamp)
+    return chunk_transform(records, index, timestamp)
+
+# Drop failed transforms, dead-lettering their raw records
+def keep_transformed(entity_type, raws, transformed):
+    """Returns the successfully transformed records (failed transforms come back as {}) and counts both."""
+    kept = []
+    for raw, record in zip(raws, transformed):
+        if record:
+            kept.append(record)
+        else:
+            DEAD_LETTERS.add(SOURCES[entity_type], "transform error", raw)
+    count_records("transform", len(kept), name=entity_type)
+    if len(kept) < len(raws):
+        RECORDS_DROPPED.inc(len(raws) - len(kept), entity_type=entity_type)
+    return kept
+
+# transform_list with validation, per entity type timing and a count of records lost to transform errors
+def measured_transform(entity_type, records, chunk_transform, workers, chunk_size, index=None, timestamp=None):
+    with timed("transform", name=entity_type):
+        records = list(validated(SOURCES[entity_type], records))  # Invalid records go to the dead-letter file
+        transformed = transform_list(records, chunk_transform, workers, chunk_size, index, timestamp)
+    return keep_transformed(entity_type, records, transformed)
+
+# Split any iterable into lists of `size`
+def chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Lazily validate and transform a source, one chunk at a time
+def iter_transform(entity_type, records, chunk_transform, chunk_size, index=None, timestamp=None):
+    """Yields the transformed records of `records` (any iterable) while holding only one chunk in memory."""
+    for chunk in chunked(validated(SOURCES[entity_type], records), chunk_size):
+        with timed("transform", name=entity_type):
+            transformed = chunk_transform(chunk, index, timestamp)
+        yield from keep_transformed(entity_type, chunk, transformed)
+
 # Transform all raw data into standardized format
-def transform_data(raw_data):
+def transform_data(raw_data, workers=None, chunk_size=None, lazy=False):
+    """Transforms products, users and transactions.
+
+    Every source is checked by its validation.VALIDATORS entry first; invalid records and
+    failed transforms are written to the dead-letter file and left out of the result.
+    Lists of at least PARALLEL_THRESHOLD records are split into `chunk_size` chunks and
+    transformed on `workers` processes (defaults: TRANSFORM_WORKERS, TRANSFORM_CHUNK_SIZE);
+    output order always matches input order. With `lazy`, transactions are returned as a
+    generator that transforms one chunk at a time as it is consumed (serially), so a
+    streaming consumer such as sqlite_store.write_store never holds them all. The first
+    chunk is transformed here, so a source without valid transactions still comes back
+    as an empty list; errors in later chunks are raised to the consumer. A source whose
+    fetch failed (a records.FailedFetch) comes back as a FailedFetch.
+    """
+    workers = workers or TRANSFORM_WORKERS
+    chunk_size = chunk_size or TRANSFORM_CHUNK_SIZE
+    timestamp = batch_timestamp()  # One timestamp for the whole batch
     try:
-        transformed_products = [transform_product(p) for p in raw_data["products"]]
-        transformed_users = [transform_user(u) for u in raw_data["users"]]
-        transformed_transactions = [transform_transaction(t, transformed_users, transformed_products) for t in raw_data["transactions"]]
+        transformed_products = measured_transform("product", raw_data["products"], _transform_product_chunk, workers, chunk_size, None, timestamp)
+        transformed_users = measured_transform("user", raw_data["users"], _transform_user_chunk, workers, chunk_size, None, timestamp)
+        with timed("index", name="lookup"):
+            index = build_lookup_index(transformed_users, transformed_products)  # Built once for all transactions
+        if lazy:
+            transactions = iter_transform("transaction", raw_data["transactions"], _transform_transaction_chunk, chunk_size, index, timestamp)
+            first = next(transactions, None)  # Peek, so emptiness checks such as PipelineRunner.compute still work
+            transformed_transactions = itertools.chain([first], transactions) if first is not None else []
+        else:
+            transformed_transactions = measured_transform("transaction", raw_data["transactions"], _transform_transaction_chunk, workers, chunk_size, index, timestamp)
 
-        return {
+        transformed = {
             "products": transformed_products,
             "users": transformed_users,
             "transactions": transformed_transactions
         }
+        for name in SOURCES.values():
+            if isinstance(raw_data[name], FailedFetch):
+                transformed[name] = FailedFetch()  # Not an empty source: PipelineRunner.compute keeps the current records
+        return transformed
     except Exception as e:
         print(f"Error in transform_data: {e}")
         return {"products": [], "users": [], "transactions": []}  # Return empty lists on failure
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from metrics import REGISTRY
+from snapshot_writer import SNAPSHOT_ROOT
+
+# Invalid records are appended here as NDJSON: {"source", "reason", "at", "hash", "record"}
+DEAD_LETTER_FILE = os.environ.get("DEAD_LETTER_FILE", os.path.join(SNAPSHOT_ROOT, "dead_letter.ndjson"))
+DEAD_LETTER_MAX_BYTES = int(os.environ.get("DEAD_LETTER_MAX_BYTES", str(16 * 1024 * 1024)))  # Rotated to <file>.1 past this size
+DEAD_LETTER_MAX_SEEN = 100_000  # Record hashes remembered for deduplication
+
+NUMBER = (int, float)
+TEXT = str
+ID = (int, str)
+OBJECT = dict
+
+# Fields each source's transform reads: dotted path -> accepted types; a path ending in "?" is only checked when present
+SCHEMAS = {
+    "products": {"id": ID, "title": TEXT, "category": TEXT, "price": NUMBER},
+    "users": {
+        "login.uuid": TEXT, "login.username": TEXT, "login.password": TEXT,
+        "name.first": TEXT, "name.last": TEXT, "location": OBJECT, "dob.date": TEXT
+    },
+    "transactions": {
+        "id": ID, "parcel_id?": ID, "status?": TEXT, "sender?": TEXT, "user_name?": TEXT, "user_phone?": TEXT
+    }
+}
+
+RECORDS_DEAD_LETTERED = REGISTRY.counter("records_dead_lettered_total", "Invalid source records written to the dead-letter file.")
+DEAD_LETTER_ERRORS = REGISTRY.counter("dead_letter_write_errors_total", "Dead letters that could not be written.")
+
+# Hash of a raw record's content
+def content_hash(record):
+    encoded = json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=repr).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+# Turn a schema into a validator
+def compile_schema(schema):
+    """Returns `validate(record)`, which gives the first problem of a record as a short reason, or None.
+
+    Paths are split and type tuples resolved once here, so checking a record is a few
+    dict lookups and isinstance calls per field.
+    """
+    checks = []
+    missing = object()
+    for path, types in schema.items():
+        types = types if isinstance(types, tuple) else (types,)
+        optional = path.endswith("?")
+        path = path.rstrip("?")
+        checks.append((path, tuple(path.split(".")), types, int in types or float in types, optional))
+
+    def validate(record):
+        if not isinstance(record, dict):
+            return "not an object"
+        for path, parts, types, numeric, optional in checks:
+            value = record
+            for part in parts:
+                if not isinstance(value, dict) or part not in value:
+                    value = missing
+                    break
+                value = value[part]
+            if value is missing:
+                if optional:
+                    continue
+                return f"missing {path}"
+            if not isinstance(value, types) or (numeric and isinstance(value, bool)):
+                return f"invalid {path}"
+        return None
+
+    return validate
+
+VALIDATORS = {source: compile_schema(schema) for source, schema in SCHEMAS.items()}
+
+# Dead-letter file with per source and reason counts
+class DeadLetters:
+    """Writes each distinct invalid record once and counts the invalid records of the latest run.
+
+    A record already in the file (same source and content hash) is counted but not written
+    again, so refreshing an unchanged source does not grow the file. `counts` of a source
+    start over with every full run of it (`start_run`); streamed records add to the current
+    run. The file is rotated to `<path>.1` once it passes `max_bytes`.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or DEAD_LETTER_FILE
+        self.max_bytes = max_bytes or DEAD_LETTER_MAX_BYTES
+        self.counts = {}  # source -> {reason: count} of the latest run
+        self._seen = None  # (source, hash) already in the file, loaded on first use
+        self._file = None
+        self._failing = False
+        self._lock = threading.Lock()
+
+    def start_run(self, source):
+        with self._lock:
+            self.counts[source] = {}
+
+    def load_seen(self):
+        """Hashes of the records already in the file."""
+        seen = set()
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        seen.add((entry["source"], entry.get("hash") or content_hash(entry["record"])))
+                    except (ValueError, KeyError, TypeError):
+                        continue  # A line cut short by a crash
+        except FileNotFoundError:
+            pass
+        return seen
+
+    def write(self, line):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        elif self._file.tell() >= self.max_bytes:
+            self._file.close()
+            self._file = None
+            os.replace(self.path, self.path + ".1")
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(line)
+        self._file.flush()
+
+    def add(self, source, reason, record):
+        digest = content_hash(record)
+        with self._lock:
+            reasons = self.counts.setdefault(source, {})
+            reasons[reason] = reasons.get(reason, 0) + 1
+            if self._seen is None:
+                self._seen = self.load_seen()
+            if (source, digest) in self._seen:
+                return
+            if len(self._seen) >= DEAD_LETTER_MAX_SEEN:
+                self._seen.clear()  # Bounded memory; a record may then be written once more
+            try:
+                self.write(json.dumps({"source": source, "reason": reason, "at": time.time(), "hash": digest, "record": record},
+                                      ensure_ascii=False, default=repr) + "\n")
+                self._seen.add((source, digest))
+                self._failing = False
+            except Exception as e:
+                DEAD_LETTER_ERRORS.inc()
+                if not self._failing:  # Once per failure streak, not once per record
+                    print(f"Error writing dead letter: {e}")
+                self._failing = True
+                return
+        RECORDS_DEAD_LETTERED.inc(source=source, reason=reason)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+DEAD_LETTERS = DeadLetters()
+
+# Keep the valid records of a source, dead-lettering the rest
+def validated(source, records, dead_letters=None, new_run=True):
+    """Lazily yields the records of `source` that pass its validator.
+
+    With `new_run` the dead-letter counts of `source` start over once iteration begins;
+    streaming passes False so its records add to the latest run.
+    """
+    validate = VALIDATORS[source]
+    dead_letters = dead_letters or DEAD_LETTERS
+    if new_run:
+        dead_letters.start_run(source)
+    for record in records:
+        reason = validate(record)
+        if reason is None:
+            yield record
+        else:
+            dead_letters.add(source, reason, record)
@@ -0,0 +1,204 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timezone
+
+# Bucket widths and how many buckets of each are kept (24 hours of minutes, 14 days of hours, 90 days)
+GRANULARITIES = {"minute": (60, 1440), "hour": (3600, 336), "day": (86400, 90)}
+WINDOW_UNITS = {"m": 60, "h": 3600, "d": 86400}
+MIN_SLIDING_BUCKETS = 24  # Sliding windows use the coarsest buckets that still split them this finely
+
+# Transaction fields counted per bucket
+DIMENSIONS = {
+    "status": lambda t: t["data"].get("status", "Unknown"),
+    "sender": lambda t: t["data"].get("sender", "Unknown"),
+    "user": lambda t: t["data"].get("user_name", "Unknown")
+}
+
+# Parse a window such as "15m", "1h" or "7d"
+def parse_window(window):
+    """Returns the window length in seconds."""
+    try:
+        amount, unit = int(window[:-1]), WINDOW_UNITS[window[-1:]]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid window '{window}', use a number followed by one of {sorted(WINDOW_UNITS)} (e.g. 1h)")
+    if amount <= 0:
+        raise ValueError("window must be positive")
+    return amount * unit
+
+# Records of one batch share their timestamp string, so parsed values are cached
+_epochs = {}
+
+def event_time(record):
+    """Epoch seconds of a record's (naive UTC) timestamp."""
+    timestamp = record["timestamp"]
+    epoch = _epochs.get(timestamp)
+    if epoch is None:
+        if len(_epochs) > 4096:
+            _epochs.clear()
+        epoch = _epochs[timestamp] = datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+    return epoch
+
+# Ring buffer of per-bucket partial aggregates
+class RingBuffer:
+    """Counts for the latest `size` buckets of `width` seconds; slot `n % size` holds bucket `n`."""
+
+    def __init__(self, width, size):
+        self.width = width
+        self.size = size
+        self.buckets = [None] * size  # [bucket number, total, {dimension: {value: count}}]
+        self.latest = None
+
+    def bucket(self, number, create=True):
+        slot = number % self.size
+        bucket = self.buckets[slot]
+        if bucket is not None and bucket[0] == number:
+            return bucket
+        if not create or (self.latest is not None and number <= self.latest - self.size):
+            return None  # Older than anything the ring still holds
+        bucket = self.buckets[slot] = [number, 0, {dimension: {} for dimension in DIMENSIONS}]
+        self.latest = number if self.latest is None else max(self.latest, number)
+        return bucket
+
+    def apply(self, epoch, values, sign):
+        bucket = self.bucket(int(epoch // self.width), create=sign > 0)
+        if bucket is None:
+            return False
+        bucket[1] += sign
+        for dimension, value in values.items():
+            counts = bucket[2][dimension]
+            count = counts.get(value, 0) + sign
+            if count > 0:
+                counts[value] = count
+            else:
+                counts.pop(value, None)
+        return True
+
+    def merge(self, first, last):
+        """Totals and counts of buckets `first` through `last`."""
+        total, counts = 0, {dimension: {} for dimension in DIMENSIONS}
+        for number in range(max(first, last - self.size + 1), last + 1):
+            bucket = self.buckets[number % self.size]
+            if bucket is None or bucket[0] != number:
+                continue
+            total += bucket[1]
+            for dimension, bucket_counts in bucket[2].items():
+                merged = counts[dimension]
+                for value, count in bucket_counts.items():
+                    merged[value] = merged.get(value, 0) + count
+        return total, counts
+
+NO_EVENT_TIME = ("Transactions fetched from the source carry no event time (every record of a run shares its batch timestamp), "
+                 "so time windows are only kept for streamed transactions; set STREAM_SOURCE to enable them")
+
+# Windowed transaction counts
+class TransactionWindows:
+    """Transaction counts by status, sender and user over tumbling and sliding time windows.
+
+    Every added or removed transaction updates one bucket per granularity in O(1); queries
+    merge the buckets a window spans and never look at the transactions themselves.
+    Transactions are keyed on their timestamp, which is only an event time for streamed
+    transactions (their arrival); with `event_times` False queries raise ValueError rather
+    than return a histogram of pipeline runs.
+    """
+
+    def __init__(self, transactions=(), event_times=False):
+        self.rings = {name: RingBuffer(width, size) for name, (width, size) in GRANULARITIES.items()}
+        self.event_times = event_times
+        self.dropped = 0  # Transactions older than every ring
+        self._lock = threading.Lock()
+        for transaction in transactions:
+            self.add(transaction)
+
+    def _apply(self, transaction, sign):
+        if not transaction:
+            return  # Failed transforms
+        epoch = event_time(transaction)
+        values = {dimension: value(transaction) for dimension, value in DIMENSIONS.items()}
+        with self._lock:
+            kept = [ring.apply(epoch, values, sign) for ring in self.rings.values()]
+            if sign > 0 and not any(kept):
+                self.dropped += 1
+
+    def to_dict(self):
+        """JSON-serializable state of the rings, restored by `from_dict`."""
+        with self._lock:
+            rings = {name: [bucket for bucket in ring.buckets if bucket is not None] for name, ring in self.rings.items()}
+            return {"event_times": self.event_times, "dropped": self.dropped, "rings": rings}
+
+    @classmethod
+    def from_dict(cls, state):
+        windows = cls(event_times=state.get("event_times", False))
+        windows.dropped = state.get("dropped", 0)
+        for name, buckets in state.get("rings", {}).items():
+            ring = windows.rings.get(name)
+            if ring is None:
+                continue  # Granularity no longer configured
+            for number, total, counts in sorted(buckets, key=lambda bucket: bucket[0]):
+                ring.buckets[number % ring.size] = [number, total, counts]
+                ring.latest = number if ring.latest is None else max(ring.latest, number)
+        return windows
+
+    def copy(self):
+        """Independent copy, so a published snapshot never sees later deltas."""
+        windows = TransactionWindows(event_times=self.event_times)
+        with self._lock:
+            windows.dropped = self.dropped
+            for name, ring in self.rings.items():
+                copied = windows.rings[name]
+                copied.latest = ring.latest
+                copied.buckets = [None if bucket is None else [bucket[0], bucket[1], {d: dict(c) for d, c in bucket[2].items()}]
+                                  for bucket in ring.buckets]
+        return windows
+
+    def add(self, transaction):
+        self._apply(transaction, 1)
+
+    def remove(self, transaction):
+        self._apply(transaction, -1)
+
+    def _ring_for(self, window, sliding):
+        """Coarsest ring whose buckets divide the window (finely enough for a sliding one) and that still covers it."""
+        candidates = [ring for ring in self.rings.values() if window % ring.width == 0 and window <= ring.width * ring.size]
+        if sliding:
+            candidates = [ring for ring in candidates if window // ring.width >= MIN_SLIDING_BUCKETS] or candidates[:1]
+        if not candidates:
+            raise ValueError("window is longer than the retained history or not a whole number of minutes")
+        return max(candidates, key=lambda ring: ring.width)
+
+    def sliding(self, window, now=None, top=10):
+        """Counts over the `window` seconds up to `now`, to the precision of one bucket."""
+        if not self.event_times:
+            raise ValueError(NO_EVENT_TIME)
+        now = time.time() if now is None else now
+        ring = self._ring_for(window, sliding=True)
+        last = int(now // ring.width)
+        first = last - window // ring.width + 1
+        with self._lock:
+            total, counts = ring.merge(first, last)
+        return window_result(first * ring.width, now, total, counts, top)
+
+    def tumbling(self, window, count=1, now=None, top=10):
+        """Counts for the last `count` epoch-aligned windows of `window` seconds, oldest first."""
+        if not self.event_times:
+            raise ValueError(NO_EVENT_TIME)
+        now = time.time() if now is None else now
+        ring = self._ring_for(window, sliding=False)
+        per_window = window // ring.width
+        count = max(1, min(count, ring.size // per_window))
+        current = int(now // window)
+        results = []
+        with self._lock:
+            for index in range(current - count + 1, current + 1):
+                first = index * window // ring.width
+                total, counts = ring.merge(first, first + per_window - 1)
+                results.append(window_result(index * window, (index + 1) * window, total, counts, top))
+        return results
+
+# JSON shape of one window
+def window_result(start, end, total, counts, top):
+    iso = lambda epoch: datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None).isoformat()
+    result = {"start": iso(start), "end": iso(end), "total": total}
+    for dimension, dimension_counts in counts.items():
+        result[f"by_{dimension}"] = dict(heapq.nlargest(top, dimension_counts.items(), key=lambda x: x[1]))
+    return result